@@ -8,7 +8,8 @@ pip install -r requirements.txt
 # Convert static asset files
 python manage.py collectstatic --no-input
 
-python manage.py makemigrations
-
 # Apply any outstanding database migrations
 python manage.py migrate
+
+# Sitemaps and product feed, written to the feeds storage and served from there by the feed_file view
+python manage.py build_product_feeds
@@ -12,5 +12,12 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'hana.settings')
+# No persistent DB connections in the ASGI web process, see DATABASE_CONN_MAX_AGE in settings
+os.environ.setdefault('DATABASE_CONN_MAX_AGE', '0')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Imported after setup, it needs the app registry
+from sho.streams import with_stock_streams  # noqa: E402
+
+application = with_stock_streams(django_application)
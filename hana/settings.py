@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 import os
+import sys
 import dj_database_url
 from pathlib import Path
 
@@ -35,8 +36,6 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
-    'boto3',
-   
 ]
 
 INSTALLED_APPS += ['storages']
@@ -52,15 +51,28 @@ AWS_S3_CUSTOM_DOMAIN = f'{AWS_STORAGE_BUCKET_NAME}.s3.amazonaws.com'
 
 STORAGES = {
     "default": {
-        "BACKEND": "storages.backends.s3boto3.S3Boto3Storage",
+        "BACKEND": "sho.s3storage.CachedURLS3Storage",
     },
+    # Minified, content-hashed static files with .gz and .br copies, see sho.staticstorage
     "staticfiles": {
-        "BACKEND": "whitenoise.storage.CompressedStaticFilesStorage",
+        "BACKEND": "sho.staticstorage.StaticStorage",
     },
 }
 
+# Offload mode: uploads land on local disk, the request returns, and a background thread pushes them to S3.
+# Local files are served from MEDIA_OFFLOAD_URL until the S3 copy is confirmed.
+MEDIA_OFFLOAD_UPLOADS = os.environ.get("MEDIA_OFFLOAD_UPLOADS", "False") == "True"
+MEDIA_OFFLOAD_ROOT = os.environ.get("MEDIA_OFFLOAD_ROOT", os.path.join(BASE_DIR, 'media_staging'))
+MEDIA_OFFLOAD_URL = '/media-staged/'
 
-DEFAULT_FILE_STORAGE = 'storages.backends.s3boto3.S3Boto3Storage'
+if MEDIA_OFFLOAD_UPLOADS:
+    STORAGES["default"] = {
+        "BACKEND": "sho.storage.OffloadedStorage",
+        "OPTIONS": {"remote_backend": "sho.s3storage.CachedURLS3Storage"},
+    }
+
+
+DEFAULT_FILE_STORAGE = 'sho.s3storage.CachedURLS3Storage'
 
 MEDIA_URL = f'https://{AWS_S3_CUSTOM_DOMAIN}/'
 
@@ -68,23 +80,56 @@ MEDIA_URL = f'https://{AWS_S3_CUSTOM_DOMAIN}/'
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
+    'sho.middleware.AdmissionControlMiddleware',
+    'sho.middleware.ReplicaRoutingMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'sho.middleware.ThrottleMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
-
-# Use WhiteNoise’s non-manifest storage to avoid missing-file errors
-STATICFILES_STORAGE = 'whitenoise.storage.CompressedStaticFilesStorage'
+# Requests in flight per web process before a class of request gets a 503. Browsing is shed first,
+# the gap up to the checkout limit is left for place-order and the Razorpay callbacks.
+ADMISSION_LIMITS = {
+    'browse': int(os.environ.get("ADMISSION_BROWSE_LIMIT", "32")),
+    'checkout': int(os.environ.get("ADMISSION_CHECKOUT_LIMIT", "48")),
+}
+# (requests, seconds) per user, or per IP when logged out, keyed by URL name
+THROTTLE_RATES = {
+    'login': (10, 60),
+    'ajax_update_cart_quantity': (60, 60),
+    'get_stock_quantity_of_product': (120, 60),
+    'add_to_wishlist': (30, 60),
+}
+# Only form submissions count on these, a GET just renders the form (and a failed login re-renders it)
+THROTTLE_POST_ONLY = {'login'}
+# Proxies in front of the app that append to X-Forwarded-For (1 on Heroku), 0 trusts REMOTE_ADDR
+TRUSTED_PROXY_COUNT = int(os.environ.get("TRUSTED_PROXY_COUNT", "0"))
 
 # STATIC FILES
 STATIC_URL = '/static/'                        
 STATICFILES_DIRS = [os.path.join(BASE_DIR, 'sho', 'static')]  
 STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles') 
 
+# Sitemaps and the product feed, written by build_product_feeds (release phase and cron) and served
+# by sho.views.feed_file. They are kept in S3 so every web dyno serves the same files; set FEED_ROOT
+# to keep them on local disk instead.
+FEED_ROOT = os.environ.get("FEED_ROOT")
+STORAGES["feeds"] = {
+    "BACKEND": "storages.backends.s3boto3.S3Boto3Storage",
+    "OPTIONS": {"location": "feeds", "file_overwrite": True},
+}
+if FEED_ROOT:
+    STORAGES["feeds"] = {
+        "BACKEND": "django.core.files.storage.FileSystemStorage",
+        "OPTIONS": {"location": FEED_ROOT, "allow_overwrite": True},
+    }
+# Absolute links in sitemaps and feeds
+SITE_URL = os.environ.get("SITE_URL", "http://localhost:8000")
+
 
 ROOT_URLCONF = 'hana.urls'
 
@@ -116,14 +161,46 @@ DATABASES = {
     }
 }
 
+DATABASE_URL = os.environ.get("DATABASE_URL", "")
+DATABASE_REPLICA_URL = os.environ.get("DATABASE_REPLICA_URL")
+# Persistent connections for the worker, mailer and commands. hana.asgi sets this to 0: under ASGI
+# Django only closes connections at request start and end, from whichever executor thread runs
+# them, so a kept-alive connection leaks per thread (Django ticket #33497).
+DATABASE_CONN_MAX_AGE = int(os.environ.get("DATABASE_CONN_MAX_AGE", "600"))
+
+# SSL only applies to Postgres, this lets tests run against local SQLite files
 DATABASES = {
     "default": dj_database_url.config(
-        default=os.environ.get("DATABASE_URL"),
-        conn_max_age=600,
-        ssl_require=True
+        default=DATABASE_URL,
+        conn_max_age=DATABASE_CONN_MAX_AGE,
+        ssl_require=DATABASE_URL.startswith("postgres")
     )
 }
 
+# Catalog and order history reads go to the replica when one is configured, see sho.routers
+if DATABASE_REPLICA_URL:
+    DATABASES["replica"] = dj_database_url.parse(
+        DATABASE_REPLICA_URL,
+        conn_max_age=DATABASE_CONN_MAX_AGE,
+        ssl_require=DATABASE_REPLICA_URL.startswith("postgres")
+    )
+
+# manage.py test without a replica: a second, independent test database stands in for it, so the
+# routing tests run everywhere. TEST MIRROR would make it the primary's, and the tests tell the
+# two apart by rows only one of them has.
+elif sys.argv[1:2] == ["test"] and DATABASES["default"]:
+    DATABASES["replica"] = {
+        **DATABASES["default"],
+        # SQLite test databases are in memory and per alias, a server needs a name of its own
+        "TEST": {} if DATABASES["default"]["ENGINE"].endswith("sqlite3") else {
+            "NAME": f"test_{DATABASES['default']['NAME']}_replica",
+        },
+    }
+
+DATABASE_ROUTERS = ['sho.routers.ReplicaRouter']
+# After a write, the user's reads stay on the primary for this long (must exceed the replica lag)
+REPLICA_STICKY_SECONDS = int(os.environ.get("REPLICA_STICKY_SECONDS", "10"))
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -164,10 +241,23 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 LOGIN_REDIRECT_URL = '/'
 
+# ModelBackend stays listed so sessions created before the switch stay logged in
+AUTHENTICATION_BACKENDS = [
+    'sho.backends.ProfileModelBackend',
+    'django.contrib.auth.backends.ModelBackend',
+]
+
 RAZORPAY_KEY_ID = 'rzp_test_iG0SjtY7Ls5zyP'
 RAZORPAY_KEY_SECRET = 'ppkv4BvBy4qcNZUsRAxTCD2E'
-
-EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
+RAZORPAY_WEBHOOK_SECRET = os.environ.get("RAZORPAY_WEBHOOK_SECRET", "")
+# 'fake' swaps the Razorpay client for the in-memory sho.fakegateway.FakeRazorpay (tests, load tests)
+PAYMENT_GATEWAY = os.environ.get("PAYMENT_GATEWAY", "razorpay")
+
+# Web processes only queue mail in the outbox table; send_outbox delivers it over OUTBOX_DELIVERY_BACKEND
+EMAIL_BACKEND = 'sho.mail.OutboxEmailBackend'
+OUTBOX_DELIVERY_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
+OUTBOX_BATCH_SIZE = 50
+OUTBOX_MAX_PER_MINUTE = 20
 EMAIL_HOST = 'smtp.gmail.com'
 EMAIL_PORT = 587
 EMAIL_USE_TLS = True
@@ -1,10 +1,18 @@
 from django.contrib import admin
+from django.db.models import Sum
+from django.utils import timezone
 from django.utils.html import format_html
 import nested_admin
 from .models import (
     Category, Product, ProductColor, ProductImage, ProductReview,
-    Order, OrderItem, Profile, Wishlist, WishlistItem
+    Order, OrderItem, Profile, Wishlist, WishlistItem, SalesRollup,
+    SaleCampaign, PointsEntry, PendingUpload, Task, OutboxEmail, DeliveryZone,
+    ProductRecommendation, ProductRanking, ArchivedOrder, ArchivedOrderItem
 )
+from .campaigns import apply_campaign, revert_campaign
+from .exports import streaming_export_response
+from .rollups import MEASURES
+from .points import points_balance
 
 # --- CATEGORY ---
 admin.site.register(Category)
@@ -29,7 +37,8 @@ class ProductColorNestedInline(nested_admin.NestedTabularInline):
 @admin.register(Product)
 class ProductAdmin(nested_admin.NestedModelAdmin):
     inlines = [ProductColorNestedInline]
-    list_display = ['name', 'category', 'price', 'discount']
+    list_display = ['name', 'category', 'price', 'discount', 'review_count']
+    readonly_fields = ['review_count']
 
 # --- SIMPLE ADMIN FOR OTHER MODELS ---
 @admin.register(ProductColor)
@@ -53,7 +62,53 @@ class ProductReviewAdmin(admin.ModelAdmin):
 
 @admin.register(Profile)
 class ProfileAdmin(admin.ModelAdmin):
-    list_display = ['user', 'loyaltypoints', 'first_order_offer_used']
+    list_display = ['user', 'loyalty_points', 'first_order_offer_used']
+
+    def loyalty_points(self, obj):
+        return points_balance(obj.user)
+    loyalty_points.short_description = "Loyalty points"
+
+@admin.register(PointsEntry)
+class PointsEntryAdmin(admin.ModelAdmin):
+    list_display = ['user', 'kind', 'points', 'order', 'created_at']
+    list_filter = ['kind', 'created_at']
+    search_fields = ['user__username']
+    raw_id_fields = ['user', 'order']
+
+    # The ledger is append-only, corrections are new Adjust entries
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+# --- SALE CAMPAIGNS ---
+@admin.register(SaleCampaign)
+class SaleCampaignAdmin(admin.ModelAdmin):
+    list_display = ['name', 'discount', 'starts_at', 'ends_at', 'status']
+    list_filter = ['status']
+    filter_horizontal = ['categories', 'products']
+    readonly_fields = ['status', 'applied_at', 'reverted_at']
+    actions = ['apply_now', 'revert_now']
+
+    def apply_now(self, request, queryset):
+        for campaign in queryset.filter(status='Scheduled'):
+            count = apply_campaign(campaign)
+            self.message_user(request, f"{campaign.name}: discounted {count} product(s).")
+    apply_now.short_description = "Apply selected campaigns now"
+
+    def revert_now(self, request, queryset):
+        for campaign in queryset.filter(status='Active'):
+            count = revert_campaign(campaign)
+            self.message_user(request, f"{campaign.name}: restored {count} product(s).")
+    revert_now.short_description = "Revert selected campaigns now"
+
+# --- DELIVERY ---
+@admin.register(DeliveryZone)
+class DeliveryZoneAdmin(admin.ModelAdmin):
+    list_display = ['name', 'pincode_from', 'pincode_to', 'charge', 'serviceable']
+    list_filter = ['serviceable']
+    search_fields = ['name']
 
 # --- ORDER ---
 class OrderItemInline(admin.TabularInline):
@@ -64,7 +119,38 @@ class OrderItemInline(admin.TabularInline):
 class OrderAdmin(admin.ModelAdmin):
     list_display = ['id', 'user', 'total', 'status', 'created_at']
     list_filter = ['status', 'created_at']
+    search_fields = ['razorpay_order_id', 'razorpay_payment_id']
     inlines = [OrderItemInline]
+    actions = ['export_as_csv', 'export_as_jsonl']
+
+    # The queryset already carries the changelist filters (status, created_at date range)
+    def export_as_csv(self, request, queryset):
+        return streaming_export_response(request, queryset, 'csv')
+    export_as_csv.short_description = "Export selected orders as CSV"
+
+    def export_as_jsonl(self, request, queryset):
+        return streaming_export_response(request, queryset, 'jsonl')
+    export_as_jsonl.short_description = "Export selected orders as JSONL"
+
+class ArchivedOrderItemInline(admin.TabularInline):
+    model = ArchivedOrderItem
+    extra = 0
+    can_delete = False
+    readonly_fields = ['product', 'color', 'price', 'quantity']
+
+@admin.register(ArchivedOrder)
+class ArchivedOrderAdmin(admin.ModelAdmin):
+    list_display = ['id', 'user', 'total', 'status', 'created_at', 'archived_at']
+    list_filter = ['status', 'created_at']
+    search_fields = ['id', 'user__username']
+    inlines = [ArchivedOrderItemInline]
+
+    # Written only by the order_lifecycle command
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
 
 # --- WISHLIST ---
 class WishlistItemInline(admin.TabularInline):
@@ -75,3 +161,104 @@ class WishlistItemInline(admin.TabularInline):
 class WishlistAdmin(admin.ModelAdmin):
     list_display = ['user']
     inlines = [WishlistItemInline]
+
+# --- SALES DASHBOARD ---
+@admin.register(SalesRollup)
+class SalesRollupAdmin(admin.ModelAdmin):
+    list_display = ['bucket', 'period', 'category', 'product', 'color', 'units', 'revenue', 'discounts', 'redeemed_points', 'delivery_charges']
+    list_filter = ['period', 'category']
+    list_select_related = ['category', 'product', 'color']
+    date_hierarchy = 'bucket'
+    change_list_template = 'admin/sho/salesrollup/dashboard.html'
+
+    # Rollups are written by the build_sales_rollups command only
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def changelist_view(self, request, extra_context=None):
+        response = super().changelist_view(request, extra_context)
+        try:
+            rollups = response.context_data['cl'].queryset
+        except (AttributeError, KeyError):
+            return response
+
+        # Hourly and daily rows hold the same sales, only sum one of them
+        period = request.GET.get('period__exact', 'day')
+        rollups = rollups.filter(period=period).order_by()
+        totals = {f'total_{name}': Sum(name) for name in MEASURES}
+
+        response.context_data.update({
+            'period': period,
+            'summary': rollups.aggregate(**totals),
+            'by_bucket': rollups.values('bucket').annotate(**totals).order_by('-bucket')[:48],
+            'by_category': rollups.values('category__name').annotate(**totals).order_by('-total_revenue'),
+            'by_product': rollups.values('product__name').annotate(**totals).order_by('-total_revenue')[:20],
+            'by_color': rollups.values('product__name', 'color__color').annotate(**totals).order_by('-total_revenue')[:20],
+        })
+        return response
+
+# --- MEDIA OFFLOAD ---
+@admin.register(PendingUpload)
+class PendingUploadAdmin(admin.ModelAdmin):
+    list_display = ['name', 'host', 'attempts', 'next_attempt_at', 'created_at', 'last_error']
+    readonly_fields = ['name', 'host', 'attempts', 'next_attempt_at', 'created_at', 'last_error']
+
+    def has_add_permission(self, request):
+        return False
+
+# --- TASK QUEUE ---
+@admin.register(Task)
+class TaskAdmin(admin.ModelAdmin):
+    list_display = ['id', 'name', 'status', 'attempts', 'run_at', 'finished_at']
+    list_filter = ['status', 'name']
+    readonly_fields = ['locked_at', 'locked_by', 'last_error', 'created_at', 'finished_at']
+    actions = ['retry_now']
+
+    def retry_now(self, request, queryset):
+        count = queryset.filter(status__in=['Failed', 'Queued']).update(status='Queued', attempts=0, run_at=timezone.now())
+        self.message_user(request, f"Requeued {count} task(s).")
+    retry_now.short_description = "Retry selected tasks now"
+
+# --- EMAIL OUTBOX ---
+@admin.register(OutboxEmail)
+class OutboxEmailAdmin(admin.ModelAdmin):
+    list_display = ['subject', 'to', 'status', 'attempts', 'created_at', 'sent_at']
+    list_filter = ['status']
+    readonly_fields = ['last_error', 'created_at', 'sent_at']
+    actions = ['retry_now']
+
+    def retry_now(self, request, queryset):
+        count = queryset.filter(status__in=['Failed', 'Queued']).update(status='Queued', attempts=0, next_attempt_at=timezone.now())
+        self.message_user(request, f"Requeued {count} email(s).")
+    retry_now.short_description = "Retry selected emails now"
+
+# --- RECOMMENDATIONS ---
+@admin.register(ProductRecommendation)
+class ProductRecommendationAdmin(admin.ModelAdmin):
+    list_display = ['product', 'rank', 'recommended', 'orders_together', 'score']
+    list_select_related = ['product', 'recommended']
+    search_fields = ['product__name']
+
+    # Rebuilt wholesale by the build_recommendations command
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+@admin.register(ProductRanking)
+class ProductRankingAdmin(admin.ModelAdmin):
+    list_display = ['product', 'category', 'units_sold', 'best_seller_score', 'trending_score', 'updated_at']
+    list_filter = ['category']
+    list_select_related = ['product', 'category']
+    ordering = ['-trending_score']
+
+    # Maintained by the refresh_product_rankings command
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
@@ -0,0 +1,96 @@
+from django.db.models import Prefetch
+from django.http import JsonResponse
+from django.shortcuts import get_object_or_404
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import etag, require_safe
+
+from .catalog import (
+    CATALOG_SCOPE, catalog_version, category_scope, media_url, product_card, product_scope, product_version,
+    with_cover_image,
+)
+from .models import Category, Product, ProductColor, ProductImage
+
+# Part of every ETag, bump it when a response's shape changes so cached bodies are refetched
+API_VERSION = 1
+API_PRODUCTS_PER_PAGE = 24
+
+
+# ETags come from the catalog version counters alone. A client with the current one gets a 304
+# after a single CatalogVersion lookup, without the product tables being read.
+def version_etag(scope, version):
+    return f'"v{API_VERSION}-{scope}-{version}"'
+
+
+def categories_etag(request):
+    return version_etag(CATALOG_SCOPE, catalog_version())
+
+
+def category_products_etag(request, pk):
+    return version_etag(category_scope(pk), catalog_version(pk))
+
+
+def product_etag(request, pk):
+    return version_etag(product_scope(pk), product_version(pk))
+
+
+def api_response(data):
+    return JsonResponse(data, json_dumps_params={'separators': (',', ':')})
+
+
+@require_safe
+@cache_control(no_cache=True)
+@etag(categories_etag)
+def api_categories(request):
+    categories = Category.objects.order_by('id').values('id', 'name', 'image')
+    return api_response({
+        'categories': [dict(category, image=media_url(category['image'])) for category in categories],
+    })
+
+
+@require_safe
+@cache_control(no_cache=True)
+@etag(category_products_etag)
+def api_category_products(request, pk):
+    category = get_object_or_404(Category, pk=pk)
+    products = with_cover_image(Product.objects.filter(category=category)).order_by('id')
+    # Keyset paging, ?after=<last id of the previous page>
+    try:
+        products = products.filter(id__gt=int(request.GET.get('after', '')))
+    except ValueError:
+        pass
+    products = list(products[:API_PRODUCTS_PER_PAGE + 1])
+    has_more = len(products) > API_PRODUCTS_PER_PAGE
+    products = products[:API_PRODUCTS_PER_PAGE]
+    return api_response({
+        'category': {'id': category.id, 'name': category.name},
+        'products': [product_card(product) for product in products],
+        'next_after': products[-1].id if has_more else None,
+    })
+
+
+@require_safe
+@cache_control(no_cache=True)
+@etag(product_etag)
+def api_product(request, pk):
+    colors = ProductColor.objects.order_by('id').prefetch_related(
+        Prefetch('images', queryset=ProductImage.objects.order_by('id')),
+    )
+    product = get_object_or_404(Product.objects.select_related('category').prefetch_related(Prefetch('colors', queryset=colors)), pk=pk)
+    return api_response({
+        'id': product.id,
+        'name': product.name,
+        'category': {'id': product.category_id, 'name': product.category.name},
+        'price': int(product.price),
+        'original_price': float(product.original_price()),
+        'discount': product.discount,
+        'review_count': product.review_count,
+        'colors': [
+            {
+                'id': color.id,
+                'color': color.color,
+                'qty': color.qty,
+                'images': [media_url(image.image.name) for image in color.images.all()],
+            }
+            for color in product.colors.all()
+        ],
+    })
@@ -0,0 +1,98 @@
+from django.db import transaction
+from django.db.models import F, OuterRef, Q, Subquery
+from django.db.models.functions import Floor
+from django.utils import timezone
+
+from .catalog import bump_listing_versions
+from .models import Product, SaleCampaign, SaleCampaignItem
+
+SNAPSHOT_BATCH_SIZE = 1000
+
+
+def campaign_targets(campaign):
+    return (
+        Product.objects
+        .filter(Q(category__in=campaign.categories.all()) | Q(pk__in=campaign.products.all()))
+        # Don't stack campaigns, and skip rows whose discount can't be undone
+        .exclude(sale_items__campaign__status='Active')
+        .filter(discount__lt=100)
+        .distinct()
+    )
+
+
+def campaign_products(campaign):
+    return Product.objects.filter(pk__in=campaign.items.values('product_id'))
+
+
+def touched_products(campaign):
+    rows = list(campaign_products(campaign).values_list('pk', 'category_id'))
+    return [pk for pk, _ in rows], {category_id for _, category_id in rows}
+
+
+def apply_campaign(campaign):
+    with transaction.atomic():
+        campaign = SaleCampaign.objects.select_for_update().get(pk=campaign.pk)
+        if campaign.status != 'Scheduled':
+            return 0
+
+        snapshot = campaign_targets(campaign).values_list('pk', 'price', 'discount')
+        SaleCampaignItem.objects.bulk_create(
+            (
+                SaleCampaignItem(campaign=campaign, product_id=pk, original_price=price, original_discount=discount)
+                for pk, price, discount in snapshot.iterator(chunk_size=SNAPSHOT_BATCH_SIZE)
+            ),
+            batch_size=SNAPSHOT_BATCH_SIZE,
+        )
+
+        # Same arithmetic as Product.original_price(), done in SQL: back to the list price, then the
+        # campaign discount. a / b rounded half up is floor((2a + b) / 2b), which stays exact on SQLite,
+        # where whole-rupee prices are integers (even cast to decimal) and / truncates.
+        remaining = 100 - F('discount')
+        sale_price = Floor((2 * F('price') * (100 - campaign.discount) + remaining) / (2 * remaining))
+        updated = campaign_products(campaign).update(
+            price=sale_price, discount=campaign.discount, updated_at=timezone.now(),
+        )
+
+        campaign.status = 'Active'
+        campaign.applied_at = timezone.now()
+        campaign.save(update_fields=['status', 'applied_at'])
+
+        product_ids, category_ids = touched_products(campaign)
+        transaction.on_commit(lambda: bump_listing_versions(category_ids, product_ids))
+    return updated
+
+
+def revert_campaign(campaign):
+    with transaction.atomic():
+        campaign = SaleCampaign.objects.select_for_update().get(pk=campaign.pk)
+        if campaign.status != 'Active':
+            return 0
+
+        snapshot = campaign.items.filter(product=OuterRef('pk'))
+        updated = campaign_products(campaign).update(
+            price=Subquery(snapshot.values('original_price')[:1]),
+            discount=Subquery(snapshot.values('original_discount')[:1]),
+            updated_at=timezone.now(),
+        )
+
+        campaign.status = 'Ended'
+        campaign.reverted_at = timezone.now()
+        campaign.save(update_fields=['status', 'reverted_at'])
+
+        product_ids, category_ids = touched_products(campaign)
+        transaction.on_commit(lambda: bump_listing_versions(category_ids, product_ids))
+    return updated
+
+
+def run_due_campaigns(now=None):
+    now = now or timezone.now()
+    # Revert first so products of an ending campaign are free for one starting at the same time
+    reverted = [
+        (campaign, revert_campaign(campaign))
+        for campaign in SaleCampaign.objects.filter(status='Active', ends_at__lte=now)
+    ]
+    applied = [
+        (campaign, apply_campaign(campaign))
+        for campaign in SaleCampaign.objects.filter(status='Scheduled', starts_at__lte=now, ends_at__gt=now).order_by('starts_at')
+    ]
+    return applied, reverted
@@ -12,14 +12,16 @@ class Cart:
         if key in self.cart:
             self.cart[key]['quantity'] += quantity
         else:
+            color = product.colors.get(id=color_id)
+            first_image = color.images.first()
             self.cart[key] = {
                 'product_id': product.id,
                 'color_id': color_id,
                 'name': product.name,
-                'color_name': product.colors.get(id=color_id).color,
+                'color_name': color.color,
                 'price': int(product.price),  # Use discounted price if any
                 'quantity': quantity,
-                'image': product.colors.get(id=color_id).images.first().image.url if product.colors.get(id=color_id).images.exists() else '',
+                'image': first_image.image.url if first_image else '',
                 'total': float(product.price) * quantity
             }
         self.save()
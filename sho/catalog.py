@@ -0,0 +1,79 @@
+from django.core.files.storage import default_storage
+from django.db.models import F, OuterRef, Subquery
+
+from .models import CatalogVersion, Product, ProductImage
+
+CATALOG_SCOPE = 'catalog'
+
+
+def category_scope(category_id):
+    return f'category:{category_id}'
+
+
+def product_scope(product_id):
+    return f'product:{product_id}'
+
+
+def scope_version(scope):
+    return CatalogVersion.objects.filter(scope=scope).values_list('version', flat=True).first() or 0
+
+
+def bump_scopes(scopes):
+    CatalogVersion.objects.bulk_create([CatalogVersion(scope=scope) for scope in scopes], ignore_conflicts=True)
+    CatalogVersion.objects.filter(scope__in=scopes).update(version=F('version') + 1)
+
+
+def catalog_version(category_id=None):
+    return scope_version(category_scope(category_id) if category_id else CATALOG_SCOPE)
+
+
+def product_version(product_id):
+    return scope_version(product_scope(product_id))
+
+
+def bump_catalog_version(category_ids=()):
+    # Only for changes to categories themselves, the one scope every client of the category list shares
+    bump_scopes([CATALOG_SCOPE] + [category_scope(category_id) for category_id in set(category_ids)])
+
+
+def bump_listing_versions(category_ids=(), product_ids=()):
+    # For changes a listing card shows (name, price, discount, cover image). One UPDATE for every
+    # touched category and product, however many changed.
+    bump_scopes(
+        [category_scope(category_id) for category_id in set(category_ids)]
+        + [product_scope(product_id) for product_id in set(product_ids)]
+    )
+
+
+def bump_product_versions(product_ids):
+    # For changes only the product itself shows (stock, reviews)
+    bump_scopes([product_scope(product_id) for product_id in set(product_ids)])
+
+
+def bump_card_versions(product_ids):
+    # For card changes below the product (images), which don't carry the category
+    rows = list(Product.objects.filter(pk__in=set(product_ids)).values_list('pk', 'category_id'))
+    product_ids, category_ids = zip(*rows) if rows else ((), ())
+    bump_listing_versions(category_ids, product_ids)
+
+
+def with_cover_image(products):
+    # The first image of the product's first color that has one, in the same query as the products
+    cover = ProductImage.objects.filter(color__product=OuterRef('pk')).order_by('color_id', 'id').values('image')[:1]
+    return products.only('id', 'name', 'price', 'discount').annotate(cover_image=Subquery(cover))
+
+
+def media_url(name):
+    return default_storage.url(name) if name else None
+
+
+def product_card(product):
+    # For products from with_cover_image: what the API, the wishlist page and alert mails show
+    return {
+        'id': product.id,
+        'name': product.name,
+        'price': int(product.price),
+        'original_price': float(product.original_price()),
+        'discount': product.discount,
+        'image': media_url(product.cover_image),
+    }
@@ -0,0 +1,76 @@
+import re
+import threading
+import time
+from bisect import bisect_right
+
+from .catalog import bump_scopes, scope_version
+from .models import DeliveryZone
+
+ZONES_SCOPE = 'delivery_zones'
+# How often a process checks whether the zone table changed; lookups in between cost no query
+ZONES_CHECK_INTERVAL = 30
+
+PINCODE_RE = re.compile(r'^[1-9][0-9]{5}$')
+
+
+def parse_pincode(value):
+    value = str(value or '').strip()
+    if not PINCODE_RE.match(value):
+        return None
+    return int(value)
+
+
+class ZoneIndex:
+    def __init__(self, zones):
+        self.zones = sorted(zones, key=lambda zone: zone[0])
+        self.starts = [zone[0] for zone in self.zones]
+
+    def lookup(self, pincode):
+        i = bisect_right(self.starts, pincode) - 1
+        if i < 0:
+            return None
+        zone = self.zones[i]
+        return zone if pincode <= zone[1] else None
+
+
+class ZoneCache:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.index = None
+        self.version = None
+        self.checked_at = 0.0
+
+    def get(self):
+        now = time.monotonic()
+        if self.index is not None and now - self.checked_at < ZONES_CHECK_INTERVAL:
+            return self.index
+        with self.lock:
+            if self.index is None or now - self.checked_at >= ZONES_CHECK_INTERVAL:
+                version = scope_version(ZONES_SCOPE)
+                if self.index is None or version != self.version:
+                    zones = DeliveryZone.objects.values_list('pincode_from', 'pincode_to', 'charge', 'serviceable', 'name')
+                    self.index = ZoneIndex(list(zones))
+                    self.version = version
+                self.checked_at = now
+            return self.index
+
+    def reset(self):
+        with self.lock:
+            self.index = None
+
+
+zone_cache = ZoneCache()
+
+
+def zones_changed():
+    bump_scopes([ZONES_SCOPE])
+    zone_cache.reset()
+
+
+def delivery_quote(pincode):
+    # (serviceable, charge, zone name); unknown pincodes are not serviceable
+    zone = zone_cache.get().lookup(pincode)
+    if zone is None:
+        return False, None, None
+    pincode_from, pincode_to, charge, serviceable, name = zone
+    return serviceable, charge, name
@@ -0,0 +1,93 @@
+import hashlib
+import hmac
+import itertools
+import json
+import threading
+import time
+from types import SimpleNamespace
+
+from django.conf import settings
+
+
+class SignatureVerificationError(Exception):
+    pass
+
+
+def sign(secret, message):
+    return hmac.new(secret.encode(), message.encode() if isinstance(message, str) else message, hashlib.sha256).hexdigest()
+
+
+class FakeRazorpay:
+    # In-memory stand-in for the parts of the Razorpay client the shop uses (order.create,
+    # payment.all, utility.verify_payment_signature). Selected with PAYMENT_GATEWAY = 'fake' for
+    # tests and load tests; pay() plays the customer completing checkout.
+    def __init__(self, key_secret):
+        self.key_secret = key_secret
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+        self.orders = {}
+        self.payments = []
+        self.order = SimpleNamespace(create=self.create_order)
+        self.payment = SimpleNamespace(all=self.all_payments)
+        self.utility = SimpleNamespace(verify_payment_signature=self.verify_payment_signature)
+
+    def create_order(self, data):
+        with self.lock:
+            order = {'id': f'order_fake{next(self.ids)}', 'amount': data['amount'], 'currency': data.get('currency', 'INR'),
+                     'status': 'created', 'notes': data.get('notes', {})}
+            self.orders[order['id']] = order
+        return order
+
+    def pay(self, razorpay_order_id, amount=None):
+        with self.lock:
+            order = self.orders[razorpay_order_id]
+            payment = {
+                'id': f'pay_fake{next(self.ids)}', 'entity': 'payment', 'order_id': razorpay_order_id,
+                'amount': order['amount'] if amount is None else amount, 'currency': order['currency'],
+                'status': 'captured', 'created_at': int(time.time()),
+            }
+            order['status'] = 'paid'
+            self.payments.append(payment)
+        return payment
+
+    def all_payments(self, params=None):
+        params = params or {}
+        with self.lock:
+            payments = [
+                payment for payment in reversed(self.payments)
+                if params.get('from', 0) <= payment['created_at'] <= params.get('to', float('inf'))
+            ]
+        skip, count = params.get('skip', 0), params.get('count', 10)
+        page = payments[skip:skip + count]
+        return {'entity': 'collection', 'count': len(page), 'items': page}
+
+    def checkout_signature(self, payment):
+        return sign(self.key_secret, f"{payment['order_id']}|{payment['id']}")
+
+    def verify_payment_signature(self, params):
+        expected = sign(self.key_secret, f"{params['razorpay_order_id']}|{params['razorpay_payment_id']}")
+        if not hmac.compare_digest(expected, params.get('razorpay_signature') or ''):
+            raise SignatureVerificationError('Razorpay Signature Verification Failed')
+        return True
+
+    def webhook(self, payment, secret, event='payment.captured'):
+        body = json.dumps({'entity': 'event', 'event': event, 'payload': {'payment': {'entity': payment}}}).encode()
+        return body, sign(secret, body)
+
+
+_gateway = None
+_gateway_lock = threading.Lock()
+
+
+def fake_gateway():
+    global _gateway
+    with _gateway_lock:
+        if _gateway is None:
+            _gateway = FakeRazorpay(settings.RAZORPAY_KEY_SECRET)
+        return _gateway
+
+
+def reset_fake_gateway():
+    global _gateway
+    with _gateway_lock:
+        _gateway = None
@@ -0,0 +1,228 @@
+import codecs
+import gzip
+import json
+import shutil
+import tempfile
+from xml.sax.saxutils import escape
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage, storages
+from django.db.models import Count, F, OuterRef, Prefetch, Q, Subquery
+from django.urls import reverse
+from django.utils import timezone
+
+from .models import Product, ProductColor, ProductImage, Watermark
+
+# Products are written in shards of consecutive ids, a run only rewrites the shards with a change
+SHARD_SIZE = 1000
+CHUNK_SIZE = 500
+FEED_BRAND = 'Hana Fashion'
+FEED_WATERMARK = 'product_feeds'
+
+# Names under public/ in the feeds storage, which feed_file serves from the site root
+SITEMAP_NAME = 'sitemap.xml'
+SITEMAP_SHARD_NAME = 'sitemap-products-{}.xml'
+PRODUCT_FEED_NAME = 'feeds/products.xml'
+MANIFEST_NAME = 'manifest.json'
+
+SITEMAP_NS = 'xmlns="http://www.sitemaps.org/schemas/sitemap/0.9"'
+IMAGE_NS = 'xmlns:image="http://www.google.com/schemas/sitemap-image/1.1"'
+XML_HEADER = '<?xml version="1.0" encoding="UTF-8"?>\n'
+
+
+def feed_storage():
+    # Shared by every web process (S3), the files outlive the dyno that built them
+    return storages['feeds']
+
+
+def public_path(name):
+    return f'public/{name}'
+
+
+def part_path(shard):
+    # Each shard's feed items, joined into the one product feed on every run
+    return f'parts/products-{shard}.xml'
+
+
+def absolute_url(url):
+    return url if url.startswith(('http://', 'https://')) else settings.SITE_URL.rstrip('/') + url
+
+
+def write_file(name, chunks, compress=True):
+    with tempfile.TemporaryFile() as out:
+        for chunk in chunks:
+            out.write(chunk.encode('utf-8'))
+        save_file(name, out, compress)
+
+
+def save_file(name, content, compress=True):
+    # A storage save replaces the whole file, readers never see half of one. The .gz copy is what
+    # feed_file sends to clients that accept gzip.
+    storage = feed_storage()
+    if compress:
+        content.seek(0)
+        with tempfile.TemporaryFile() as packed:
+            with gzip.GzipFile(fileobj=packed, mode='wb') as out:
+                shutil.copyfileobj(content, out)
+            packed.seek(0)
+            storage.save(name + '.gz', File(packed))
+    content.seek(0)
+    storage.save(name, File(content))
+
+
+def remove_file(name):
+    storage = feed_storage()
+    for stored in (name, name + '.gz'):
+        storage.delete(stored)
+
+
+def shard_of():
+    return F('id') / SHARD_SIZE
+
+
+def shard_counts():
+    rows = Product.objects.annotate(shard=shard_of()).values('shard').annotate(count=Count('id')).order_by()
+    return {str(row['shard']): row['count'] for row in rows}
+
+
+def changed_shards(since):
+    changed = (
+        Product.objects
+        .filter(Q(updated_at__gte=since) | Q(colors__updated_at__gte=since))
+        .annotate(shard=shard_of())
+        .values_list('shard', flat=True)
+        .distinct()
+    )
+    return {str(shard) for shard in changed}
+
+
+def shard_products(shard):
+    first_image = ProductImage.objects.filter(color=OuterRef('pk')).order_by('id').values('image')[:1]
+    colors = ProductColor.objects.annotate(image=Subquery(first_image)).order_by('id')
+    start = int(shard) * SHARD_SIZE
+    return (
+        Product.objects
+        .filter(id__gte=start, id__lt=start + SHARD_SIZE)
+        .select_related('category')
+        .prefetch_related(Prefetch('colors', queryset=colors))
+        .order_by('id')
+        .iterator(chunk_size=CHUNK_SIZE)
+    )
+
+
+def feed_item(product, color, link):
+    title = f'{product.name} - {color.color}' if color.color else product.name
+    fields = [
+        ('g:id', color.id),
+        ('g:item_group_id', product.id),
+        ('g:title', title),
+        ('g:link', link),
+        ('g:brand', FEED_BRAND),
+        ('g:condition', 'new'),
+        ('g:product_type', product.category.name),
+        ('g:color', color.color or ''),
+        ('g:price', f'{product.original_price():.2f} INR'),
+        ('g:availability', 'in_stock' if color.qty > 0 else 'out_of_stock'),
+        ('g:sell_on_google_quantity', max(color.qty, 0)),
+    ]
+    if product.discount:
+        fields.append(('g:sale_price', f'{product.price:.2f} INR'))
+    if color.image:
+        fields.append(('g:image_link', absolute_url(default_storage.url(color.image))))
+    return '<item>' + ''.join(f'<{tag}>{escape(str(value))}</{tag}>' for tag, value in fields) + '</item>\n'
+
+
+def sitemap_entry(product, link, lastmod, images):
+    image_tags = ''.join(f'<image:image><image:loc>{escape(url)}</image:loc></image:image>' for url in images)
+    return f'<url><loc>{escape(link)}</loc><lastmod>{lastmod.isoformat()}</lastmod>{image_tags}</url>\n'
+
+
+def write_shard(shard):
+    # One pass over the shard's products writes both files, returns the shard's last change
+    lastmod = None
+    with tempfile.TemporaryFile() as sitemap, tempfile.TemporaryFile() as part:
+        sitemap.write(f'{XML_HEADER}<urlset {SITEMAP_NS} {IMAGE_NS}>\n'.encode('utf-8'))
+        for product in shard_products(shard):
+            colors = list(product.colors.all())
+            link = absolute_url(reverse('product_detail', args=[product.id]))
+            changed = max([product.updated_at] + [color.updated_at for color in colors])
+            lastmod = changed if lastmod is None else max(lastmod, changed)
+            images = [absolute_url(default_storage.url(color.image)) for color in colors if color.image]
+            sitemap.write(sitemap_entry(product, link, changed, images).encode('utf-8'))
+            for color in colors:
+                part.write(feed_item(product, color, link).encode('utf-8'))
+        sitemap.write(b'</urlset>\n')
+        save_file(public_path(SITEMAP_SHARD_NAME.format(shard)), sitemap)
+        save_file(part_path(shard), part, compress=False)
+    return lastmod
+
+
+def open_chunks(name, size=64 * 1024):
+    with feed_storage().open(name, 'rb') as src:
+        yield from codecs.iterdecode(iter(lambda: src.read(size), b''), 'utf-8')
+
+
+def sitemap_index(shards):
+    yield f'{XML_HEADER}<sitemapindex {SITEMAP_NS}>\n'
+    for shard in sorted(shards, key=int):
+        loc = absolute_url('/' + SITEMAP_SHARD_NAME.format(shard))
+        yield f"<sitemap><loc>{escape(loc)}</loc><lastmod>{shards[shard]['lastmod']}</lastmod></sitemap>\n"
+    yield '</sitemapindex>\n'
+
+
+def product_feed(shards):
+    yield (
+        f'{XML_HEADER}<rss version="2.0" xmlns:g="http://base.google.com/ns/1.0"><channel>\n'
+        f'<title>{FEED_BRAND}</title><link>{escape(absolute_url("/"))}</link>'
+        f'<description>{FEED_BRAND} products</description>\n'
+    )
+    for shard in sorted(shards, key=int):
+        yield from open_chunks(part_path(shard))
+    yield '</channel></rss>\n'
+
+
+def load_manifest():
+    try:
+        with feed_storage().open(MANIFEST_NAME, 'rb') as src:
+            return json.load(src)
+    except FileNotFoundError:
+        return {'shards': {}}
+
+
+def build_feeds(full=False):
+    # The files are in shared storage, so one scheduled run serves every web process and the
+    # watermark is kept in the database like the other incremental jobs'. The manifest next to the
+    # files records what each shard held when it was written.
+    started = timezone.now()
+    watermark, _ = Watermark.objects.get_or_create(name=FEED_WATERMARK)
+    storage = feed_storage()
+    manifest = load_manifest()
+    shards = manifest['shards']
+    counts = shard_counts()
+
+    stale = set(counts)
+    if watermark.value and not full:
+        stale = changed_shards(watermark.value)
+        stale |= {shard for shard, count in counts.items() if shards.get(shard, {}).get('products') != count}
+        stale |= {shard for shard in counts if not storage.exists(part_path(shard))}
+        # Products added since counting are picked up by the next run's count check
+        stale &= set(counts)
+    removed = set(shards) - set(counts)
+
+    for shard in stale:
+        lastmod = write_shard(shard)
+        shards[shard] = {'products': counts[shard], 'lastmod': (lastmod or started).isoformat()}
+    for shard in removed:
+        del shards[shard]
+        remove_file(public_path(SITEMAP_SHARD_NAME.format(shard)))
+        remove_file(part_path(shard))
+
+    if stale or removed or not storage.exists(public_path(SITEMAP_NAME)):
+        write_file(public_path(SITEMAP_NAME), sitemap_index(shards))
+        write_file(public_path(PRODUCT_FEED_NAME), product_feed(shards))
+    write_file(MANIFEST_NAME, [json.dumps(manifest)], compress=False)
+
+    watermark.value = started
+    watermark.save()
+    return len(stale), len(counts)
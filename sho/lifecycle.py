@@ -0,0 +1,87 @@
+import heapq
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import ArchivedOrder, ArchivedOrderItem, Order, OrderItem
+
+# A checkout that hasn't been paid for in this long is abandoned. Razorpay still confirms it if the
+# payment turns up later.
+PENDING_EXPIRY = timedelta(hours=24)
+# Orders in a final state are moved to the archive tables this long after their last change
+ARCHIVE_AFTER = timedelta(days=180)
+ARCHIVE_STATUSES = ['Delivered', 'Cancelled', 'Returned', 'Expired']
+BATCH_SIZE = 500
+
+ARCHIVED_ORDER_FIELDS = [
+    'id', 'user_id', 'razorpay_order_id', 'razorpay_payment_id', 'created_at', 'updated_at', 'total', 'status',
+    'shipping_address', 'phone', 'pincode', 'deliverycharge', 'redeemed_points',
+]
+ARCHIVED_ITEM_FIELDS = ['id', 'order_id', 'product_id', 'color_id', 'price', 'quantity']
+
+
+def id_batches(queryset, batch_size):
+    # Each batch is handled (and leaves the queryset) before the next one is read
+    while True:
+        ids = list(queryset.order_by('id').values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return
+        yield ids
+
+
+def expire_pending_orders(older_than=PENDING_EXPIRY, batch_size=BATCH_SIZE):
+    now = timezone.now()
+    stale = Order.objects.filter(status='Pending', created_at__lt=now - older_than)
+    expired = 0
+    for ids in id_batches(stale, batch_size):
+        # .update() skips auto_now, updated_at is set by hand so rollups and exports see the change
+        expired += Order.objects.filter(id__in=ids, status='Pending').update(status='Expired', updated_at=now)
+    return expired
+
+
+def archive_batch(ids, cutoff):
+    with transaction.atomic():
+        # Re-read under lock, an order may have changed since the batch was picked
+        orders = list(
+            Order.objects.select_for_update()
+            .filter(id__in=ids, status__in=ARCHIVE_STATUSES, updated_at__lt=cutoff)
+            .values(*ARCHIVED_ORDER_FIELDS)
+        )
+        ids = [order['id'] for order in orders]
+        items = OrderItem.objects.filter(order_id__in=ids).values(*ARCHIVED_ITEM_FIELDS)
+        ArchivedOrder.objects.bulk_create([ArchivedOrder(**order) for order in orders])
+        ArchivedOrderItem.objects.bulk_create([ArchivedOrderItem(**item) for item in items])
+        OrderItem.objects.filter(order_id__in=ids).delete()
+        # Points entries keep the points, their order link is cleared (SET_NULL)
+        Order.objects.filter(id__in=ids).delete()
+    return len(ids)
+
+
+def archive_orders(older_than=ARCHIVE_AFTER, batch_size=BATCH_SIZE):
+    cutoff = timezone.now() - older_than
+    done = Order.objects.filter(status__in=ARCHIVE_STATUSES, updated_at__lt=cutoff)
+    archived = 0
+    for ids in id_batches(done, batch_size):
+        archived += archive_batch(ids, cutoff)
+    return archived
+
+
+def order_history(user):
+    # Live and archived orders, newest first, each with their items
+    related = ['items__product', 'items__color']
+    orders = list(Order.objects.filter(user=user).order_by('-created_at').prefetch_related(*related))
+    orders += ArchivedOrder.objects.filter(user=user).order_by('-created_at').prefetch_related(*related)
+    return sorted(orders, key=lambda order: order.created_at, reverse=True)
+
+
+def with_archived(live, archived, key=None):
+    # Merges rows of live and archived orders, each sorted by key (unique per row), into one stream
+    # in key order. Live rows must be read first: an order archived between the two reads is then
+    # in both and taken once, never in neither.
+    key = key or (lambda row: row)
+    last = object()
+    for row in heapq.merge(live, archived, key=key):
+        if key(row) != last:
+            last = key(row)
+            yield row
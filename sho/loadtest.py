@@ -0,0 +1,251 @@
+import math
+import re
+import threading
+import time
+import uuid
+from collections import defaultdict
+from contextlib import ExitStack
+from importlib import import_module
+
+import requests
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.contrib.auth.models import User
+from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler
+from django.core.wsgi import get_wsgi_application
+from django.db import connections
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from .delivery import delivery_quote
+from .fakegateway import sign
+from .models import Category, DeliveryZone, Order, OrderItem, PointsEntry, Product, ProductColor, Task
+from .taskqueue import run_task
+
+LOADTEST_USERNAME = 'loadtest-{}'
+LOADTEST_CATEGORY = 'Load test'
+LOADTEST_PRICE = 1000
+# A pincode range of its own, so the test doesn't depend on the real delivery zones
+LOADTEST_ZONE = ('Load test', 999000, 999999)
+STEPS = ['product', 'add_to_cart', 'cart', 'place_order', 'payment']
+QUERY_COUNT_HEADER = 'X-Query-Count'
+
+# Filled in by razorpay_checkout.html for the Razorpay widget
+RAZORPAY_ORDER_RE = re.compile(r'"order_id": "([^"]+)"')
+ORDER_ID_RE = re.compile(r'order_id: "(\d+)"')
+
+
+def setup_sale(users, stock):
+    # A fresh product per run, so the audit only sees this run's orders
+    category, _ = Category.objects.get_or_create(name=LOADTEST_CATEGORY)
+    product = Product.objects.create(
+        category=category, name=f'Load test {int(time.time())}', price=LOADTEST_PRICE, after_discount_price=0,
+    )
+    color = ProductColor.objects.create(product=product, color='Load test', qty=stock)
+
+    name, pincode_from, pincode_to = LOADTEST_ZONE
+    if not delivery_quote(pincode_from)[0]:
+        DeliveryZone.objects.create(name=name, pincode_from=pincode_from, pincode_to=pincode_to, charge=0)
+
+    usernames = [LOADTEST_USERNAME.format(i) for i in range(users)]
+    existing = set(User.objects.filter(username__in=usernames).values_list('username', flat=True))
+    for username in usernames:
+        if username not in existing:
+            User.objects.create_user(username)
+    return product, color, list(User.objects.filter(username__in=usernames))
+
+
+def sale_orders(product):
+    return list(OrderItem.objects.filter(product=product).values_list('order_id', flat=True).distinct())
+
+
+def run_sale_tasks(product):
+    # Only this run's point awards, the rest of the queue is left to the workers
+    tasks = Task.objects.filter(name='order.award_points', status='Queued', payload__order_id__in=sale_orders(product))
+    processed = 0
+    for task in tasks:
+        claimed = Task.objects.filter(pk=task.pk, status='Queued').update(
+            status='Running', locked_at=timezone.now(), locked_by='loadtest', attempts=F('attempts') + 1,
+        )
+        if claimed:
+            task.refresh_from_db()
+            run_task(task)
+            processed += 1
+    return processed
+
+
+def teardown_sale(product, users):
+    # Removes what setup_sale and the checkouts made, a run leaves no shoppers, orders or stock behind
+    order_ids = sale_orders(product)
+    Task.objects.filter(name='order.award_points', payload__order_id__in=order_ids).delete()
+    Order.objects.filter(pk__in=order_ids).delete()
+    User.objects.filter(pk__in=[user.pk for user in users]).delete()
+    product.delete()
+    Category.objects.filter(name=LOADTEST_CATEGORY, products__isnull=True).delete()
+    name, pincode_from, pincode_to = LOADTEST_ZONE
+    DeliveryZone.objects.filter(name=name, pincode_from=pincode_from, pincode_to=pincode_to).delete()
+
+
+def login_session(user):
+    # Sessions are made directly, the login view is throttled per IP and every simulated user is 127.0.0.1
+    session = import_module(settings.SESSION_ENGINE).SessionStore()
+    session[SESSION_KEY] = user._meta.pk.value_to_string(user)
+    session[BACKEND_SESSION_KEY] = settings.AUTHENTICATION_BACKENDS[0]
+    session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+    session.save()
+    return session.session_key
+
+
+def end_sessions(session_keys):
+    engine = import_module(settings.SESSION_ENGINE)
+    for session_key in session_keys:
+        engine.SessionStore(session_key).delete()
+
+
+def count_queries(app):
+    # Adds the number of queries each request made as a response header
+    def counted_app(environ, start_response):
+        queries = 0
+
+        def count(execute, sql, params, many, context):
+            nonlocal queries
+            queries += 1
+            return execute(sql, params, many, context)
+
+        def counted_start_response(status, headers, exc_info=None):
+            return start_response(status, headers + [(QUERY_COUNT_HEADER, str(queries))], exc_info)
+
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(count))
+            return app(environ, counted_start_response)
+
+    return counted_app
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class LoadTestServer(ThreadedWSGIServer):
+    # Hundreds of clients connect at once, the default backlog of 10 would refuse most of them
+    request_queue_size = 1024
+
+
+def start_server():
+    server = LoadTestServer(('127.0.0.1', 0), QuietRequestHandler)
+    server.set_app(count_queries(get_wsgi_application()))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_port}'
+
+
+class Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(lambda: defaultdict(int))
+        self.queries = defaultdict(int)
+        self.completed = 0
+
+    def record(self, step, seconds, response, ok):
+        with self.lock:
+            self.latencies[step].append(seconds)
+            if not ok:
+                self.errors[step][failure_reason(response)] += 1
+            if QUERY_COUNT_HEADER in response.headers:
+                self.queries[step] += int(response.headers[QUERY_COUNT_HEADER])
+
+    def fail(self, step, error):
+        with self.lock:
+            self.errors[step][type(error).__name__] += 1
+
+    def done(self):
+        with self.lock:
+            self.completed += 1
+
+    def requests(self):
+        return sum(len(latencies) for latencies in self.latencies.values())
+
+
+def failure_reason(response):
+    # The ajax views answer 200 with {'success': False, 'error': ...}
+    if response.headers.get('Content-Type') == 'application/json':
+        try:
+            return response.json().get('error') or response.status_code
+        except ValueError:
+            pass
+    return response.status_code
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+
+def checkout(base_url, session_key, color, qty, stats):
+    # One shopper: product page, add to cart, cart, place order, pay. Stops at the first failed step.
+    http = requests.Session()
+    http.cookies.set(settings.SESSION_COOKIE_NAME, session_key)
+
+    def step(name, method, path, check, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = http.request(method, base_url + path, allow_redirects=False, timeout=60, **kwargs)
+        except requests.RequestException as error:
+            stats.fail(name, error)
+            return None
+        ok = check(response)
+        stats.record(name, time.perf_counter() - started, response, ok)
+        return response if ok else None
+
+    if not step('product', 'GET', f'/product_detail/{color.product_id}/', lambda r: r.status_code == 200):
+        return
+    csrf = {'X-CSRFToken': http.cookies.get(settings.CSRF_COOKIE_NAME, '')}
+    if not step('add_to_cart', 'POST', f'/add-to-cart/{color.product_id}/', lambda r: r.status_code == 302,
+                data={'color_id': color.id, 'qty': qty}, headers=csrf):
+        return
+    if not step('cart', 'GET', '/cart/', lambda r: r.status_code == 200):
+        return
+    placed = step(
+        'place_order', 'POST', '/place-order/', lambda r: r.status_code == 200 and RAZORPAY_ORDER_RE.search(r.text),
+        data={'address': 'Load test street', 'phone': '9999999999', 'pincode': LOADTEST_ZONE[1], 'redeem_points_in_modal': 0},
+        headers=csrf,
+    )
+    if not placed:
+        return
+
+    # Plays the Razorpay widget: a captured payment with the checkout signature the gateway would send
+    razorpay_order_id = RAZORPAY_ORDER_RE.search(placed.text).group(1)
+    payment_id = f'pay_load{uuid.uuid4().hex[:14]}'
+    paid = step('payment', 'POST', '/razorpay-success/', lambda r: r.status_code == 200 and r.json().get('success'), json={
+        'razorpay_order_id': razorpay_order_id,
+        'razorpay_payment_id': payment_id,
+        'razorpay_signature': sign(settings.RAZORPAY_KEY_SECRET, f'{razorpay_order_id}|{payment_id}'),
+        'order_id': ORDER_ID_RE.search(placed.text).group(1),
+    })
+    if paid:
+        stats.done()
+
+
+def audit(color, stock):
+    # What the database says happened, independent of what the clients saw
+    color.refresh_from_db()
+    confirmed = OrderItem.objects.filter(color=color, order__status='Confirmed')
+    sold = confirmed.aggregate(units=Sum('quantity'))['units'] or 0
+    expected_points = {
+        order_id: spent / 100
+        for order_id, spent in confirmed.values('order_id').annotate(spent=Sum(F('price') * F('quantity'))).values_list('order_id', 'spent')
+    }
+    earned = dict(
+        PointsEntry.objects.filter(order_id__in=expected_points, kind='Earn').values_list('order_id', 'points')
+    )
+    return {
+        'orders': OrderItem.objects.filter(color=color).values('order_id').distinct().count(),
+        'confirmed': len(expected_points),
+        'sold': sold,
+        'oversold': max(0, sold - stock),
+        # Decrements that were overwritten by a concurrent checkout
+        'lost_stock_updates': (stock - sold) - color.qty,
+        'lost_points': sum(1 for order_id, points in expected_points.items() if earned.get(order_id) != points),
+    }
@@ -0,0 +1,139 @@
+import smtplib
+import time
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.core.mail.backends.base import BaseEmailBackend
+from django.db import connection as db_connection, transaction
+from django.utils import timezone
+
+from .models import OutboxEmail
+
+RETRY_BACKOFF = 60  # seconds, doubled after every failed attempt
+MAX_ATTEMPTS = 5
+STALE_AFTER = timedelta(minutes=15)
+
+
+class OutboxEmailBackend(BaseEmailBackend):
+    # EMAIL_BACKEND for web processes: sending a mail is one INSERT, send_outbox does the SMTP part
+    def send_messages(self, email_messages):
+        rows = []
+        for message in email_messages:
+            if not message.recipients():
+                continue
+            if message.attachments:
+                # Attachments aren't stored in the outbox, hand those straight to the delivery backend
+                get_connection(settings.OUTBOX_DELIVERY_BACKEND, fail_silently=self.fail_silently).send_messages([message])
+                continue
+            rows.append(outbox_row(message))
+        OutboxEmail.objects.bulk_create(rows)
+        return len(rows)
+
+
+def outbox_row(message):
+    return OutboxEmail(
+        subject=message.subject,
+        body=message.body,
+        from_email=message.from_email or settings.DEFAULT_FROM_EMAIL,
+        to=list(message.to),
+        cc=list(message.cc),
+        bcc=list(message.bcc),
+        reply_to=list(message.reply_to),
+        headers=dict(message.extra_headers),
+        alternatives=[[content, mimetype] for content, mimetype in getattr(message, 'alternatives', [])],
+        next_attempt_at=timezone.now(),
+    )
+
+
+def outbox_message(row, connection):
+    message = EmailMultiAlternatives(
+        subject=row.subject,
+        body=row.body,
+        from_email=row.from_email,
+        to=row.to,
+        cc=row.cc,
+        bcc=row.bcc,
+        reply_to=row.reply_to,
+        headers=row.headers,
+        connection=connection,
+    )
+    for content, mimetype in row.alternatives:
+        message.attach_alternative(content, mimetype)
+    return message
+
+
+def is_transient(error):
+    # 4xx replies and dropped connections are worth retrying, 5xx replies are not
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(400 <= code < 500 for code, _ in error.recipients.values())
+    if isinstance(error, smtplib.SMTPResponseException):
+        return 400 <= error.smtp_code < 500
+    return isinstance(error, (smtplib.SMTPException, OSError))
+
+
+class RateLimiter:
+    def __init__(self, per_minute):
+        self.interval = 60.0 / per_minute if per_minute else 0
+        self.next_at = 0.0
+
+    def wait(self):
+        now = time.monotonic()
+        if self.next_at > now:
+            time.sleep(self.next_at - now)
+        self.next_at = max(now, self.next_at) + self.interval
+
+
+def claim_batch(batch_size):
+    now = timezone.now()
+    OutboxEmail.objects.filter(status='Sending', next_attempt_at__lt=now - STALE_AFTER).update(status='Queued')
+    # Rows are stamped with this run's token, so a row another mailer claimed first is never
+    # returned here too, even where skip_locked isn't available
+    claim = uuid.uuid4().hex
+    with transaction.atomic():
+        due = OutboxEmail.objects.filter(status='Queued', next_attempt_at__lte=now).order_by('next_attempt_at', 'id')
+        if db_connection.features.has_select_for_update_skip_locked:
+            due = due.select_for_update(skip_locked=True)
+        ids = list(due.values_list('id', flat=True)[:batch_size])
+        OutboxEmail.objects.filter(id__in=ids, status='Queued').update(status='Sending', claim=claim, next_attempt_at=now)
+    return list(OutboxEmail.objects.filter(claim=claim, status='Sending').order_by('id'))
+
+
+def retry_later(row, error):
+    row.last_error = repr(error)
+    if is_transient(error) and row.attempts < MAX_ATTEMPTS:
+        row.status = 'Queued'
+        row.next_attempt_at = timezone.now() + timedelta(seconds=RETRY_BACKOFF * 2 ** max(row.attempts - 1, 0))
+    else:
+        row.status = 'Failed'
+    row.save(update_fields=['status', 'attempts', 'last_error', 'next_attempt_at'])
+
+
+def send_batch(rows, limiter, connection=None):
+    connection = connection or get_connection(settings.OUTBOX_DELIVERY_BACKEND)
+    sent = failed = 0
+    # One connection for the whole batch instead of one per message
+    with connection:
+        for index, row in enumerate(rows):
+            limiter.wait()
+            row.attempts += 1
+            try:
+                connection.send_messages([outbox_message(row, connection)])
+            except Exception as e:
+                failed += 1
+                retry_later(row, e)
+                # The server may have dropped us, carry on with a fresh connection
+                connection.close()
+                try:
+                    connection.open()
+                except Exception as e:
+                    for pending in rows[index + 1:]:
+                        retry_later(pending, e)
+                    break
+                continue
+            sent += 1
+            row.status = 'Sent'
+            row.sent_at = timezone.now()
+            row.save(update_fields=['status', 'attempts', 'sent_at'])
+    return sent, failed
@@ -0,0 +1,51 @@
+import tempfile
+import time
+
+from django.core.files.storage import FileSystemStorage
+from django.core.management.base import BaseCommand
+from storages.backends.s3boto3 import S3Boto3Storage
+
+from sho.s3storage import CachedURLS3Storage
+from sho.storage import CachedURLFileSystemStorage
+
+# Signing happens locally in botocore, so dummy credentials are enough - no bucket or network is touched
+S3_STAND_IN = {
+    'bucket_name': 'bench-bucket',
+    'access_key': 'bench-access-key',
+    'secret_key': 'bench-secret-key',
+    'region_name': 'ap-south-1',
+    'custom_domain': None,
+    'querystring_auth': True,
+}
+
+
+class Command(BaseCommand):
+    help = "Compare image URL resolution of the plain and the URL-caching storage backends."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--backend', choices=['s3', 'filesystem'], default='s3')
+        parser.add_argument('--images', type=int, default=30, help="Image URLs per simulated page.")
+        parser.add_argument('--pages', type=int, default=200, help="Simulated page renders.")
+
+    def handle(self, *args, **options):
+        if options['backend'] == 's3':
+            plain, cached = S3Boto3Storage(**S3_STAND_IN), CachedURLS3Storage(**S3_STAND_IN)
+        else:
+            location = tempfile.mkdtemp()
+            plain = FileSystemStorage(location=location, base_url='/media/')
+            cached = CachedURLFileSystemStorage(location=location, base_url='/media/')
+
+        names = [f'product_images/bench-{i}.jpg' for i in range(options['images'])]
+        for label, storage in (('plain', plain), ('cached', cached)):
+            started = time.perf_counter()
+            for _ in range(options['pages']):
+                for name in names:
+                    storage.url(name)
+            elapsed = time.perf_counter() - started
+            per_page = elapsed / options['pages'] * 1000
+            self.stdout.write(f"{label:>7}: {elapsed:.3f}s total, {per_page:.3f} ms/page ({options['images']} URLs)")
+
+        started = time.perf_counter()
+        cached.url_cache.clear()
+        cached.urls(names)
+        self.stdout.write(f"  batch: {(time.perf_counter() - started) * 1000:.3f} ms for {len(names)} cold URLs")
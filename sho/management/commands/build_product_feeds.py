@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from sho.feeds import build_feeds
+
+
+class Command(BaseCommand):
+    help = (
+        "Incrementally rewrite the sitemaps and the product feed in the feeds storage for products changed "
+        "since the last run. Runs in the release phase, run it from cron as well."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help="Rewrite every shard.")
+
+    def handle(self, *args, **options):
+        rebuilt, shards = build_feeds(full=options['full'])
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {rebuilt} of {shards} shard(s)."))
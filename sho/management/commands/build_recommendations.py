@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from sho.recommendations import BATCH_SIZE, MIN_SUPPORT, TOP_K, build_recommendations
+
+
+class Command(BaseCommand):
+    help = "Rebuild the precomputed \"frequently bought together\" table from order history."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top-k', type=int, default=TOP_K)
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help="Orders read per batch.")
+        parser.add_argument('--min-support', type=int, default=MIN_SUPPORT, help="Minimum orders a pair must share.")
+
+    def handle(self, *args, **options):
+        products, rows = build_recommendations(options['top_k'], options['batch_size'], options['min_support'])
+        self.stdout.write(self.style.SUCCESS(f"Stored {rows} recommendation(s) for {products} product(s)."))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from sho.rollups import build_sales_rollups
+
+
+class Command(BaseCommand):
+    help = "Incrementally rebuild the hourly/daily SalesRollup rows for orders changed since the last run."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help="Drop all rollups and rebuild from every order.")
+
+    def handle(self, *args, **options):
+        days, rows = build_sales_rollups(full=options['full'])
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {len(days)} day(s), {rows} rollup row(s)."))
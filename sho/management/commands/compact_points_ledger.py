@@ -0,0 +1,18 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from sho.points import COMPACTION_AGE, compact_points
+
+
+class Command(BaseCommand):
+    help = "Fold loyalty points ledger entries older than the cutoff into the per-user PointsBalance snapshot."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than-hours', type=int, default=int(COMPACTION_AGE.total_seconds() // 3600))
+
+    def handle(self, *args, **options):
+        before = timezone.now() - timedelta(hours=options['older_than_hours'])
+        compacted = compact_points(before)
+        self.stdout.write(self.style.SUCCESS(f"Compacted points for {compacted} user(s)."))
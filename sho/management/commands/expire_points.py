@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from sho.points import expire_points
+
+
+class Command(BaseCommand):
+    help = "Write Expire entries for loyalty points that were not redeemed within POINTS_LIFETIME of being earned."
+
+    def handle(self, *args, **options):
+        expired = expire_points()
+        self.stdout.write(self.style.SUCCESS(f"Expired points for {expired} user(s)."))
@@ -0,0 +1,40 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from sho.exports import EXPORT_CHUNK_SIZE, EXPORT_FORMATS, export_lines, filter_orders
+from sho.models import ArchivedOrder, Order
+
+
+class Command(BaseCommand):
+    help = "Stream Order + OrderItem rows, archived orders included, as CSV or JSONL, filtered by date range and status."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', type=date.fromisoformat, help="First day to include (YYYY-MM-DD).")
+        parser.add_argument('--until', type=date.fromisoformat, help="Last day to include (YYYY-MM-DD).")
+        parser.add_argument('--status', action='append', dest='statuses', help="Order status, can be repeated.")
+        parser.add_argument('--format', choices=sorted(EXPORT_FORMATS), default='csv')
+        parser.add_argument('--output', help="File to write to, defaults to stdout.")
+        parser.add_argument('--chunk-size', type=int, default=EXPORT_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        if options['since'] and options['until'] and options['since'] > options['until']:
+            raise CommandError("--since must not be after --until")
+
+        valid_statuses = {value for value, _ in Order._meta.get_field('status').choices}
+        for status in options['statuses'] or []:
+            if status not in valid_statuses:
+                raise CommandError(f"Unknown status {status!r}")
+
+        filters = {'since': options['since'], 'until': options['until'], 'statuses': options['statuses']}
+        orders = filter_orders(Order.objects.all(), **filters)
+        archived = filter_orders(ArchivedOrder.objects.all(), **filters)
+        lines = export_lines(orders, options['format'], options['chunk_size'], archived)
+
+        if options['output']:
+            with open(options['output'], 'w', newline='', encoding='utf-8') as out:
+                for line in lines:
+                    out.write(line)
+        else:
+            for line in lines:
+                self.stdout.write(line, ending='')
@@ -0,0 +1,56 @@
+import csv
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from sho.delivery import parse_pincode, zones_changed
+from sho.models import DeliveryZone
+
+
+class Command(BaseCommand):
+    help = (
+        "Replace the delivery zones from a CSV with either a 'pincode' column or 'pincode_from'/'pincode_to' "
+        "columns, plus 'charge', and optional 'serviceable' (1/0) and 'name'. Adjacent pincodes with the same "
+        "charge, serviceability and name are merged into one range."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+
+    def handle(self, *args, **options):
+        rows = []
+        with open(options['path'], newline='', encoding='utf-8') as f:
+            for line, row in enumerate(csv.DictReader(f), start=2):
+                start = parse_pincode(row.get('pincode') or row.get('pincode_from'))
+                end = parse_pincode(row.get('pincode') or row.get('pincode_to'))
+                if start is None or end is None or start > end:
+                    raise CommandError(f"Line {line}: invalid pincode range")
+                try:
+                    charge = int(row['charge'])
+                except (KeyError, ValueError):
+                    raise CommandError(f"Line {line}: invalid charge")
+                serviceable = row.get('serviceable', '1').strip().lower() not in ('0', 'false', 'no')
+                rows.append((start, end, charge, serviceable, (row.get('name') or '').strip()))
+
+        rows.sort()
+        ranges = []
+        for start, end, charge, serviceable, name in rows:
+            if ranges and start <= ranges[-1][1]:
+                raise CommandError(f"Pincode range {start}-{end} overlaps {ranges[-1][0]}-{ranges[-1][1]}")
+            if ranges and ranges[-1][1] + 1 == start and ranges[-1][2:] == [charge, serviceable, name]:
+                ranges[-1][1] = end
+            else:
+                ranges.append([start, end, charge, serviceable, name])
+        # Unnamed zones are named after their merged range
+        zones = [
+            DeliveryZone(name=name or f"{start}-{end}", pincode_from=start, pincode_to=end, charge=charge, serviceable=serviceable)
+            for start, end, charge, serviceable, name in ranges
+        ]
+
+        with transaction.atomic():
+            # Plain DELETE: going through the ORM would fire a reload signal per row
+            with connection.cursor() as cursor:
+                cursor.execute(f'DELETE FROM {DeliveryZone._meta.db_table}')
+            DeliveryZone.objects.bulk_create(zones, batch_size=1000)
+            transaction.on_commit(zones_changed)
+        self.stdout.write(self.style.SUCCESS(f"Loaded {len(rows)} row(s) as {len(zones)} zone(s)."))
@@ -0,0 +1,105 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+
+import sho.tasks  # noqa: F401 - registers the handlers
+from sho.loadtest import (
+    STEPS, Stats, audit, checkout, end_sessions, login_session, percentile, run_sale_tasks, setup_sale, start_server,
+    teardown_sale,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Run concurrent shoppers through product page, cart, place-order and payment, and report "
+        "throughput, latency, queries, oversold stock and lost loyalty points."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=200, help="Simulated shoppers, one checkout each.")
+        parser.add_argument('--concurrency', type=int, default=50, help="Shoppers running at the same time.")
+        parser.add_argument('--stock', type=int, default=100, help="Units of the sale product.")
+        parser.add_argument('--qty', type=int, default=1, help="Units each shopper buys.")
+        parser.add_argument('--url', help=(
+            "Drive an already running server (started with PAYMENT_GATEWAY=fake and the same database) "
+            "instead of one in this process. Query counts are only reported in-process."
+        ))
+        parser.add_argument('--skip-tasks', action='store_true',
+                            help="Don't run this run's queued point awards before auditing loyalty points.")
+        parser.add_argument('--i-know-this-is-production', action='store_true',
+                            help="Run with DEBUG off. The sale's shoppers, orders and stock are deleted afterwards.")
+
+    def handle(self, *args, **options):
+        if not settings.DEBUG and not options['i_know_this_is_production']:
+            raise CommandError(
+                "DEBUG is off, this may be a production database. "
+                "Pass --i-know-this-is-production to run the load test anyway."
+            )
+        with override_settings(PAYMENT_GATEWAY='fake'):
+            product, color, users = setup_sale(options['users'], options['stock'])
+            try:
+                elapsed, stats, result, in_process = self.run(product, color, users, options)
+            finally:
+                teardown_sale(product, users)
+
+        self.report(stats, elapsed, result, in_process)
+
+    def run(self, product, color, users, options):
+        sessions = [login_session(user) for user in users]
+        server = None
+        base_url = options['url']
+        if not base_url:
+            server, base_url = start_server()
+        base_url = base_url.rstrip('/')
+
+        self.stdout.write(
+            f"{len(users)} shoppers, {options['concurrency']} at a time, buying {options['qty']} of "
+            f"{options['stock']} units of '{product.name}' on {base_url}"
+        )
+        stats = Stats()
+        started = time.perf_counter()
+        try:
+            with ThreadPoolExecutor(max_workers=options['concurrency']) as pool:
+                for session_key in sessions:
+                    pool.submit(checkout, base_url, session_key, color, options['qty'], stats)
+            elapsed = time.perf_counter() - started
+        finally:
+            if server:
+                server.shutdown()
+                server.server_close()
+            end_sessions(sessions)
+
+        if not options['skip_tasks']:
+            run_sale_tasks(product)
+        return elapsed, stats, audit(color, options['stock']), server is not None
+
+    def report(self, stats, elapsed, result, in_process):
+        self.stdout.write(
+            f"\nCheckouts: {stats.completed}/{result['orders']} placed orders paid in {elapsed:.1f}s, "
+            f"{stats.completed / elapsed:.1f} checkouts/s, {stats.requests() / elapsed:.1f} requests/s"
+        )
+        self.stdout.write(f"{'step':<12}{'requests':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'queries':>9}  errors")
+        for step in STEPS:
+            latencies = stats.latencies[step]
+            if not latencies:
+                continue
+            timings = ''.join(f"{percentile(latencies, p) * 1000:>9.0f}" for p in (50, 95, 99))
+            queries = f"{stats.queries[step] / len(latencies):>9.1f}" if in_process else f"{'-':>9}"
+            errors = ', '.join(f"{count}x {status}" for status, count in stats.errors[step].items())
+            self.stdout.write(f"{step:<12}{len(latencies):>9}{timings}{queries}  {errors}")
+        if in_process:
+            total = sum(stats.queries.values())
+            per_checkout = total / stats.completed if stats.completed else 0
+            self.stdout.write(f"Queries: {total} total, {per_checkout:.1f} per completed checkout")
+
+        stock_line = (
+            f"Stock: {result['sold']} units sold, {result['oversold']} oversold, "
+            f"{result['lost_stock_updates']} lost stock updates"
+        )
+        points_line = f"Points: {result['confirmed']} confirmed orders, {result['lost_points']} missing or wrong awards"
+        for line, broken in ((stock_line, result['oversold'] or result['lost_stock_updates']),
+                             (points_line, result['lost_points'])):
+            self.stdout.write(self.style.ERROR(line) if broken else self.style.SUCCESS(line))
@@ -0,0 +1,23 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from sho.lifecycle import ARCHIVE_AFTER, BATCH_SIZE, PENDING_EXPIRY, archive_orders, expire_pending_orders
+
+
+class Command(BaseCommand):
+    help = "Expire abandoned Pending orders and move old finished orders into the archive tables."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pending-hours', type=int, default=int(PENDING_EXPIRY.total_seconds() // 3600))
+        parser.add_argument('--archive-days', type=int, default=ARCHIVE_AFTER.days)
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+        parser.add_argument('--skip-archive', action='store_true', help="Only expire Pending orders.")
+
+    def handle(self, *args, **options):
+        expired = expire_pending_orders(timedelta(hours=options['pending_hours']), options['batch_size'])
+        self.stdout.write(f"Expired {expired} pending order(s).")
+        if not options['skip_archive']:
+            archived = archive_orders(timedelta(days=options['archive_days']), options['batch_size'])
+            self.stdout.write(f"Archived {archived} order(s).")
+        self.stdout.write(self.style.SUCCESS("Done."))
@@ -0,0 +1,78 @@
+import os
+import re
+import subprocess
+import sys
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Default budget for a web worker to become ready, override with --budget-ms
+STARTUP_BUDGET_MS = 1000
+
+# What a worker does before serving its first request: set up Django, build the ASGI app
+# (middleware) and load the URLconf, which imports every view module
+STARTUP_SCRIPT = """
+import time
+started = time.perf_counter()
+from hana.asgi import application
+from django.urls import get_resolver
+get_resolver().url_patterns
+print('startup_ms=%.1f' % ((time.perf_counter() - started) * 1000))
+"""
+
+IMPORTTIME_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$')
+
+
+def parse_importtime(stderr):
+    modules = []
+    for line in stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, module = match.groups()
+            modules.append((module, int(self_us), int(cumulative_us), len(indent) // 2))
+    return modules
+
+
+class Command(BaseCommand):
+    help = "Profile web worker startup with python -X importtime and fail if it is over budget."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--budget-ms', type=float, default=STARTUP_BUDGET_MS)
+        parser.add_argument('--top', type=int, default=15, help="Number of packages and modules to list.")
+        parser.add_argument('--runs', type=int, default=3, help="Startup is timed this many times, the fastest run counts.")
+
+    def run_startup(self):
+        env = {**os.environ, 'DJANGO_SETTINGS_MODULE': settings.SETTINGS_MODULE}
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', STARTUP_SCRIPT],
+            cwd=settings.BASE_DIR, env=env, capture_output=True, text=True,
+        )
+        if result.returncode:
+            raise CommandError(f"Startup failed:\n{result.stderr[-2000:]}")
+        startup_ms = float(re.search(r'startup_ms=([\d.]+)', result.stdout).group(1))
+        return startup_ms, parse_importtime(result.stderr)
+
+    def handle(self, *args, **options):
+        # Each run is a fresh interpreter, so every one pays the full import cost
+        runs = [self.run_startup() for _ in range(max(1, options['runs']))]
+        startup_ms, modules = min(runs, key=lambda run: run[0])
+
+        packages = defaultdict(int)
+        for module, self_us, _, _ in modules:
+            packages[module.split('.')[0]] += self_us
+
+        top = options['top']
+        self.stdout.write("Import time by top-level package (ms):")
+        for package, self_us in sorted(packages.items(), key=lambda item: -item[1])[:top]:
+            self.stdout.write(f"  {self_us / 1000:8.1f}  {package}")
+        self.stdout.write("Slowest imports, including their own imports (ms):")
+        top_level = [m for m in modules if m[3] == 0]
+        for module, _, cumulative_us, _ in sorted(top_level, key=lambda m: -m[2])[:top]:
+            self.stdout.write(f"  {cumulative_us / 1000:8.1f}  {module}")
+
+        budget = options['budget_ms']
+        summary = f"Startup took {startup_ms:.0f} ms (budget {budget:.0f} ms, fastest of {len(runs)} run(s))."
+        if startup_ms > budget:
+            raise CommandError(summary)
+        self.stdout.write(self.style.SUCCESS(summary))
@@ -0,0 +1,20 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from sho.taskqueue import DONE_RETENTION, FAILED_RETENTION, PURGE_BATCH_SIZE, purge_finished_tasks
+
+
+class Command(BaseCommand):
+    help = "Delete Done and Failed tasks that finished longer ago than the retention period."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--done-days', type=int, default=DONE_RETENTION.days)
+        parser.add_argument('--failed-days', type=int, default=FAILED_RETENTION.days)
+        parser.add_argument('--batch-size', type=int, default=PURGE_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        purged = purge_finished_tasks(
+            timedelta(days=options['done_days']), timedelta(days=options['failed_days']), options['batch_size'],
+        )
+        self.stdout.write(self.style.SUCCESS(f"Purged {purged} finished task(s)."))
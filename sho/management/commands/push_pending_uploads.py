@@ -0,0 +1,25 @@
+import time
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = "Push media files this host staged on local disk to the remote storage (OffloadedStorage only, run on every web host)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=100)
+        parser.add_argument('--loop', action='store_true', help="Keep running, sweeping every --interval seconds.")
+        parser.add_argument('--interval', type=int, default=30)
+
+    def handle(self, *args, **options):
+        if not hasattr(default_storage, 'push_pending'):
+            raise CommandError("The default storage is not an OffloadedStorage, set MEDIA_OFFLOAD_UPLOADS=True.")
+
+        while True:
+            results = default_storage.push_pending(options['limit'])
+            if results:
+                self.stdout.write(f"Pushed {results.count(True)} file(s), {results.count(False)} failed.")
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
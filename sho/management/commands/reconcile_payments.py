@@ -0,0 +1,20 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from sho.payments import RECONCILE_PAGE_SIZE, RECONCILE_WINDOW, reconcile_payments
+
+
+class Command(BaseCommand):
+    help = "Settle Pending/Expired orders whose payment was captured by the gateway but never confirmed here."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=int, default=int(RECONCILE_WINDOW.total_seconds() // 3600),
+                            help="How far back to page through gateway payments.")
+        parser.add_argument('--page-size', type=int, default=RECONCILE_PAGE_SIZE)
+
+    def handle(self, *args, **options):
+        since = timezone.now() - timedelta(hours=options['hours'])
+        seen, settled = reconcile_payments(since, page_size=options['page_size'])
+        self.stdout.write(self.style.SUCCESS(f"Checked {seen} payment(s), settled {settled} order(s)."))
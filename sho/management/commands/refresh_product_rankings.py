@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from sho.rankings import refresh_rankings
+
+
+class Command(BaseCommand):
+    help = "Decay the best-seller/trending scores and add the units from orders confirmed since the last run."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help="Reset every score and recount all orders.")
+
+    def handle(self, *args, **options):
+        orders = refresh_rankings(full=options['full'])
+        self.stdout.write(self.style.SUCCESS(f"Counted {orders} new order(s) into product rankings."))
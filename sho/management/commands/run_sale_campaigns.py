@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from sho.campaigns import run_due_campaigns
+
+
+class Command(BaseCommand):
+    help = "Apply sale campaigns that have started and revert the ones that have ended. Run it from cron."
+
+    def handle(self, *args, **options):
+        applied, reverted = run_due_campaigns()
+        for campaign, count in reverted:
+            self.stdout.write(f"Reverted {campaign.name}: {count} product(s)")
+        for campaign, count in applied:
+            self.stdout.write(f"Applied {campaign.name}: {count} product(s)")
+        self.stdout.write(self.style.SUCCESS(f"{len(applied)} applied, {len(reverted)} reverted."))
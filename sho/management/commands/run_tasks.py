@@ -0,0 +1,49 @@
+import signal
+import threading
+
+from django.core.management.base import BaseCommand
+
+import sho.tasks  # noqa: F401 - registers the handlers
+from sho.taskqueue import purge_finished_tasks, requeue_stale_tasks, work
+
+
+class Command(BaseCommand):
+    help = "Run background tasks from the database queue."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=2, help="Worker threads.")
+        parser.add_argument('--poll-interval', type=float, default=1.0)
+        parser.add_argument('--once', action='store_true', help="Exit when the queue is empty.")
+
+    def handle(self, *args, **options):
+        stop_event = threading.Event()
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGTERM, lambda *_: stop_event.set())
+
+        requeued = requeue_stale_tasks()
+        if requeued:
+            self.stdout.write(f"Requeued {requeued} stale task(s).")
+        # Workers restart on every deploy, between deploys the scheduler runs purge_tasks
+        purged = purge_finished_tasks()
+        if purged:
+            self.stdout.write(f"Purged {purged} finished task(s).")
+
+        results = []
+        threads = [
+            threading.Thread(
+                target=lambda: results.append(work(stop_event, options['poll_interval'], options['once'])),
+                name=f'task-worker-{i}',
+            )
+            for i in range(options['concurrency'])
+        ]
+        for thread in threads:
+            thread.start()
+        try:
+            for thread in threads:
+                while thread.is_alive():
+                    thread.join(timeout=1)
+        except KeyboardInterrupt:
+            stop_event.set()
+            for thread in threads:
+                thread.join()
+        self.stdout.write(f"Processed {sum(results)} task(s).")
@@ -0,0 +1,28 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from sho.mail import RateLimiter, claim_batch, send_batch
+
+
+class Command(BaseCommand):
+    help = "Deliver queued outbox emails in batches over a single reused connection."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=settings.OUTBOX_BATCH_SIZE)
+        parser.add_argument('--per-minute', type=int, default=settings.OUTBOX_MAX_PER_MINUTE, help="Provider send quota.")
+        parser.add_argument('--loop', action='store_true', help="Keep polling the outbox.")
+        parser.add_argument('--interval', type=int, default=10)
+
+    def handle(self, *args, **options):
+        limiter = RateLimiter(options['per_minute'])
+        while True:
+            rows = claim_batch(options['batch_size'])
+            if rows:
+                sent, failed = send_batch(rows, limiter)
+                self.stdout.write(f"Sent {sent} email(s), {failed} failed.")
+                continue
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from sho.wishlists import queue_wishlist_alerts
+
+
+class Command(BaseCommand):
+    help = (
+        "Queue mails to shoppers whose wishlisted products came back in stock or dropped in price since "
+        "the last run. Run it from cron, run_tasks writes the mails to the outbox."
+    )
+
+    def handle(self, *args, **options):
+        restocked, drops, users = queue_wishlist_alerts()
+        self.stdout.write(self.style.SUCCESS(
+            f"{restocked} restocked color(s), {drops} price drop(s): queued alerts for {users} shopper(s)."
+        ))
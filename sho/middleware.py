@@ -0,0 +1,67 @@
+import math
+
+from django.conf import settings
+from django.http import JsonResponse
+
+from .routers import RoutingState, routing_state
+from .throttle import AdmissionController, Throttle, client_key, route_class, route_name
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+PRIMARY_COOKIE = 'read_primary'
+
+
+class ReplicaRoutingMiddleware:
+    # Reads go to the replica unless this request writes, or this browser wrote within the last
+    # REPLICA_STICKY_SECONDS (longer than the replica lag), so users always see their own writes
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        pinned = request.method not in SAFE_METHODS or PRIMARY_COOKIE in request.COOKIES
+        state = RoutingState(pinned=pinned)
+        token = routing_state.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            routing_state.reset(token)
+        if state.wrote:
+            response.set_cookie(
+                PRIMARY_COOKIE, '1', max_age=settings.REPLICA_STICKY_SECONDS, httponly=True, samesite='Lax',
+            )
+        return response
+
+
+class AdmissionControlMiddleware:
+    # Sits before anything that touches the database, a shed request costs next to nothing
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.controller = AdmissionController(settings.ADMISSION_LIMITS)
+
+    def __call__(self, request):
+        if not self.controller.admit(route_class(request)):
+            response = JsonResponse({'success': False, 'error': 'We are busy right now, please try again'}, status=503)
+            response['Retry-After'] = '1'
+            return response
+        try:
+            return self.get_response(request)
+        finally:
+            self.controller.release()
+
+
+class ThrottleMiddleware:
+    # Per user (or IP when logged out) limits on the routes listed in THROTTLE_RATES. Needs
+    # request.user, so it goes after AuthenticationMiddleware.
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.throttle = Throttle(settings.THROTTLE_RATES)
+        self.post_only = set(settings.THROTTLE_POST_ONLY)
+
+    def __call__(self, request):
+        route = route_name(request)
+        if route in self.throttle.rates and (request.method == 'POST' or route not in self.post_only):
+            wait = self.throttle.wait(route, client_key(request, settings.TRUSTED_PROXY_COUNT))
+            if wait:
+                response = JsonResponse({'success': False, 'error': 'Too many requests, slow down'}, status=429)
+                response['Retry-After'] = str(math.ceil(wait))
+                return response
+        return self.get_response(request)
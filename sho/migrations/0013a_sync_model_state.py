@@ -0,0 +1,54 @@
+# Generated by Django 5.2.4 on 2026-10-19 03:38
+
+from django.db import migrations, models
+
+
+def add_missing_after_discount_price(apps, schema_editor):
+    # Production got this column from running makemigrations at release time,
+    # under a migration this repo never had, so only add it where it's missing.
+    Product = apps.get_model('sho', 'Product')
+    connection = schema_editor.connection
+    with connection.cursor() as cursor:
+        columns = {
+            column.name
+            for column in connection.introspection.get_table_description(cursor, Product._meta.db_table)
+        }
+    field = Product._meta.get_field('after_discount_price')
+    if field.column not in columns:
+        schema_editor.add_field(Product, field)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sho', '0013_wishlist_wishlistitem'),
+    ]
+
+    # Databases that applied this migration before it was renamed.
+    replaces = [
+        ('sho', '0014_sync_model_state'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AddField(
+                    model_name='product',
+                    name='after_discount_price',
+                    field=models.DecimalField(blank=True, decimal_places=0, max_digits=10, null=True),
+                ),
+            ],
+        ),
+        migrations.RunPython(add_missing_after_discount_price, migrations.RunPython.noop),
+        # Both are no-ops where the column already matches.
+        migrations.AlterField(
+            model_name='productcolor',
+            name='color',
+            field=models.CharField(blank=True, max_length=30, null=True),
+        ),
+        migrations.AlterField(
+            model_name='profile',
+            name='loyaltypoints',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 5.2.4 on 2026-10-19 03:38
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sho', '0013a_sync_model_state'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Watermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('value', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.CreateModel(
+            name='SalesRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('hour', 'Hourly'), ('day', 'Daily')], max_length=4)),
+                ('bucket', models.DateTimeField()),
+                ('units', models.PositiveIntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('discounts', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('redeemed_points', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('delivery_charges', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='sho.category')),
+                ('color', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='sho.productcolor')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='sho.product')),
+            ],
+            options={
+                'unique_together': {('period', 'bucket', 'color')},
+            },
+        ),
+    ]
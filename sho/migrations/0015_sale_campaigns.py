@@ -0,0 +1,51 @@
+# Generated by Django 5.2.4 on 2026-10-19 03:40
+
+import django.core.validators
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sho', '0014_sales_rollups'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('scope', models.CharField(max_length=30, unique=True)),
+                ('version', models.PositiveBigIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SaleCampaign',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('discount', models.PositiveIntegerField(validators=[django.core.validators.MinValueValidator(1), django.core.validators.MaxValueValidator(90)])),
+                ('starts_at', models.DateTimeField()),
+                ('ends_at', models.DateTimeField()),
+                ('status', models.CharField(choices=[('Scheduled', 'Scheduled'), ('Active', 'Active'), ('Ended', 'Ended')], default='Scheduled', max_length=10)),
+                ('applied_at', models.DateTimeField(blank=True, null=True)),
+                ('reverted_at', models.DateTimeField(blank=True, null=True)),
+                ('categories', models.ManyToManyField(blank=True, related_name='sale_campaigns', to='sho.category')),
+                ('products', models.ManyToManyField(blank=True, related_name='sale_campaigns', to='sho.product')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SaleCampaignItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('original_price', models.DecimalField(decimal_places=0, max_digits=10)),
+                ('original_discount', models.IntegerField(default=0)),
+                ('campaign', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='items', to='sho.salecampaign')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sale_items', to='sho.product')),
+            ],
+            options={
+                'unique_together': {('campaign', 'product')},
+            },
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 5.2.4 on 2026-10-19 03:41
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def open_ledger_balances(apps, schema_editor):
+    Profile = apps.get_model('sho', 'Profile')
+    PointsEntry = apps.get_model('sho', 'PointsEntry')
+    db_alias = schema_editor.connection.alias
+    PointsEntry.objects.using(db_alias).bulk_create(
+        [
+            PointsEntry(user_id=user_id, kind='Adjust', points=points)
+            for user_id, points in Profile.objects.using(db_alias).filter(loyaltypoints__gt=0).values_list('user_id', 'loyaltypoints')
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sho', '0015_sale_campaigns'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PointsBalance',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('balance', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('last_entry_id', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='points_balance', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PointsEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('Earn', 'Earn'), ('Redeem', 'Redeem'), ('Expire', 'Expire'), ('Adjust', 'Adjust')], max_length=10)),
+                ('points', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('order', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='points_entries', to='sho.order')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='points_entries', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('order', 'kind'), name='unique_points_entry_per_order')],
+            },
+        ),
+        migrations.RunPython(open_ledger_balances, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='profile',
+            name='loyaltypoints',
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.4 on 2026-10-19 03:48
+
+from django.db import migrations, models
+
+
+def seed_zones(apps, schema_editor):
+    # Same charges as the old hard-coded rule: 60 inside Tamil Nadu (6xxxxx), 90 everywhere else
+    DeliveryZone = apps.get_model('sho', 'DeliveryZone')
+    DeliveryZone.objects.using(schema_editor.connection.alias).bulk_create([
+        DeliveryZone(name='Rest of India', pincode_from=100000, pincode_to=600000, charge=90),
+        DeliveryZone(name='Tamil Nadu', pincode_from=600001, pincode_to=699998, charge=60),
+        DeliveryZone(name='Rest of India', pincode_from=699999, pincode_to=999999, charge=90),
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sho', '0019_email_outbox'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeliveryZone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('pincode_from', models.PositiveIntegerField()),
+                ('pincode_to', models.PositiveIntegerField()),
+                ('charge', models.PositiveIntegerField()),
+                ('serviceable', models.BooleanField(default=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'ordering': ['pincode_from'],
+            },
+        ),
+        migrations.RunPython(seed_zones, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 5.2.4 on 2026-10-19 03:53
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def create_rankings(apps, schema_editor):
+    # Zero-score rows for the existing products, the first refresh_product_rankings run counts their sales
+    Product = apps.get_model('sho', 'Product')
+    ProductRanking = apps.get_model('sho', 'ProductRanking')
+    db_alias = schema_editor.connection.alias
+    ProductRanking.objects.using(db_alias).bulk_create(
+        [ProductRanking(product_id=product_id, category_id=category_id)
+         for product_id, category_id in Product.objects.using(db_alias).values_list('id', 'category_id')],
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sho', '0021_product_recommendations'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='counted_in_rankings',
+            field=models.BooleanField(db_index=True, default=False),
+        ),
+        migrations.CreateModel(
+            name='ProductRanking',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('units_sold', models.PositiveIntegerField(default=0)),
+                ('best_seller_score', models.FloatField(default=0)),
+                ('trending_score', models.FloatField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rankings', to='sho.category')),
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='ranking', to='sho.product')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['category', '-best_seller_score', 'product'], name='ranking_best_seller_idx'), models.Index(fields=['category', '-trending_score', 'product'], name='ranking_trending_idx')],
+            },
+        ),
+        migrations.RunPython(create_rankings, migrations.RunPython.noop),
+    ]
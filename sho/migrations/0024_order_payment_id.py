@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-19 04:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sho', '0023_order_archive'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='razorpay_payment_id',
+            field=models.CharField(blank=True, max_length=100, null=True, unique=True),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.4 on 2026-10-19 04:05
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_reviews(apps, schema_editor):
+    Product = apps.get_model('sho', 'Product')
+    ProductReview = apps.get_model('sho', 'ProductReview')
+    counts = (
+        ProductReview.objects.filter(product=OuterRef('pk'))
+        .order_by().values('product').annotate(count=Count('id')).values('count')
+    )
+    Product.objects.using(schema_editor.connection.alias).update(review_count=Coalesce(Subquery(counts), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sho', '0024_order_payment_id'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='review_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='productreview',
+            index=models.Index(fields=['product', '-id'], name='review_product_id_idx'),
+        ),
+        migrations.RunPython(count_reviews, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 5.2.4 on 2026-10-19 04:18
+
+from django.conf import settings
+from django.db import migrations, models
+
+from sho.operations import AddIndexConcurrently
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY can't run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('sho', '0026_catalog_updated_at'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='archivedorder',
+            index=models.Index(fields=['user', '-created_at'], name='archived_user_created_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='order',
+            index=models.Index(fields=['user', 'status'], name='order_user_status_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='order',
+            index=models.Index(fields=['user', '-created_at'], name='order_user_created_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='order',
+            index=models.Index(fields=['razorpay_order_id'], name='order_razorpay_order_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='product',
+            index=models.Index(fields=['category', 'id'], name='product_category_id_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='productcolor',
+            index=models.Index(fields=['product', 'id'], name='color_product_id_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='productimage',
+            index=models.Index(fields=['color', 'id'], name='image_color_id_idx'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.4 on 2026-10-19 04:26
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sho', '0027_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ColorSnapshot',
+            fields=[
+                ('color', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='snapshot', serialize=False, to='sho.productcolor')),
+                ('qty', models.IntegerField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ProductSnapshot',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='snapshot', serialize=False, to='sho.product')),
+                ('price', models.DecimalField(decimal_places=0, max_digits=10)),
+            ],
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.4 on 2026-10-19 04:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sho', '0028_wishlist_snapshots'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pendingupload',
+            name='host',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AlterField(
+            model_name='pendingupload',
+            name='next_attempt_at',
+            field=models.DateTimeField(),
+        ),
+        migrations.AddIndex(
+            model_name='pendingupload',
+            index=models.Index(fields=['host', 'next_attempt_at'], name='upload_host_next_attempt_idx'),
+        ),
+    ]
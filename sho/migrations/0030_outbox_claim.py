@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-19 04:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sho', '0029_pending_upload_host'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='outboxemail',
+            name='claim',
+            field=models.CharField(blank=True, db_index=True, max_length=32),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.4 on 2026-10-19 05:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sho', '0032_archived_order_payment_id'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(fields=['status', 'finished_at'], name='task_status_finished_idx'),
+        ),
+    ]
@@ -1,4 +1,6 @@
 from django.db import models
+from django.core.exceptions import ValidationError
+from django.core.validators import MaxValueValidator, MinValueValidator
 from django.contrib.auth.models import User
 from decimal import Decimal, ROUND_HALF_UP
 
@@ -16,12 +18,49 @@ class Product(models.Model):
     price = models.DecimalField(max_digits=10, decimal_places=0)
     after_discount_price = models.DecimalField(max_digits=10, decimal_places=0, blank=True, null=True)
     discount = models.IntegerField(default=0)
+    # Kept current by the ProductReview signals, so the product page never counts reviews
+    review_count = models.PositiveIntegerField(default=0, editable=False)
+    # Feeds and sitemaps regenerate the products changed since their last run
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    class Meta:
+        indexes = [
+            # Category listings and the catalog API page through a category by id
+            models.Index(fields=['category', 'id'], name='product_category_id_idx'),
+        ]
+
+    # What a listing card shows. A product moved to another category changes both categories' listings.
+    TRACKED_FIELDS = ['category_id', 'name', 'price', 'discount']
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = {name: getattr(instance, name) for name in cls.TRACKED_FIELDS if name in field_names}
+        return instance
+
+    def loaded_value(self, name):
+        return getattr(self, '_loaded_values', {}).get(name)
+
+    def changed_fields(self):
+        loaded = getattr(self, '_loaded_values', None)
+        if loaded is None:
+            return list(self.TRACKED_FIELDS)
+        return [name for name, value in loaded.items() if getattr(self, name) != value]
 
     def save(self, *args, **kwargs):
         if self.after_discount_price > 0:
             self.discount = int((self.after_discount_price/self.price) * 100)
             self.price = self.after_discount_price
-        return super().save(*args, **kwargs)
+        # review_count only changes through the F() updates in the review signals, a full save of
+        # a product read earlier would write back the count it was read with
+        if not self._state.adding and not kwargs.get('force_insert') and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name != 'review_count'
+            ]
+        result = super().save(*args, **kwargs)
+        self._loaded_values = {name: getattr(self, name) for name in self.TRACKED_FIELDS}
+        return result
     
     def original_price(self):
         if self.discount:
@@ -41,6 +80,12 @@ class ProductColor(models.Model):
     product = models.ForeignKey(to=Product, related_name='colors', on_delete=models.CASCADE)
     color = models.CharField(max_length=30, blank=True, null=True)
     qty = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['product', 'id'], name='color_product_id_idx'),
+        ]
 
     def __str__(self):
         return f"{self.product.name}: {self.color}"
@@ -50,6 +95,12 @@ class ProductImage(models.Model):
     color = models.ForeignKey(to=ProductColor, related_name='images', on_delete=models.CASCADE)
     image = models.ImageField(upload_to='product_images/')
 
+    class Meta:
+        indexes = [
+            # A color's first image, shown on cards and in feeds
+            models.Index(fields=['color', 'id'], name='image_color_id_idx'),
+        ]
+
 
 class ProductReview(models.Model):
     product = models.ForeignKey(to=Product, related_name='reviews', on_delete=models.CASCADE)
@@ -58,6 +109,12 @@ class ProductReview(models.Model):
     review = models.TextField(max_length=256)
     review_image = models.ImageField(upload_to='review_images')
 
+    class Meta:
+        indexes = [
+            # Reviews are paged newest first by id within a product
+            models.Index(fields=['product', '-id'], name='review_product_id_idx'),
+        ]
+
     def __str__(self):
         return f"{self.product}-{self.review}-{self.reviewer}"
 
@@ -65,7 +122,10 @@ class ProductReview(models.Model):
 class Order(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     razorpay_order_id = models.CharField(max_length=100, blank=True, null=True)
+    # Set when the payment is settled, whichever of checkout/webhook/reconciliation gets there first
+    razorpay_payment_id = models.CharField(max_length=100, unique=True, blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
     total = models.DecimalField(max_digits=10, decimal_places=2)
     status = models.CharField(choices=(
         ("Confirmed", "Confirmed"),
@@ -77,12 +137,23 @@ class Order(models.Model):
         ("Return Requested", "Return Requested"),
         ("Processing", "Processing"),
         ("On the way", "On the way"),
+        ("Expired", "Expired"),
     ), default="Confirmed")
     shipping_address = models.TextField(max_length=256)
     phone = models.CharField(max_length=15)
     pincode = models.PositiveIntegerField()
     deliverycharge = models.PositiveIntegerField()
     redeemed_points = models.PositiveIntegerField()
+    # Set once the order's units have been added to ProductRanking
+    counted_in_rankings = models.BooleanField(default=False, db_index=True)
+
+    class Meta:
+        indexes = [
+            # Confirmed order count for VIP checks, a user's newest orders, and payment settlement
+            models.Index(fields=['user', 'status'], name='order_user_status_idx'),
+            models.Index(fields=['user', '-created_at'], name='order_user_created_idx'),
+            models.Index(fields=['razorpay_order_id'], name='order_razorpay_order_idx'),
+        ]
 
     def __str__(self):
         return f"Order {self.id} by {self.user.username} - Status: {self.status}"
@@ -101,7 +172,25 @@ class OrderItem(models.Model):
 class Profile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     first_order_offer_used = models.BooleanField(default=False)
-    loyaltypoints = models.PositiveIntegerField(default=0)
+
+    TRACKED_FIELDS = ['first_order_offer_used']
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = {name: getattr(instance, name) for name in cls.TRACKED_FIELDS if name in field_names}
+        return instance
+
+    def changed_fields(self):
+        loaded = getattr(self, '_loaded_values', None)
+        if loaded is None:
+            return list(self.TRACKED_FIELDS)
+        return [name for name, value in loaded.items() if getattr(self, name) != value]
+
+    def save(self, *args, **kwargs):
+        result = super().save(*args, **kwargs)
+        self._loaded_values = {name: getattr(self, name) for name in self.TRACKED_FIELDS}
+        return result
 
     def __str__(self):
         return f"{self.user.username}'s profile"
@@ -126,3 +215,298 @@ class WishlistItem(models.Model):
 
         return f"{self.product.name} in {self.wishlist.user.username}'s wishlist"
 
+
+# Price and stock as of the last send_wishlist_alerts run. The live tables are diffed against
+# these to find restocks and price drops since then.
+class ProductSnapshot(models.Model):
+    product = models.OneToOneField(Product, primary_key=True, related_name='snapshot', on_delete=models.CASCADE)
+    price = models.DecimalField(max_digits=10, decimal_places=0)
+
+
+class ColorSnapshot(models.Model):
+    color = models.OneToOneField(ProductColor, primary_key=True, related_name='snapshot', on_delete=models.CASCADE)
+    qty = models.IntegerField()
+
+
+class Watermark(models.Model):
+    name = models.CharField(max_length=50, unique=True)
+    value = models.DateTimeField(blank=True, null=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name}: {self.value}"
+
+
+class SalesRollup(models.Model):
+    period = models.CharField(max_length=4, choices=(
+        ("hour", "Hourly"),
+        ("day", "Daily"),
+    ))
+    bucket = models.DateTimeField()
+    category = models.ForeignKey(Category, on_delete=models.CASCADE)
+    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    color = models.ForeignKey(ProductColor, on_delete=models.CASCADE)
+    units = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    discounts = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    redeemed_points = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    delivery_charges = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+    class Meta:
+        unique_together = ('period', 'bucket', 'color')
+
+    def __str__(self):
+        return f"{self.get_period_display()} {self.bucket:%d-%b-%y %H:%M} - {self.color}"
+
+
+class CatalogVersion(models.Model):
+    # 'catalog' for the whole catalog, 'category:<id>' per category, 'product:<id>' per product,
+    # plus other cached reference data such as 'delivery_zones'
+    scope = models.CharField(max_length=30, unique=True)
+    version = models.PositiveBigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.scope} v{self.version}"
+
+
+class SaleCampaign(models.Model):
+    name = models.CharField(max_length=100)
+    discount = models.PositiveIntegerField(validators=[MinValueValidator(1), MaxValueValidator(90)])
+    starts_at = models.DateTimeField()
+    ends_at = models.DateTimeField()
+    categories = models.ManyToManyField(Category, blank=True, related_name='sale_campaigns')
+    products = models.ManyToManyField(Product, blank=True, related_name='sale_campaigns')
+    status = models.CharField(max_length=10, choices=(
+        ("Scheduled", "Scheduled"),
+        ("Active", "Active"),
+        ("Ended", "Ended"),
+    ), default="Scheduled")
+    applied_at = models.DateTimeField(blank=True, null=True)
+    reverted_at = models.DateTimeField(blank=True, null=True)
+
+    def __str__(self):
+        return f"{self.name} (-{self.discount}%) - {self.status}"
+
+
+class SaleCampaignItem(models.Model):
+    campaign = models.ForeignKey(SaleCampaign, related_name='items', on_delete=models.CASCADE)
+    product = models.ForeignKey(Product, related_name='sale_items', on_delete=models.CASCADE)
+    original_price = models.DecimalField(max_digits=10, decimal_places=0)
+    original_discount = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('campaign', 'product')
+
+    def __str__(self):
+        return f"{self.product.name} in {self.campaign.name}"
+
+
+class PointsEntry(models.Model):
+    # Append-only: rows are inserted at checkout and never updated, so no row is ever contended
+    user = models.ForeignKey(User, related_name='points_entries', on_delete=models.CASCADE)
+    order = models.ForeignKey(Order, related_name='points_entries', on_delete=models.SET_NULL, blank=True, null=True)
+    kind = models.CharField(max_length=10, choices=(
+        ("Earn", "Earn"),
+        ("Redeem", "Redeem"),
+        ("Expire", "Expire"),
+        ("Adjust", "Adjust"),
+    ))
+    points = models.DecimalField(max_digits=12, decimal_places=2)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['order', 'kind'], name='unique_points_entry_per_order'),
+        ]
+
+    def __str__(self):
+        return f"{self.user.username}: {self.kind} {self.points}"
+
+
+class PointsBalance(models.Model):
+    # Snapshot of every entry up to last_entry_id, maintained by the compact_points_ledger command
+    user = models.OneToOneField(User, related_name='points_balance', on_delete=models.CASCADE)
+    balance = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    last_entry_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.user.username}: {self.balance} (up to entry {self.last_entry_id})"
+
+
+class PendingUpload(models.Model):
+    # A media file written to local disk by OffloadedStorage and not yet confirmed on the remote backend
+    name = models.CharField(max_length=255, unique=True)
+    # Only this host has the local file
+    host = models.CharField(max_length=255, blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    next_attempt_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['host', 'next_attempt_at'], name='upload_host_next_attempt_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.name} ({self.attempts} attempts)"
+
+
+class Task(models.Model):
+    name = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict, blank=True)
+    # Optional dedupe key, enqueueing the same key twice is a no-op
+    key = models.CharField(max_length=150, unique=True, blank=True, null=True)
+    status = models.CharField(max_length=10, choices=(
+        ("Queued", "Queued"),
+        ("Running", "Running"),
+        ("Done", "Done"),
+        ("Failed", "Failed"),
+    ), default="Queued")
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    run_at = models.DateTimeField(db_index=True)
+    locked_at = models.DateTimeField(blank=True, null=True)
+    locked_by = models.CharField(max_length=100, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            # purge_finished_tasks picks old Done and Failed rows
+            models.Index(fields=['status', 'finished_at'], name='task_status_finished_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.name} #{self.id} - {self.status}"
+
+
+class OutboxEmail(models.Model):
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    from_email = models.CharField(max_length=255)
+    to = models.JSONField(default=list)
+    cc = models.JSONField(default=list, blank=True)
+    bcc = models.JSONField(default=list, blank=True)
+    reply_to = models.JSONField(default=list, blank=True)
+    headers = models.JSONField(default=dict, blank=True)
+    # [[content, mimetype], ...] e.g. the HTML part
+    alternatives = models.JSONField(default=list, blank=True)
+    status = models.CharField(max_length=10, choices=(
+        ("Queued", "Queued"),
+        ("Sending", "Sending"),
+        ("Sent", "Sent"),
+        ("Failed", "Failed"),
+    ), default="Queued")
+    # Token of the send_outbox run that claimed the row
+    claim = models.CharField(max_length=32, blank=True, db_index=True)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(db_index=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(blank=True, null=True)
+
+    def __str__(self):
+        return f"{self.subject} to {', '.join(self.to)} - {self.status}"
+
+
+class DeliveryZone(models.Model):
+    name = models.CharField(max_length=100)
+    pincode_from = models.PositiveIntegerField()
+    pincode_to = models.PositiveIntegerField()
+    charge = models.PositiveIntegerField()
+    serviceable = models.BooleanField(default=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['pincode_from']
+
+    def clean(self):
+        if self.pincode_from > self.pincode_to:
+            raise ValidationError("pincode_from must not be greater than pincode_to")
+        overlapping = DeliveryZone.objects.filter(pincode_from__lte=self.pincode_to, pincode_to__gte=self.pincode_from).exclude(pk=self.pk)
+        if overlapping.exists():
+            raise ValidationError(f"Overlaps with {overlapping.first()}")
+
+    def __str__(self):
+        return f"{self.name} ({self.pincode_from}-{self.pincode_to}): ₹{self.charge}"
+
+
+class ProductRecommendation(models.Model):
+    # Precomputed "frequently bought together" list, rebuilt offline by the build_recommendations command
+    product = models.ForeignKey(Product, related_name='recommendations', on_delete=models.CASCADE)
+    recommended = models.ForeignKey(Product, related_name='+', on_delete=models.CASCADE)
+    rank = models.PositiveSmallIntegerField()
+    # Number of orders that contained both products
+    orders_together = models.PositiveIntegerField()
+    score = models.FloatField()
+
+    class Meta:
+        unique_together = ('product', 'rank')
+        ordering = ['product', 'rank']
+
+    def __str__(self):
+        return f"{self.product.name} -> {self.recommended.name} (#{self.rank})"
+
+
+class ProductRanking(models.Model):
+    # One row per product, created with the product. Scores are units sold with exponential time decay,
+    # kept up to date by the refresh_product_rankings command.
+    product = models.OneToOneField(Product, related_name='ranking', on_delete=models.CASCADE)
+    category = models.ForeignKey(Category, related_name='rankings', on_delete=models.CASCADE)
+    units_sold = models.PositiveIntegerField(default=0)
+    best_seller_score = models.FloatField(default=0)
+    trending_score = models.FloatField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['category', '-best_seller_score', 'product'], name='ranking_best_seller_idx'),
+            models.Index(fields=['category', '-trending_score', 'product'], name='ranking_trending_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.product.name}: {self.units_sold} sold"
+
+
+class ArchivedOrder(models.Model):
+    # Orders in a final state moved out of sho_order by the order_lifecycle command. Same id and
+    # fields as the Order it came from, so my_orders can list both the same way.
+    id = models.BigIntegerField(primary_key=True)
+    user = models.ForeignKey(User, related_name='archived_orders', on_delete=models.CASCADE)
+    razorpay_order_id = models.CharField(max_length=100, blank=True, null=True)
+    # Kept so a late webhook or reconciliation still finds the payment's order
+    razorpay_payment_id = models.CharField(max_length=100, unique=True, blank=True, null=True)
+    created_at = models.DateTimeField(db_index=True)
+    updated_at = models.DateTimeField()
+    total = models.DecimalField(max_digits=10, decimal_places=2)
+    status = models.CharField(max_length=20)
+    shipping_address = models.TextField(max_length=256)
+    phone = models.CharField(max_length=15)
+    pincode = models.PositiveIntegerField()
+    deliverycharge = models.PositiveIntegerField()
+    redeemed_points = models.PositiveIntegerField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-created_at'], name='archived_user_created_idx'),
+            models.Index(fields=['razorpay_order_id'], name='archived_razorpay_order_idx'),
+        ]
+
+    def __str__(self):
+        return f"Archived order {self.id} by {self.user.username} - Status: {self.status}"
+
+
+class ArchivedOrderItem(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    order = models.ForeignKey(ArchivedOrder, related_name='items', on_delete=models.CASCADE)
+    product = models.ForeignKey(Product, related_name='+', on_delete=models.PROTECT)
+    color = models.ForeignKey(ProductColor, related_name='+', on_delete=models.PROTECT)
+    price = models.DecimalField(max_digits=10, decimal_places=2)
+    quantity = models.PositiveIntegerField()
+
+    def __str__(self):
+        return f"Archived order ID: {self.order_id} - {self.product.name} {self.color.color} - {self.quantity}"
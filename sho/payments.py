@@ -0,0 +1,165 @@
+import hashlib
+import hmac
+import logging
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .catalog import bump_product_versions
+from .models import ArchivedOrder, Order, ProductColor, Profile
+from .points import points_balance, spend_points
+from .stockfeed import stock_changed
+from .taskqueue import enqueue
+
+logger = logging.getLogger(__name__)
+
+# Orders a captured payment may still confirm. Expired ones too, the customer did pay.
+SETTLEABLE_STATUSES = ['Pending', 'Expired']
+SETTLE_EVENTS = ['payment.captured', 'order.paid']
+# The Razorpay API returns at most 100 payments per call
+RECONCILE_PAGE_SIZE = 100
+RECONCILE_WINDOW = timedelta(hours=48)
+
+
+def razorpay_client():
+    if settings.PAYMENT_GATEWAY == 'fake':
+        from .fakegateway import fake_gateway
+
+        return fake_gateway()
+
+    # The SDK is imported on first use: it pulls in pkg_resources and requests, which costs every
+    # worker a couple of hundred ms at boot even though only checkout talks to the gateway
+    import razorpay
+
+    return razorpay.Client(auth=(settings.RAZORPAY_KEY_ID, settings.RAZORPAY_KEY_SECRET))
+
+
+def verify_webhook_signature(body, signature):
+    if not settings.RAZORPAY_WEBHOOK_SECRET or not signature:
+        return False
+    expected = hmac.new(settings.RAZORPAY_WEBHOOK_SECRET.encode(), body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, signature)
+
+
+def confirm_order(order_id, payment_id):
+    # Shared by the checkout callback, the webhook and reconciliation, whichever comes first.
+    # The payment id is stored (unique) on the order, so every later call for it is a no-op.
+    with transaction.atomic():
+        order = Order.objects.select_for_update().select_related('user').get(pk=order_id)
+        if order.razorpay_payment_id:
+            if order.razorpay_payment_id != payment_id:
+                logger.warning("Order %s paid twice: %s and %s", order.id, order.razorpay_payment_id, payment_id)
+            return order, False
+        if order.status not in SETTLEABLE_STATUSES:
+            return order, False
+        if order.redeemed_points > 0:
+            # Placing an order only checks the balance, the points are spent here. The select_related
+            # above locks the user row too, so two of a shopper's orders can't both spend the same points.
+            # An order short of its points is left unconfirmed for staff, like a short payment.
+            if points_balance(order.user) < order.redeemed_points:
+                logger.warning("Order %s redeems %s points, more than its user has", order.id, order.redeemed_points)
+                return order, False
+
+        order.status = 'Confirmed'
+        order.razorpay_payment_id = payment_id
+        order.save(update_fields=['status', 'razorpay_payment_id', 'updated_at'])
+
+        items = list(order.items.values_list('color_id', 'quantity', 'product_id'))
+        now = timezone.now()
+        for color_id, quantity, _ in items:
+            # Atomic decrement, concurrent checkouts can't overwrite each other's stock update.
+            # .update() skips auto_now, updated_at is set so the product feed picks up the new stock.
+            ProductColor.objects.filter(id=color_id).update(qty=F('qty') - quantity, updated_at=now)
+        Profile.objects.filter(user_id=order.user_id, first_order_offer_used=False).update(first_order_offer_used=True)
+
+        if order.redeemed_points > 0:
+            spend_points(order.user, order.redeemed_points, order)
+        enqueue('order.award_points', {'order_id': order.id}, key=f'order.award_points:{order.id}')
+
+        # Push the new quantities to shoppers watching these products
+        color_ids = [color_id for color_id, _, _ in items]
+        transaction.on_commit(lambda: stock_changed(color_ids))
+        # New stock for the catalog API's ETags
+        transaction.on_commit(lambda: bump_product_versions(product_id for _, _, product_id in items))
+    return order, True
+
+
+def check_archived_payment(payment, archived_payment_id):
+    # Archived orders are final, a payment that didn't settle one before it was archived is left to staff
+    if archived_payment_id != payment['id']:
+        logger.warning("Payment %s is for gateway order %s, archived with payment %s",
+                       payment['id'], payment['order_id'], archived_payment_id)
+
+
+def refusal_reason(order, payment_id):
+    # Why confirm_order left the order unconfirmed for this payment, None when the payment settled it
+    if order.razorpay_payment_id == payment_id:
+        return None
+    if order.razorpay_payment_id:
+        return "This order was already paid with another payment."
+    if order.status not in SETTLEABLE_STATUSES:
+        return f"This order is {order.status.lower()} and can no longer be paid for."
+    return "Your loyalty points balance no longer covers the points redeemed on this order."
+
+
+def settle_payment(payment, order_id=None):
+    if payment.get('status') != 'captured' or not payment.get('order_id'):
+        return False
+    if order_id is None:
+        order_id = Order.objects.filter(razorpay_order_id=payment['order_id']).values_list('id', flat=True).first()
+        if order_id is None:
+            archived = list(ArchivedOrder.objects.filter(razorpay_order_id=payment['order_id']).values_list(
+                'razorpay_payment_id', flat=True,
+            )[:1])
+            if archived:
+                check_archived_payment(payment, archived[0])
+            else:
+                logger.warning("Payment %s is for unknown gateway order %s", payment['id'], payment['order_id'])
+            return False
+    total = Order.objects.filter(pk=order_id).values_list('total', flat=True).first()
+    if total is not None and Decimal(payment['amount']) < total * 100:
+        logger.warning("Payment %s of %s paise is short for order %s", payment['id'], payment['amount'], order_id)
+        return False
+    _, confirmed = confirm_order(order_id, payment['id'])
+    return confirmed
+
+
+def reconcile_payments(since, until=None, page_size=RECONCILE_PAGE_SIZE):
+    # Pages through the gateway's captured payments and settles the orders we never heard about
+    # (tab closed before the callback, webhook not delivered)
+    client = razorpay_client()
+    until = until or timezone.now()
+    skip = seen = settled = 0
+    while True:
+        page = client.payment.all({
+            'from': int(since.timestamp()), 'to': int(until.timestamp()), 'count': page_size, 'skip': skip,
+        })['items']
+        seen += len(page)
+        captured = [payment for payment in page if payment.get('status') == 'captured' and payment.get('order_id')]
+        # One query per page finds which of these payments still have an unsettled order
+        open_orders = dict(
+            Order.objects
+            .filter(
+                razorpay_order_id__in=[payment['order_id'] for payment in captured],
+                status__in=SETTLEABLE_STATUSES,
+                razorpay_payment_id__isnull=True,
+            )
+            .values_list('razorpay_order_id', 'id')
+        )
+        archived = dict(
+            ArchivedOrder.objects
+            .filter(razorpay_order_id__in=[payment['order_id'] for payment in captured])
+            .values_list('razorpay_order_id', 'razorpay_payment_id')
+        )
+        for payment in captured:
+            if payment['order_id'] in open_orders and settle_payment(payment, open_orders[payment['order_id']]):
+                settled += 1
+            elif payment['order_id'] in archived:
+                check_archived_payment(payment, archived[payment['order_id']])
+        if len(page) < page_size:
+            return seen, settled
+        skip += page_size
@@ -0,0 +1,114 @@
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import F, Max, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import PointsBalance, PointsEntry
+
+# Compaction only folds entries older than this, so a checkout transaction that took an
+# entry id but hasn't committed yet can never be skipped over
+COMPACTION_AGE = timedelta(days=1)
+COMPACTION_BATCH_SIZE = 500
+# Points not redeemed within this long of being earned expire, oldest first
+POINTS_LIFETIME = timedelta(days=365)
+EXPIRY_BATCH_SIZE = 500
+
+
+def record_points(user, kind, points, order=None):
+    if order is not None:
+        # At most one entry of each kind per order, so replays don't count twice
+        entry, _ = PointsEntry.objects.get_or_create(order=order, kind=kind, defaults={'user': user, 'points': Decimal(points)})
+        return entry
+    return PointsEntry.objects.create(user=user, kind=kind, points=Decimal(points))
+
+
+def earn_points(user, points, order=None):
+    return record_points(user, 'Earn', points, order)
+
+
+def spend_points(user, points, order=None):
+    return record_points(user, 'Redeem', -Decimal(points), order)
+
+
+def points_balance(user):
+    snapshot = PointsBalance.objects.filter(user=user).values_list('balance', 'last_entry_id').first()
+    balance, last_entry_id = snapshot or (Decimal(0), 0)
+    recent = PointsEntry.objects.filter(user=user, id__gt=last_entry_id).aggregate(total=Sum('points'))['total']
+    return balance + (recent or 0)
+
+
+def expiring_points(entries, cutoff):
+    # Redemptions, earlier expiries and negative adjustments use up the oldest points first, so
+    # whatever was credited before the cutoff and is more than everything spent has expired
+    return entries.values('user').annotate(
+        credited=Coalesce(Sum('points', filter=Q(points__gt=0, created_at__lt=cutoff)), Value(Decimal(0))),
+        debited=Coalesce(Sum('points', filter=Q(points__lt=0)), Value(Decimal(0))),
+    ).annotate(expiring=F('credited') + F('debited')).filter(expiring__gt=0).order_by('user')
+
+
+def expire_points(now=None):
+    cutoff = (now or timezone.now()) - POINTS_LIFETIME
+    users = list(expiring_points(PointsEntry.objects.all(), cutoff).values_list('user', flat=True))
+    expired = 0
+    for start in range(0, len(users), EXPIRY_BATCH_SIZE):
+        batch = users[start:start + EXPIRY_BATCH_SIZE]
+        with transaction.atomic():
+            # Same lock as confirm_order's balance check, recounted under it
+            list(User.objects.select_for_update().filter(pk__in=batch).values_list('pk'))
+            rows = expiring_points(PointsEntry.objects.filter(user__in=batch), cutoff).values_list('user', 'expiring')
+            entries = [PointsEntry(user_id=user_id, kind='Expire', points=-points) for user_id, points in rows]
+            PointsEntry.objects.bulk_create(entries)
+        expired += len(entries)
+    return expired
+
+
+def compact_points(before=None):
+    before = before or timezone.now() - COMPACTION_AGE
+    cutoff_id = PointsEntry.objects.filter(created_at__lt=before).aggregate(last=Max('id'))['last']
+    if not cutoff_id:
+        return 0
+
+    folded_up_to = PointsBalance.objects.filter(user=OuterRef('user')).values('last_entry_id')
+    pending = (
+        PointsEntry.objects
+        .filter(id__lte=cutoff_id)
+        .annotate(folded_up_to=Coalesce(Subquery(folded_up_to), Value(0)))
+        .filter(id__gt=F('folded_up_to'))
+        .values('user')
+        .annotate(total=Sum('points'), last=Max('id'))
+        .order_by('user')
+    )
+
+    compacted = 0
+    batch = []
+    for row in pending.iterator(chunk_size=COMPACTION_BATCH_SIZE):
+        batch.append(row)
+        if len(batch) == COMPACTION_BATCH_SIZE:
+            compacted += fold_batch(batch)
+            batch = []
+    if batch:
+        compacted += fold_batch(batch)
+    return compacted
+
+
+def fold_batch(rows):
+    with transaction.atomic():
+        locked = PointsBalance.objects.select_for_update().filter(user__in=[row['user'] for row in rows])
+        snapshots = {snapshot.user_id: snapshot for snapshot in locked}
+        now = timezone.now()
+        new = []
+        for row in rows:
+            snapshot = snapshots.get(row['user'])
+            if snapshot is None:
+                new.append(PointsBalance(user_id=row['user'], balance=row['total'], last_entry_id=row['last']))
+            else:
+                snapshot.balance += row['total']
+                snapshot.last_entry_id = row['last']
+                snapshot.updated_at = now
+        PointsBalance.objects.bulk_update(snapshots.values(), ['balance', 'last_entry_id', 'updated_at'])
+        PointsBalance.objects.bulk_create(new)
+    return len(rows)
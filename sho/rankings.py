@@ -0,0 +1,111 @@
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Order, OrderItem, Product, ProductRanking, Watermark
+from .rollups import SALE_STATUSES
+
+RANKING_WATERMARK = 'product_rankings'
+# A unit sold one half-life ago counts half as much as one sold now
+BEST_SELLER_HALF_LIFE = timedelta(days=90)
+TRENDING_HALF_LIFE = timedelta(days=3)
+BATCH_SIZE = 1000
+
+# ?sort= value -> ordering, each backed by an index on ProductRanking
+RANKING_SORTS = {
+    'best-sellers': '-best_seller_score',
+    'trending': '-trending_score',
+}
+
+
+def decay(age, half_life):
+    return 0.5 ** (max(age, timedelta(0)) / half_life)
+
+
+def ensure_rankings():
+    # Rows are created by the Product post_save signal. This catches products created with
+    # bulk_create or before the table existed.
+    missing = Product.objects.filter(ranking__isnull=True).values_list('id', 'category_id')
+    ProductRanking.objects.bulk_create(
+        [ProductRanking(product_id=product_id, category_id=category_id) for product_id, category_id in missing],
+        batch_size=500,
+        ignore_conflicts=True,
+    )
+
+
+def decay_rankings(elapsed, now):
+    # Decaying every stored score by the time since the last refresh is the same as re-weighting
+    # each past sale by its age, without re-reading any orders
+    ProductRanking.objects.update(
+        best_seller_score=F('best_seller_score') * decay(elapsed, BEST_SELLER_HALF_LIFE),
+        trending_score=F('trending_score') * decay(elapsed, TRENDING_HALF_LIFE),
+        updated_at=now,
+    )
+
+
+def uncounted_orders(batch_size):
+    while True:
+        order_ids = list(
+            Order.objects
+            .filter(status__in=SALE_STATUSES, counted_in_rankings=False)
+            .order_by('id')
+            .values_list('id', flat=True)[:batch_size]
+        )
+        if not order_ids:
+            return
+        yield order_ids
+
+
+def count_orders(order_ids, now):
+    sold = defaultdict(lambda: [0, 0.0, 0.0])
+    items = OrderItem.objects.filter(order_id__in=order_ids).values_list('product_id', 'quantity', 'order__created_at')
+    for product_id, quantity, created_at in items:
+        row = sold[product_id]
+        row[0] += quantity
+        row[1] += quantity * decay(now - created_at, BEST_SELLER_HALF_LIFE)
+        row[2] += quantity * decay(now - created_at, TRENDING_HALF_LIFE)
+
+    with transaction.atomic():
+        rankings = list(ProductRanking.objects.select_for_update().filter(product_id__in=sold))
+        for ranking in rankings:
+            units, best_seller, trending = sold[ranking.product_id]
+            ranking.units_sold += units
+            ranking.best_seller_score += best_seller
+            ranking.trending_score += trending
+            ranking.updated_at = now
+        ProductRanking.objects.bulk_update(
+            rankings, ['units_sold', 'best_seller_score', 'trending_score', 'updated_at'], batch_size=500,
+        )
+        Order.objects.filter(id__in=order_ids).update(counted_in_rankings=True)
+
+
+def refresh_rankings(full=False, batch_size=BATCH_SIZE):
+    now = timezone.now()
+    watermark, _ = Watermark.objects.get_or_create(name=RANKING_WATERMARK)
+    ensure_rankings()
+    if full:
+        Order.objects.filter(counted_in_rankings=True).update(counted_in_rankings=False)
+        ProductRanking.objects.update(units_sold=0, best_seller_score=0, trending_score=0, updated_at=now)
+    elif watermark.value:
+        decay_rankings(now - watermark.value, now)
+
+    orders = 0
+    for order_ids in uncounted_orders(batch_size):
+        count_orders(order_ids, now)
+        orders += len(order_ids)
+
+    watermark.value = now
+    watermark.save()
+    return orders
+
+
+def ranked_products(category, sort):
+    return (
+        ProductRanking.objects
+        .filter(category=category)
+        .order_by(RANKING_SORTS[sort], 'product_id')
+        .select_related('product')
+    )
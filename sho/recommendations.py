@@ -0,0 +1,112 @@
+from itertools import islice
+
+from django.db import transaction
+
+from .lifecycle import with_archived
+from .models import ArchivedOrder, ArchivedOrderItem, Order, OrderItem, Product, ProductRecommendation
+from .rollups import SALE_STATUSES
+
+TOP_K = 8
+# How many of the stored top-K the product page shows
+RECOMMENDATIONS_SHOWN = 4
+# Orders read per batch. Each batch becomes one sparse orders x products matrix.
+BATCH_SIZE = 5000
+# Minimum number of shared orders before a pair is recommended
+MIN_SUPPORT = 1
+
+
+def sale_order_ids(orders, batch_size):
+    return (
+        orders.filter(status__in=SALE_STATUSES).order_by('id')
+        .values_list('id', flat=True).iterator(chunk_size=batch_size)
+    )
+
+
+def order_batches(batch_size):
+    # Id ranges over live and archived orders, archived baskets are co-purchases too
+    order_ids = with_archived(
+        sale_order_ids(Order.objects, batch_size), sale_order_ids(ArchivedOrder.objects, batch_size),
+    )
+    while batch := list(islice(order_ids, batch_size)):
+        yield batch[0], batch[-1]
+
+
+def basket_pairs(first_id, last_id):
+    pairs = []
+    for items in (OrderItem.objects, ArchivedOrderItem.objects):
+        pairs += (
+            items
+            .filter(order_id__gte=first_id, order_id__lte=last_id, order__status__in=SALE_STATUSES)
+            .values_list('order_id', 'product_id')
+            .distinct()
+        )
+    return pairs
+
+
+def co_occurrence_matrix(product_ids, batch_size=BATCH_SIZE):
+    # NumPy/SciPy are only needed by this offline job, so web processes never import them
+    import numpy as np
+    from scipy import sparse
+
+    counts = sparse.csr_matrix((len(product_ids), len(product_ids)), dtype=np.int64)
+    for first_id, last_id in order_batches(batch_size):
+        # An order archived between the two reads is in both, np.unique keeps its pairs once
+        pairs = np.unique(np.array(basket_pairs(first_id, last_id), dtype=np.int64).reshape(-1, 2), axis=0)
+        if not len(pairs):
+            continue
+        orders, rows = np.unique(pairs[:, 0], return_inverse=True)
+        cols = np.searchsorted(product_ids, pairs[:, 1])
+        incidence = sparse.csr_matrix(
+            (np.ones(len(pairs), dtype=np.int64), (rows, cols)),
+            shape=(len(orders), len(product_ids)),
+        )
+        # (products x orders) @ (orders x products): cell i, j counts the orders holding both i and j
+        counts = counts + incidence.T @ incidence
+    return counts.tocsr()
+
+
+def top_recommendations(counts, product_ids, top_k=TOP_K, min_support=MIN_SUPPORT):
+    import numpy as np
+
+    # The diagonal holds how many orders each product appeared in
+    occurrences = counts.diagonal().astype(np.float64)
+    counts = counts.tolil()
+    counts.setdiag(0)
+    counts = counts.tocsr()
+    counts.eliminate_zeros()
+
+    recommendations = []
+    for i in range(len(product_ids)):
+        start, end = counts.indptr[i], counts.indptr[i + 1]
+        cols, together = counts.indices[start:end], counts.data[start:end]
+        keep = together >= min_support
+        cols, together = cols[keep], together[keep]
+        if not len(cols):
+            continue
+        # Cosine similarity, so products that are in every basket don't top every list
+        scores = together / np.sqrt(occurrences[i] * occurrences[cols])
+        best = np.lexsort((-together, -scores))[:top_k]
+        for rank, j in enumerate(best, start=1):
+            recommendations.append(ProductRecommendation(
+                product_id=int(product_ids[i]),
+                recommended_id=int(product_ids[cols[j]]),
+                rank=rank,
+                orders_together=int(together[j]),
+                score=float(scores[j]),
+            ))
+    return recommendations
+
+
+def build_recommendations(top_k=TOP_K, batch_size=BATCH_SIZE, min_support=MIN_SUPPORT):
+    import numpy as np
+
+    product_ids = np.fromiter(Product.objects.order_by('id').values_list('id', flat=True), dtype=np.int64)
+    recommendations = []
+    if len(product_ids):
+        counts = co_occurrence_matrix(product_ids, batch_size)
+        recommendations = top_recommendations(counts, product_ids, top_k, min_support)
+
+    with transaction.atomic():
+        ProductRecommendation.objects.all().delete()
+        ProductRecommendation.objects.bulk_create(recommendations, batch_size=1000)
+    return len({r.product_id for r in recommendations}), len(recommendations)
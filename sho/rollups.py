@@ -0,0 +1,123 @@
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+from itertools import groupby
+from operator import itemgetter
+
+from django.db import transaction
+from django.db.models.functions import TruncDay
+from django.utils import timezone
+
+from .models import ArchivedOrder, ArchivedOrderItem, Order, OrderItem, SalesRollup, Watermark
+
+# Orders that were paid for. Pending/Cancelled/Returned don't count as sales.
+SALE_STATUSES = ['Confirmed', 'Processing', 'Shipped', 'On the way', 'Delivered', 'Return Requested']
+
+ROLLUP_WATERMARK = 'sales_rollup'
+# Re-read a little before the watermark so orders committed while the last run was going are not missed.
+# Rebuilding a day is idempotent, so the overlap is harmless.
+WATERMARK_OVERLAP = timedelta(minutes=5)
+
+MEASURES = ['units', 'revenue', 'discounts', 'redeemed_points', 'delivery_charges']
+CENT = Decimal('0.01')
+
+
+def changed_days(since=None):
+    if since:
+        # Archived orders never change, only live ones can have moved a day's totals
+        orders = Order.objects.filter(updated_at__gte=since - WATERMARK_OVERLAP)
+        return sorted(set(orders.annotate(day=TruncDay('created_at')).values_list('day', flat=True)))
+    days = set()
+    for orders in (Order.objects.all(), ArchivedOrder.objects.all()):
+        days.update(orders.annotate(day=TruncDay('created_at')).values_list('day', flat=True))
+    return sorted(days)
+
+
+def order_lines(items, day):
+    return (
+        items
+        .filter(
+            order__created_at__gte=day,
+            order__created_at__lt=day + timedelta(days=1),
+            order__status__in=SALE_STATUSES,
+        )
+        .order_by('order_id', 'id')
+        .values_list(
+            'order_id', 'order__created_at', 'order__total', 'order__deliverycharge', 'order__redeemed_points',
+            'product__category_id', 'product_id', 'color_id', 'price', 'quantity',
+        )
+    )
+
+
+def day_orders(day):
+    # Archived orders are sales too. One archived between the two reads is in both, it is only
+    # counted from the first.
+    seen = set()
+    for order_id, lines in groupby(order_lines(OrderItem.objects.all(), day).iterator(), key=itemgetter(0)):
+        seen.add(order_id)
+        yield list(lines)
+    for order_id, lines in groupby(order_lines(ArchivedOrderItem.objects.all(), day).iterator(), key=itemgetter(0)):
+        if order_id not in seen:
+            yield list(lines)
+
+
+def aggregate_day(day):
+    totals = defaultdict(lambda: dict.fromkeys(MEASURES, Decimal(0)))
+    for lines in day_orders(day):
+        _, created_at, total, deliverycharge, redeemed_points = lines[0][:5]
+        subtotal = sum(line[8] * line[9] for line in lines)
+        if not subtotal:
+            continue
+        # Whatever the customer did not pay for items + delivery was discount (first order/loyal
+        # offer, waived VIP delivery, rounding).
+        discount = max(Decimal(0), subtotal + deliverycharge - redeemed_points - total)
+        hour = created_at.replace(minute=0, second=0, microsecond=0)
+        # Order level amounts are shared out over the lines by their share of the subtotal
+        for line in lines:
+            category_id, product_id, color_id, price, quantity = line[5:]
+            share = price * quantity / subtotal
+            for period, bucket in (('hour', hour), ('day', day)):
+                row = totals[(period, bucket, category_id, product_id, color_id)]
+                row['units'] += quantity
+                row['revenue'] += price * quantity
+                row['discounts'] += discount * share
+                row['redeemed_points'] += redeemed_points * share
+                row['delivery_charges'] += deliverycharge * share
+    return totals
+
+
+def rebuild_day(day):
+    totals = aggregate_day(day)
+    rollups = [
+        SalesRollup(
+            period=period, bucket=bucket, category_id=category_id, product_id=product_id, color_id=color_id,
+            units=int(row['units']),
+            revenue=row['revenue'].quantize(CENT),
+            discounts=row['discounts'].quantize(CENT),
+            redeemed_points=row['redeemed_points'].quantize(CENT),
+            delivery_charges=row['delivery_charges'].quantize(CENT),
+        )
+        for (period, bucket, category_id, product_id, color_id), row in totals.items()
+    ]
+    with transaction.atomic():
+        SalesRollup.objects.filter(bucket__gte=day, bucket__lt=day + timedelta(days=1)).delete()
+        SalesRollup.objects.bulk_create(rollups, batch_size=500)
+    return len(rollups)
+
+
+def build_sales_rollups(full=False):
+    started = timezone.now()
+    watermark, _ = Watermark.objects.get_or_create(name=ROLLUP_WATERMARK)
+    if full:
+        SalesRollup.objects.all().delete()
+        days = changed_days()
+    else:
+        days = changed_days(watermark.value)
+
+    rows = 0
+    for day in days:
+        rows += rebuild_day(day)
+
+    watermark.value = started
+    watermark.save()
+    return days, rows
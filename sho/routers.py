@@ -0,0 +1,65 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+
+REPLICA = 'replica'
+
+# Read-mostly models whose reads may lag the primary by a few seconds. The version counters are
+# read from the same database as the data, so an ETag never names data the replica doesn't have yet.
+CATALOG_MODELS = {'category', 'product', 'productcolor', 'productimage', 'productreview', 'catalogversion'}
+# Only read from the replica inside order_history_reads(), i.e. the my_orders page
+ORDER_HISTORY_MODELS = {'order', 'orderitem', 'archivedorder', 'archivedorderitem'}
+# Writes that don't make the user's next reads stale
+UNTRACKED_WRITE_APPS = {'sessions'}
+
+
+class RoutingState:
+    def __init__(self, pinned=False):
+        # The request must read from the primary: an unsafe method, or the user wrote recently
+        self.pinned = pinned
+        # Set by the first write in the request, later reads go to the primary to see it
+        self.wrote = False
+        self.order_history = False
+
+
+# Only set while a request is handled by ReplicaRoutingMiddleware. Management commands and the task
+# worker read and write on the primary only.
+routing_state = ContextVar('routing_state', default=None)
+
+
+@contextmanager
+def order_history_reads():
+    state = routing_state.get()
+    if state is None:
+        yield
+        return
+    previous, state.order_history = state.order_history, True
+    try:
+        yield
+    finally:
+        state.order_history = previous
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        state = routing_state.get()
+        if state is None or state.pinned or state.wrote or REPLICA not in settings.DATABASES:
+            return None
+        if model._meta.app_label != 'sho':
+            return None
+        if model._meta.model_name in CATALOG_MODELS:
+            return REPLICA
+        if state.order_history and model._meta.model_name in ORDER_HISTORY_MODELS:
+            return REPLICA
+        return None
+
+    def db_for_write(self, model, **hints):
+        state = routing_state.get()
+        if state is not None and model._meta.app_label not in UNTRACKED_WRITE_APPS:
+            state.wrote = True
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replica is a copy of the primary, objects from either can be related
+        return True
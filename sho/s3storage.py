@@ -0,0 +1,15 @@
+# Kept out of sho.storage: importing boto3/botocore costs a few hundred ms, so it only happens once
+# default_storage is first used, not at every process start
+from storages.backends.s3boto3 import S3Boto3Storage
+
+from .storage import PUBLIC_URL_TTL, CachedURLMixin
+
+
+class CachedURLS3Storage(CachedURLMixin, S3Boto3Storage):
+    def url_ttl(self, expire=None):
+        signed = self.querystring_auth and (not self.custom_domain or self.cloudfront_signer)
+        if not signed:
+            return PUBLIC_URL_TTL
+        expire = expire or self.querystring_expire
+        # Hand out signed URLs with at least 10% of their lifetime (min. a minute) left
+        return max(0, expire - max(60, expire // 10))
@@ -1,7 +1,15 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 from django.contrib.auth.models import User
-from .models import Profile
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from .models import Profile, Category, Product, ProductColor, ProductImage, ProductRanking, ProductReview, DeliveryZone
+from .catalog import (
+    bump_card_versions, bump_catalog_version, bump_listing_versions, bump_product_versions, bump_scopes, product_scope,
+)
+from .delivery import zones_changed
+from .stockfeed import stock_feed
 
 @receiver(post_save, sender=User)
 def create_user_profile(sender, instance, created, **kwargs):
@@ -10,4 +18,91 @@ def create_user_profile(sender, instance, created, **kwargs):
         
 @receiver(post_save, sender=User)
 def save_user_profile(sender, instance, **kwargs):
-    instance.profile.save()
+    # Only a profile that was loaded and edited through the user needs writing. This keeps
+    # last_login updates at login (and every other User.save) from rewriting the profile.
+    if not User.profile.related.is_cached(instance):
+        return
+    changed = instance.profile.changed_fields()
+    if changed:
+        instance.profile.save(update_fields=changed)
+
+
+@receiver(post_save, sender=Product)
+def invalidate_product_catalog(sender, instance, created, **kwargs):
+    # Only a change to what the listing card shows reaches the category. A move also changes the
+    # listing of the category the product was loaded from.
+    if created or instance.changed_fields():
+        category_ids = {instance.category_id, instance.loaded_value('category_id')} - {None}
+        bump_listing_versions(category_ids, [instance.id])
+    else:
+        bump_product_versions([instance.id])
+
+
+@receiver(post_delete, sender=Product)
+def invalidate_deleted_product(sender, instance, **kwargs):
+    bump_listing_versions([instance.category_id], [instance.id])
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_category_catalog(sender, instance, **kwargs):
+    bump_catalog_version([instance.id])
+
+
+@receiver(post_save, sender=ProductColor)
+def invalidate_color_catalog(sender, instance, **kwargs):
+    # Stock and colors only show on the product
+    bump_product_versions([instance.product_id])
+
+
+@receiver(post_delete, sender=ProductColor)
+def invalidate_deleted_color(sender, instance, **kwargs):
+    # The card's cover image can come from the deleted color
+    bump_card_versions([instance.product_id])
+
+
+@receiver(post_save, sender=Product)
+def sync_product_ranking(sender, instance, created, **kwargs):
+    # Every product has a ranking row so the sorted listings never need an outer join
+    if created:
+        ProductRanking.objects.create(product=instance, category_id=instance.category_id)
+    else:
+        ProductRanking.objects.filter(product=instance).exclude(category_id=instance.category_id).update(category_id=instance.category_id)
+
+
+@receiver(post_save, sender=ProductColor)
+def publish_stock(sender, instance, **kwargs):
+    rows = [(instance.product_id, instance.id, instance.qty)]
+    transaction.on_commit(lambda: stock_feed.publish(rows))
+
+
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+def touch_image_color(sender, instance, **kwargs):
+    # The feeds carry the color's image, a new or removed image makes the color changed
+    ProductColor.objects.filter(pk=instance.color_id).update(updated_at=timezone.now())
+    bump_card_versions(ProductColor.objects.filter(pk=instance.color_id).values_list('product_id', flat=True))
+
+
+@receiver(post_delete, sender=ProductColor)
+def touch_color_product(sender, instance, **kwargs):
+    Product.objects.filter(pk=instance.product_id).update(updated_at=timezone.now())
+
+
+@receiver(post_save, sender=ProductReview)
+def count_new_review(sender, instance, created, **kwargs):
+    if created:
+        Product.objects.filter(pk=instance.product_id).update(review_count=F('review_count') + 1)
+        bump_scopes([product_scope(instance.product_id)])
+
+
+@receiver(post_delete, sender=ProductReview)
+def count_deleted_review(sender, instance, **kwargs):
+    Product.objects.filter(pk=instance.product_id, review_count__gt=0).update(review_count=F('review_count') - 1)
+    bump_scopes([product_scope(instance.product_id)])
+
+
+@receiver(post_save, sender=DeliveryZone)
+@receiver(post_delete, sender=DeliveryZone)
+def reload_delivery_zones(sender, **kwargs):
+    zones_changed()
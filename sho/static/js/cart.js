@@ -0,0 +1,174 @@
+// URLs and the shopper's free delivery come from the page, on this script's tag
+const cartConfig = document.currentScript.dataset;
+
+document.addEventListener('DOMContentLoaded', function() {
+  function updateCartQuantity(key, quantity) {
+    const csrftoken = getCookie('csrftoken');
+    fetch(cartConfig.updateUrl, {
+      method: 'POST',
+      headers: {
+        'X-CSRFToken': csrftoken,
+        'Content-Type': 'application/x-www-form-urlencoded',
+      },
+      body: new URLSearchParams({
+        key: key,
+        quantity: quantity
+      }),
+    })
+    .then(response => response.json())
+    .then(data => {
+      if (data.success) {
+
+        // Update quantity input box
+        const input = document.querySelector(`input.quantity-input[data-key="${data.key}"]`);
+        if (input) input.value = data.quantity;
+
+        // Update total price cell
+        const totalPriceCell = document.querySelector(`td.total-price[data-key="${data.key}"]`);
+        const totalPriceDivForMobile = document.querySelector(`.cart-item-total-${data.key}`);
+
+        if (totalPriceCell || totalPriceDivForMobile) totalPriceCell.textContent = '₹' + data.total_price;
+totalPriceDivForMobile.textContent = 'Total ₹' + data.total_price;
+        document.querySelector('.total-sum').textContent = data.total_sum;
+
+document.querySelector('#finalTotal').textContent = data.total_sum;
+        document.querySelector('.ajax-discount').textContent = '₹' + data.ajax_discount;
+
+document.getElementById('redeem_points').value = "0";
+
+document.getElementById('pointsDiscount').textContent = "0";
+
+      } else {
+        alert(data.error);
+      }
+    })
+    .catch(err => {
+      console.error('Error updating cart quantity:', err);
+    });
+  }
+
+  // Helper getCookie function for CSRF token from Django docs
+  function getCookie(name) {
+    let cookieValue = null;
+    if (document.cookie && document.cookie !== '') {
+      const cookies = document.cookie.split(';');
+      for (let i = 0; i < cookies.length; i++) {
+        const cookie = cookies[i].trim();
+        if (cookie.substring(0, name.length + 1) === (name + '=')) {
+          cookieValue = decodeURIComponent(cookie.substring(name.length + 1));
+          break;
+        }
+      }
+    }
+    return cookieValue;
+  }
+
+  // Event delegation for increment/decrement buttons
+  document.querySelectorAll('.increment-btn').forEach(button => {
+    button.addEventListener('click', () => {
+      const key = button.getAttribute('data-key');
+      const input = document.querySelector(`input.quantity-input[data-key="${key}"]`);
+      let quantity = parseInt(input.value) || 1;
+      quantity += 1;
+      updateCartQuantity(key, quantity);
+    });
+  });
+
+  document.querySelectorAll('.decrement-btn').forEach(button => {
+    button.addEventListener('click', () => {
+      const key = button.getAttribute('data-key');
+      const input = document.querySelector(`input.quantity-input[data-key="${key}"]`);
+      let quantity = parseInt(input.value) || 1;
+      if (quantity > 1) {
+        quantity -= 1;
+        updateCartQuantity(key, quantity);
+      }
+    });
+  });
+});
+
+
+document.addEventListener('DOMContentLoaded', function() {
+  const input = document.getElementById('redeem_points');
+  const input_in_modal = document.getElementById('redeem_points_in_modal');
+  const incrementBtn = document.getElementById('increment-loyalty');
+  const decrementBtn = document.getElementById('decrement-loyalty');
+  const pointsDiscountSpan = document.getElementById('pointsDiscount');
+  const finalTotalSpan = document.getElementById('finalTotal');
+
+  const maxPoints = parseInt(input.getAttribute('max'), 10) || 0;
+  const minPoints = parseInt(input.getAttribute('min'), 10) || 0;
+
+  // Function to update UI
+  function updateTotalWithRedeem() {
+
+    let originalTotal = parseFloat(document.getElementById('originalTotal').textContent) || 0;
+
+    let redeemPoints = parseInt(input.value) || 0;
+    // Clamp value (shouldn't be necessary, but for safety)
+    redeemPoints = Math.min(Math.max(redeemPoints, minPoints), maxPoints);
+    input.value = redeemPoints;
+
+    const newTotal = Math.max(originalTotal - redeemPoints, 0);
+
+    pointsDiscountSpan.textContent = redeemPoints.toLocaleString(undefined, {minimumFractionDigits: 2, maximumFractionDigits: 2});
+    finalTotalSpan.textContent = newTotal.toLocaleString(undefined, {minimumFractionDigits: 2, maximumFractionDigits: 2});
+    input_in_modal.value = redeemPoints
+  }
+
+  // Increment button action
+  incrementBtn.addEventListener('click', function() {
+    let current = parseInt(input.value) || 0;
+    if (current < maxPoints) {
+      input.value = current + 1;
+      updateTotalWithRedeem();
+    }
+  });
+
+  // Decrement button action
+  decrementBtn.addEventListener('click', function() {
+    let current = parseInt(input.value) || 0;
+    if (current > minPoints) {
+      input.value = current - 1;
+      updateTotalWithRedeem();
+    }
+  });
+
+  // Initialize UI at start
+  updateTotalWithRedeem();
+});
+
+
+document.addEventListener('DOMContentLoaded', function() {
+  const pincodeInput = document.getElementById('pincode');
+  const quote = document.getElementById('deliveryQuote');
+  const checkoutError = document.getElementById('checkoutError');
+  const submitBtn = document.getElementById('checkoutSubmitBtn');
+
+  // Show the delivery charge for the entered pincode before the order is placed
+  pincodeInput.addEventListener('input', function() {
+    const pincode = pincodeInput.value.trim();
+    quote.classList.add('d-none');
+    checkoutError.classList.add('d-none');
+    submitBtn.disabled = false;
+    if (pincode.length !== 6) return;
+
+    fetch(cartConfig.deliveryUrl + "?pincode=" + encodeURIComponent(pincode))
+    .then(response => response.json())
+    .then(data => {
+      if (pincodeInput.value.trim() !== pincode) return;
+      if (!data.success || !data.serviceable) {
+        checkoutError.textContent = data.success ? 'Sorry, we do not deliver to this pincode yet.' : data.error;
+        checkoutError.classList.remove('d-none');
+        submitBtn.disabled = true;
+        return;
+      }
+      if (cartConfig.vipUser) {
+        quote.textContent = 'Delivery to ' + data.pincode + ': Free for you 🎉';
+      } else {
+        quote.textContent = 'Delivery to ' + data.pincode + ': ₹' + data.charge;
+      }
+      quote.classList.remove('d-none');
+    });
+  });
+});
@@ -0,0 +1,211 @@
+  function showColorGallery(colorId, productId) {
+updateChevronVisibility(colorId);
+    document.getElementsByClassName('color_id').value=colorId;
+    fetch(`/product_detail/${productId}/get-stock-quantity/${colorId}`,{
+      method: 'GET',
+    }
+    ).then(response => response.json())
+    .then(data => {
+
+      if(data.success){
+        let stockQtyElements = document.getElementsByClassName('stock_qty');
+        for (let el of stockQtyElements) {
+          el.textContent = data.stock_qty;  // Or el.innerText = data.stock_qty;
+      }
+        let OrderQtyElements = document.getElementsByClassName('order-qty');
+        for (let el of OrderQtyElements) {
+          el.max = data.stock_qty;  // Or el.innerText = data.stock_qty;
+          el.value = "1"
+      }
+      }
+    })
+
+    // Hide all galleries
+    document.querySelectorAll('.color-gallery').forEach(g => g.style.display = 'none');
+    // Show selected gallery
+    document.getElementById('gallery-' + colorId).style.display = 'block';
+
+    // Update swatch active button
+    document.querySelectorAll('#colorSwatches button').forEach(btn => btn.classList.remove('active'));
+    const activeBtn = document.querySelector('#colorSwatches button[data-color="'+ colorId +'"]');
+    if(activeBtn) activeBtn.classList.add('active');
+document.querySelector('.color_id_hidden').value=colorId;
+  }
+
+  // Live stock: the server pushes {color_id: qty} whenever stock for this product changes.
+  // The stream URL is on this script's tag.
+  if (window.EventSource) {
+    const stockStream = new EventSource(document.currentScript.dataset.stockStream);
+    stockStream.addEventListener('stock', function (e) {
+      const stock = JSON.parse(e.data);
+      const selected = document.querySelector('.color_id_hidden').value;
+      if (!(selected in stock)) return;
+      for (let el of document.getElementsByClassName('stock_qty')) {
+        el.textContent = stock[selected];
+      }
+      const qtyInput = document.getElementById('qty');
+      qtyInput.setAttribute('max', stock[selected]);
+      if (parseInt(qtyInput.value, 10) > stock[selected]) {
+        qtyInput.value = stock[selected];
+      }
+    });
+  }
+
+  // Reviews are fetched a page at a time once the section scrolls into view
+  const reviewList = document.getElementById('reviewList');
+  if (reviewList) {
+    function loadReviews(before) {
+      const url = before ? `${reviewList.dataset.url}?before=${before}` : reviewList.dataset.url;
+      fetch(url).then(res => res.text()).then(html => {
+        reviewList.insertAdjacentHTML('beforeend', html);
+      });
+    }
+    reviewList.addEventListener('click', function (e) {
+      const button = e.target.closest('.load-more-reviews');
+      if (!button) return;
+      button.remove();
+      loadReviews(button.dataset.before);
+    });
+    if (window.IntersectionObserver) {
+      const observer = new IntersectionObserver(function (entries) {
+        if (entries.some(entry => entry.isIntersecting)) {
+          observer.disconnect();
+          loadReviews();
+        }
+      }, {rootMargin: '200px'});
+      observer.observe(reviewList);
+    } else {
+      loadReviews();
+    }
+  }
+
+  function nextImage(colorId) {
+    const img = document.getElementById('mainImage-' + colorId);
+    if (!img) return;
+    const urls = img.getAttribute('data-image-urls').split(',').map(u => u.trim());
+    let index = parseInt(img.getAttribute('data-index'), 10) || 0;
+    index = (index + 1) % urls.length;
+    img.src = urls[index];
+    img.setAttribute('data-index', index);
+    updateCounter(colorId, index + 1, urls.length);
+  }
+
+  function prevImage(colorId) {
+    const img = document.getElementById('mainImage-' + colorId);
+    if (!img) return;
+    const urls = img.getAttribute('data-image-urls').split(',').map(u => u.trim());
+    let index = parseInt(img.getAttribute('data-index'), 10) || 0;
+    index = (index - 1 + urls.length) % urls.length;
+    img.src = urls[index];
+    img.setAttribute('data-index', index);
+    updateCounter(colorId, index + 1, urls.length);
+  }
+
+  function updateCounter(colorId, current, total) {
+    const counter = document.getElementById('counter-' + colorId);
+    if(counter) counter.textContent = current + ' / ' + total;
+  }
+
+  document.addEventListener('DOMContentLoaded', () => {
+    const orderQty = document.querySelector('.order-qty');
+    if (orderQty) {
+      orderQty.addEventListener('change', function() {
+        if (parseInt(this.value, 10) > parseInt(this.max, 10)) {
+          alert('Sorry! We have limited stock only for this item.');
+          this.value = this.max;
+        }
+      });
+    }
+  });
+
+  document.addEventListener('DOMContentLoaded', function () {
+    const qtyInput = document.getElementById('qty');
+    const btnIncrease = document.getElementById('qty-increase');
+    const btnDecrease = document.getElementById('qty-decrease');
+    const cartButton = document.getElementById('cart-button');
+
+    if(qtyInput.value === "0" || qtyInput.value === "" || qtyInput.value === 0){
+      cartButton.disabled = true;
+    }else {
+      cartButton.disabled = false
+    };
+
+    btnIncrease.addEventListener('click', () => {
+        let currentValue = parseInt(qtyInput.value) || 0;
+        const max = parseInt(qtyInput.getAttribute('max')) || 0;
+        if (currentValue < max) {
+            qtyInput.value = currentValue + 1;
+        }
+        if(qtyInput.value === "0" || qtyInput.value === "" || qtyInput.value === 0){
+          cartButton.disabled = true;
+        }else {
+          cartButton.disabled = false
+        };
+
+    });
+
+    btnDecrease.addEventListener('click', () => {
+        let currentValue = parseInt(qtyInput.value) || 0;
+        const min = parseInt(qtyInput.getAttribute('min')) || 0;
+        if (currentValue > min) {
+            qtyInput.value = currentValue - 1;
+        }
+        if(qtyInput.value === "0" || qtyInput.value === "" || qtyInput.value === 0){
+          cartButton.disabled = true;
+        }else {
+          cartButton.disabled = false
+        };
+
+    });
+
+    });
+
+
+  function showWishlistPopup() {
+    var toastEl = document.getElementById('wishlistToast');
+    var toast = new bootstrap.Toast(toastEl, { delay: 3000 });
+    toast.show();
+  }
+
+  function addToWishlist(productID) {
+    console.log(productID);
+      fetch(`/product_detail/${productID}/wishlist/add/${productID}`,{
+        method: 'GET'
+      }
+    ).then(response => response.json())
+    .then(data=>{
+      if(data.success){
+        showWishlistPopup();
+      }
+    })
+    }
+
+   function updateChevronVisibility(colorId) {
+  const img = document.getElementById('mainImage-' + colorId);
+  if (!img) return;
+
+  // Get the array of image URLs from data attribute
+  const urls = img.getAttribute('data-image-urls').split(',').map(u => u.trim());
+
+  // Find the next button (right arrow) inside the same gallery container
+  const nextBtn = img.parentElement.querySelector('.gallery-arrow-btn.position-absolute[style*="right:"]');
+
+const prevBtn = img.parentElement.querySelector('.gallery-arrow-btn.position-absolute[style*="left:"]');
+
+  // Show the next button only if more than one image exists
+  if (urls.length > 1) {
+    nextBtn.style.display = 'flex';
+    prevBtn.style.display = 'flex';
+
+  } else {
+    nextBtn.style.display = 'none';
+    prevBtn.style.display = 'none';
+  }
+}
+
+// Call this function after the page loads for all color galleries
+document.addEventListener('DOMContentLoaded', () => {
+  document.querySelectorAll('.color-gallery').forEach(gallery => {
+    updateChevronVisibility(gallery.dataset.color);
+  });
+});
@@ -0,0 +1,56 @@
+// Sidebar responsive overlay toggle for mobile
+const sidebar = document.getElementById('sidebarNav');
+const sidebarBtn = document.getElementById('sidebarToggleBtn');
+const backdrop = document.getElementById('sidebarBackdrop');
+
+// Close sidebar when clicking outside (on mobile)
+document.addEventListener('click', function(event) {
+  const clickedInsideSidebar = sidebar.contains(event.target);
+  const clickedOnToggleBtn = sidebarBtn.contains(event.target);
+
+  // Only close for small screens AND if sidebar is visible
+  if (
+    window.innerWidth < 992 &&
+    sidebar.classList.contains('sidebar-show') &&
+    !clickedInsideSidebar &&
+    !clickedOnToggleBtn
+  ) {
+    closeSidebar();
+  }
+});
+
+
+
+      function closeSidebar() {
+        sidebar.classList.remove('sidebar-show');
+        backdrop.classList.add('d-none');
+      }
+      function openSidebar() {
+        sidebar.classList.add('sidebar-show');
+        backdrop.classList.remove('d-none');
+      }
+      if (sidebarBtn) {
+        sidebarBtn.onclick = function () {
+          if (sidebar.classList.contains('sidebar-show')) {
+            closeSidebar();
+          } else {
+            openSidebar();
+          }
+        }
+      }
+      if (backdrop) {
+        backdrop.onclick = closeSidebar;
+      }
+      // Hide sidebar by default on small screens
+      function handleResize() {
+        if (window.innerWidth < 992) {
+          sidebar.classList.remove('sidebar-show');
+          // Don't show backdrop unless sidebar is manually open
+          backdrop.classList.add('d-none');
+        } else {
+          sidebar.classList.remove('sidebar-show');
+          backdrop.classList.add('d-none');
+        }
+      }
+      window.addEventListener('resize', handleResize);
+      document.addEventListener('DOMContentLoaded', handleResize);
@@ -0,0 +1,73 @@
+import io
+
+import rcssmin
+import rjsmin
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps
+from whitenoise.storage import CompressedManifestStaticFilesStorage
+
+JPEG_QUALITY = 82
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp')
+
+
+def minify(path, content):
+    if path.endswith(('.min.css', '.min.js')):
+        return None
+    if path.endswith('.css'):
+        return rcssmin.cssmin(content.decode('utf-8')).encode('utf-8')
+    if path.endswith('.js'):
+        return rjsmin.jsmin(content.decode('utf-8')).encode('utf-8')
+    return None
+
+
+def optimize_image(content):
+    # Re-encoded in the file's own format (placeholder.jpg is a WebP), only kept when smaller
+    image = Image.open(io.BytesIO(content))
+    kind = image.format
+    options = {'optimize': True}
+    if kind == 'JPEG':
+        options.update(quality=JPEG_QUALITY, progressive=True)
+    elif kind == 'WEBP':
+        options.update(quality=JPEG_QUALITY, method=6)
+    elif kind != 'PNG':
+        return None
+    if image.info.get('icc_profile'):
+        options['icc_profile'] = image.info['icc_profile']
+    # Metadata is dropped, so the EXIF rotation is applied to the pixels first
+    image = ImageOps.exif_transpose(image)
+    out = io.BytesIO()
+    image.save(out, kind, **options)
+    return out.getvalue() if out.tell() < len(content) else None
+
+
+class StaticStorage(CompressedManifestStaticFilesStorage):
+    # collectstatic minifies CSS and JS and recompresses images before the files are hashed, so
+    # the hashed names (served with far-future immutable caching) and the .gz/.br copies whitenoise
+    # makes are of the smaller files
+    def post_process(self, paths, dry_run=False, **options):
+        if not dry_run:
+            paths = {path: self.optimize(path, storage, source) for path, (storage, source) in paths.items()}
+        yield from super().post_process(paths, dry_run, **options)
+
+    def optimize(self, path, storage, source):
+        # Always made from the source file: collectstatic skips copying unchanged files and a
+        # JPEG recompressed on every deploy would lose quality each time
+        with storage.open(source) as original:
+            content = original.read()
+        if path.lower().endswith(IMAGE_EXTENSIONS):
+            optimized = optimize_image(content)
+        else:
+            optimized = minify(path, content)
+        if optimized is None:
+            return storage, source
+        self.delete(path)
+        self._save(path, ContentFile(optimized))
+        return self, path
+
+    def stored_name(self, name):
+        # Before collectstatic has run (tests, a fresh checkout) pages link the plain name
+        # instead of failing to render
+        try:
+            return super().stored_name(name)
+        except ValueError:
+            return name
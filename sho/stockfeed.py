@@ -0,0 +1,108 @@
+import asyncio
+from collections import defaultdict
+
+from asgiref.sync import sync_to_async
+
+from .models import ProductColor
+
+# Stock changed by other processes (another web worker, the admin) is picked up by one query per
+# interval for every watched product, rather than one poll per open page
+STOCK_POLL_INTERVAL = 2
+HEARTBEAT_INTERVAL = 15
+# Open streams per process. Each one holds at most one pending qty per color of its product.
+MAX_STREAMS = 1000
+
+
+def current_stock(product_ids):
+    return list(ProductColor.objects.filter(product_id__in=product_ids).values_list('product_id', 'id', 'qty'))
+
+
+class Subscription:
+    def __init__(self, product_id):
+        self.product_id = product_id
+        # Changes not yet sent, coalesced per color so a slow client never builds up a backlog
+        self.pending = {}
+        self.ready = asyncio.Event()
+        self.closed = False
+
+    def offer(self, color_id, qty):
+        self.pending[color_id] = qty
+        self.ready.set()
+
+    def close(self):
+        self.closed = True
+        self.ready.set()
+
+    async def changes(self, timeout):
+        try:
+            await asyncio.wait_for(self.ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            return {}
+        self.ready.clear()
+        changes, self.pending = self.pending, {}
+        return changes
+
+
+# In-process fan-out of ProductColor.qty changes to the open stock streams. It lives on the ASGI
+# event loop, publish() may be called from any thread.
+class StockFeed:
+    def __init__(self):
+        self.loop = None
+        self.subscribers = defaultdict(set)
+        # product id -> {color id: qty} last sent to that product's subscribers
+        self.last_seen = {}
+        self.poller = None
+
+    def __len__(self):
+        return sum(len(subs) for subs in self.subscribers.values())
+
+    def watching(self):
+        return bool(self.subscribers)
+
+    def subscribe(self, product_id):
+        self.loop = asyncio.get_running_loop()
+        subscription = Subscription(product_id)
+        self.subscribers[product_id].add(subscription)
+        self.last_seen.setdefault(product_id, {})
+        if self.poller is None or self.poller.done():
+            self.poller = self.loop.create_task(self.poll())
+        return subscription
+
+    def unsubscribe(self, subscription):
+        subs = self.subscribers.get(subscription.product_id)
+        if subs is None:
+            return
+        subs.discard(subscription)
+        if not subs:
+            del self.subscribers[subscription.product_id]
+            self.last_seen.pop(subscription.product_id, None)
+
+    def publish(self, rows):
+        loop = self.loop
+        if loop is None or loop.is_closed():
+            return
+        loop.call_soon_threadsafe(self.dispatch, list(rows))
+
+    def dispatch(self, rows):
+        for product_id, color_id, qty in rows:
+            seen = self.last_seen.get(product_id)
+            if seen is None or seen.get(color_id) == qty:
+                continue
+            seen[color_id] = qty
+            for subscription in self.subscribers[product_id]:
+                subscription.offer(color_id, qty)
+
+    async def poll(self):
+        while self.subscribers:
+            await asyncio.sleep(STOCK_POLL_INTERVAL)
+            if self.subscribers:
+                self.dispatch(await sync_to_async(current_stock)(list(self.subscribers)))
+
+
+stock_feed = StockFeed()
+
+
+def stock_changed(color_ids):
+    # Called after a stock decrement commits. Nothing to read when no page in this process is watching.
+    if stock_feed.watching():
+        stock_feed.publish(ProductColor.objects.filter(id__in=color_ids).values_list('product_id', 'id', 'qty'))
@@ -0,0 +1,265 @@
+import socket
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage, Storage
+from django.db import connections, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.deconstruct import deconstructible
+from django.utils.module_loading import import_string
+
+# Unsigned URLs don't expire, they are only cached for this long so config changes get picked up
+PUBLIC_URL_TTL = 24 * 60 * 60
+URL_CACHE_MAX_NAMES = 20000
+
+
+class URLCache:
+    # name -> {variant: (url, expires_at)}, least recently used names are dropped first
+    def __init__(self, max_names=URL_CACHE_MAX_NAMES):
+        self.max_names = max_names
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, name, variant):
+        with self.lock:
+            variants = self.entries.get(name)
+            if not variants or variant not in variants:
+                return None
+            url, expires_at = variants[variant]
+            if expires_at <= time.monotonic():
+                del variants[variant]
+                if not variants:
+                    del self.entries[name]
+                return None
+            self.entries.move_to_end(name)
+            return url
+
+    def set(self, name, variant, url, ttl):
+        with self.lock:
+            self.entries.setdefault(name, {})[variant] = (url, time.monotonic() + ttl)
+            self.entries.move_to_end(name)
+            while len(self.entries) > self.max_names:
+                self.entries.popitem(last=False)
+
+    def get_many(self, names, variant):
+        # One lock round for a whole page of names, expired entries are left to get()
+        now = time.monotonic()
+        found = {}
+        with self.lock:
+            for name in names:
+                url, expires_at = self.entries.get(name, {}).get(variant, (None, now))
+                if expires_at > now:
+                    self.entries.move_to_end(name)
+                    found[name] = url
+        return found
+
+    def set_many(self, urls, variant, ttl):
+        expires_at = time.monotonic() + ttl
+        with self.lock:
+            for name, url in urls.items():
+                self.entries.setdefault(name, {})[variant] = (url, expires_at)
+                self.entries.move_to_end(name)
+            while len(self.entries) > self.max_names:
+                self.entries.popitem(last=False)
+
+    def forget(self, name):
+        with self.lock:
+            self.entries.pop(name, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class CachedURLMixin:
+    url_cache_max_names = URL_CACHE_MAX_NAMES
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.url_cache = URLCache(self.url_cache_max_names)
+
+    def url_ttl(self, expire=None):
+        return PUBLIC_URL_TTL
+
+    def url(self, name, *args, **kwargs):
+        variant = (args, tuple(sorted((key, repr(value)) for key, value in kwargs.items())))
+        url = self.url_cache.get(name, variant)
+        if url is None:
+            url = super().url(name, *args, **kwargs)
+            self.url_cache.set(name, variant, url, self.url_ttl(kwargs.get('expire')))
+        return url
+
+    def urls(self, names):
+        # Batch form for lists of images: hits are read and misses stored under one lock each, repeats
+        # and empty names are resolved at most once
+        names = list(dict.fromkeys(name for name in names if name))
+        variant = ((), ())
+        urls = self.url_cache.get_many(names, variant)
+        missing = {}
+        for name in names:
+            if name not in urls:
+                missing[name] = super().url(name)
+        if missing:
+            self.url_cache.set_many(missing, variant, self.url_ttl())
+        return {name: urls.get(name) or missing[name] for name in names}
+
+    def _save(self, name, content):
+        name = super()._save(name, content)
+        self.url_cache.forget(name)
+        return name
+
+    def delete(self, name):
+        super().delete(name)
+        self.url_cache.forget(name)
+
+
+class CachedURLFileSystemStorage(CachedURLMixin, FileSystemStorage):
+    pass
+
+
+# Background pushes: thread pool in the web process, with push_pending_uploads as the sweeper
+OFFLOAD_WORKERS = 4
+OFFLOAD_ATTEMPTS = 3
+OFFLOAD_BACKOFF = 2  # seconds, doubled after every failed attempt
+OFFLOAD_CLAIM_SECONDS = 300
+
+_offload_executor = None
+_offload_executor_lock = threading.Lock()
+
+
+def offload_executor():
+    global _offload_executor
+    with _offload_executor_lock:
+        if _offload_executor is None:
+            _offload_executor = ThreadPoolExecutor(max_workers=OFFLOAD_WORKERS, thread_name_prefix='media-offload')
+        return _offload_executor
+
+
+@deconstructible
+class OffloadedStorage(Storage):
+    """
+    Writes uploads to local disk and returns at once; the remote backend gets the file from a
+    background thread. Files are served from local disk until the remote copy is confirmed.
+
+    The local disk is only readable on the host that wrote the file, so every PendingUpload row
+    records its host and only that host pushes it (push_pending_uploads must run on each web host).
+    """
+
+    def __init__(self, remote_backend='sho.s3storage.CachedURLS3Storage', remote_options=None, location=None, base_url=None,
+                 host=None):
+        self.remote_backend = remote_backend
+        self.remote_options = remote_options or {}
+        self.remote = import_string(remote_backend)(**self.remote_options)
+        self.local = FileSystemStorage(
+            location=location or settings.MEDIA_OFFLOAD_ROOT,
+            base_url=base_url or settings.MEDIA_OFFLOAD_URL,
+        )
+        self.host = host or socket.gethostname()
+
+    def _open(self, name, mode='rb'):
+        if self.local.exists(name):
+            return self.local.open(name, mode)
+        return self.remote.open(name, mode)
+
+    def _save(self, name, content):
+        from .models import PendingUpload
+
+        if self.local.exists(name):
+            self.local.delete(name)
+        name = self.local.save(name, content)
+        PendingUpload.objects.update_or_create(
+            name=name,
+            defaults={
+                'host': self.host, 'attempts': 0, 'last_error': '',
+                'next_attempt_at': timezone.now() + timedelta(seconds=OFFLOAD_CLAIM_SECONDS),
+            },
+        )
+        # Push only once the row referencing the file is committed
+        transaction.on_commit(lambda: offload_executor().submit(self.push_in_background, name))
+        return name
+
+    def get_available_name(self, name, max_length=None):
+        if getattr(self.remote, 'file_overwrite', False):
+            return self.remote.get_available_name(name, max_length)
+        return super().get_available_name(name, max_length)
+
+    def exists(self, name):
+        return self.local.exists(name) or self.remote.exists(name)
+
+    def delete(self, name):
+        from .models import PendingUpload
+
+        PendingUpload.objects.filter(name=name).delete()
+        self.local.delete(name)
+        self.remote.delete(name)
+
+    def size(self, name):
+        if self.local.exists(name):
+            return self.local.size(name)
+        return self.remote.size(name)
+
+    def url(self, name):
+        # The local file is there until the push is confirmed, whichever process on this host staged it
+        # and across restarts. Other hosts' uploads link the remote copy, there once their push is done.
+        if self.local.exists(name):
+            return self.local.url(name)
+        return self.remote.url(name)
+
+    def push(self, name):
+        from .models import PendingUpload
+
+        delay = OFFLOAD_BACKOFF
+        for attempt in range(1, OFFLOAD_ATTEMPTS + 1):
+            try:
+                if not self.local.exists(name):
+                    # Without its row the file was deleted or pushed meanwhile. With it, the disk lost the
+                    # file (restart, wrong host): the row stays, with the error, for someone to re-upload.
+                    return not PendingUpload.objects.filter(name=name).update(
+                        attempts=F('attempts') + 1, last_error=f"Local file {name} is missing",
+                    )
+                if attempt > 1 and self.remote.exists(name):
+                    self.remote.delete(name)
+                with self.local.open(name) as content:
+                    saved = self.remote._save(name, content)
+                if saved != name:
+                    raise OSError(f"Remote storage saved {name} as {saved}")
+                PendingUpload.objects.filter(name=name).delete()
+                self.local.delete(name)
+                return True
+            except Exception as e:
+                PendingUpload.objects.filter(name=name).update(
+                    attempts=F('attempts') + 1,
+                    last_error=repr(e),
+                    next_attempt_at=timezone.now() + timedelta(seconds=delay * 2),
+                )
+                if attempt < OFFLOAD_ATTEMPTS:
+                    time.sleep(delay)
+                    delay *= 2
+        return False
+
+    def push_in_background(self, name):
+        try:
+            return self.push(name)
+        finally:
+            # Pool threads get their own DB connections, don't leave them open
+            connections.close_all()
+
+    def push_pending(self, limit=100):
+        from .models import PendingUpload
+
+        now = timezone.now()
+        names = list(
+            PendingUpload.objects.filter(host=self.host, next_attempt_at__lte=now).order_by('next_attempt_at').values_list('name', flat=True)[:limit]
+        )
+        claimed = [
+            name for name in names
+            if PendingUpload.objects.filter(name=name, next_attempt_at__lte=now).update(
+                next_attempt_at=now + timedelta(seconds=OFFLOAD_CLAIM_SECONDS)
+            )
+        ]
+        return list(offload_executor().map(self.push_in_background, claimed))
@@ -0,0 +1,104 @@
+import asyncio
+import itertools
+import json
+import re
+
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+
+from .models import Product
+from .stockfeed import HEARTBEAT_INTERVAL, MAX_STREAMS, current_stock, stock_feed
+
+STOCK_STREAM_PATH = re.compile(r'^/stream/stock/(?P<product_id>\d+)/$')
+# Chunks of a streamed download read per trip to the sync thread
+STREAM_BATCH_SIZE = 100
+
+SSE_HEADERS = [
+    (b'content-type', b'text/event-stream'),
+    (b'cache-control', b'no-cache'),
+    # Stop proxies (Heroku router, nginx) from buffering the stream
+    (b'x-accel-buffering', b'no'),
+]
+
+
+async def plain_response(send, status, body):
+    await send({'type': 'http.response.start', 'status': status, 'headers': [(b'content-type', b'text/plain')]})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+def stock_event(stock):
+    return f"event: stock\ndata: {json.dumps(stock)}\n\n".encode()
+
+
+async def watch_disconnect(receive, subscription):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+    subscription.close()
+
+
+async def stock_stream(scope, receive, send, product_id):
+    if len(stock_feed) >= MAX_STREAMS:
+        # The page falls back to fetching stock when a swatch is clicked
+        return await plain_response(send, 503, b'Too many stock streams')
+    if not await sync_to_async(Product.objects.filter(pk=product_id).exists)():
+        return await plain_response(send, 404, b'Not found')
+
+    subscription = stock_feed.subscribe(product_id)
+    watcher = asyncio.ensure_future(watch_disconnect(receive, subscription))
+    try:
+        rows = await sync_to_async(current_stock)([product_id])
+        stock_feed.dispatch(rows)
+        # This client gets the snapshot below, not the change events it just caused
+        subscription.pending.clear()
+        subscription.ready.clear()
+        await send({'type': 'http.response.start', 'status': 200, 'headers': SSE_HEADERS})
+        await send({
+            'type': 'http.response.body',
+            'body': stock_event({color_id: qty for _, color_id, qty in rows}),
+            'more_body': True,
+        })
+        while True:
+            changes = await subscription.changes(HEARTBEAT_INTERVAL)
+            if subscription.closed:
+                break
+            body = stock_event(changes) if changes else b': keepalive\n\n'
+            await send({'type': 'http.response.body', 'body': body, 'more_body': True})
+    except OSError:
+        pass
+    finally:
+        stock_feed.unsubscribe(subscription)
+        watcher.cancel()
+
+
+def with_stock_streams(application):
+    # Stock streams are answered here, before Django, so an open stream holds no thread or DB connection
+    async def app(scope, receive, send):
+        if scope['type'] == 'http' and scope['method'] == 'GET':
+            match = STOCK_STREAM_PATH.match(scope['path'])
+            if match:
+                return await stock_stream(scope, receive, send, int(match['product_id']))
+        return await application(scope, receive, send)
+    return app
+
+
+async def async_chunks(chunks):
+    # The sync iterator (a DB cursor, a storage file) is read in the thread-sensitive sync thread,
+    # a batch at a time, and each batch is sent before the next is read
+    chunks = iter(chunks)
+    next_batch = sync_to_async(lambda: list(itertools.islice(chunks, STREAM_BATCH_SIZE)))
+    try:
+        while batch := await next_batch():
+            for chunk in batch:
+                yield chunk
+    finally:
+        close = getattr(chunks, 'close', None)
+        if close:
+            await sync_to_async(close)()
+
+
+def response_chunks(request, chunks):
+    # Under ASGI Django reads a sync iterator to the end with one sync_to_async(list) before sending
+    # the first byte, so streamed responses are handed over as async iterators there
+    if isinstance(request, ASGIRequest):
+        return async_chunks(chunks)
+    return chunks
@@ -0,0 +1,132 @@
+import logging
+import os
+import threading
+import traceback
+from datetime import timedelta
+
+from django.db import connection, connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Task
+
+logger = logging.getLogger(__name__)
+
+RETRY_BACKOFF = 10  # seconds, doubled after every failed attempt
+STALE_AFTER = timedelta(minutes=15)
+# Finished rows are only kept for looking into; Failed ones longer, they need someone to act on them
+DONE_RETENTION = timedelta(days=7)
+FAILED_RETENTION = timedelta(days=30)
+PURGE_BATCH_SIZE = 1000
+
+handlers = {}
+
+
+def task(name):
+    def register(func):
+        handlers[name] = func
+        return func
+    return register
+
+
+def enqueue(name, payload=None, key=None, delay=0, max_attempts=5):
+    # Plain insert: inside the caller's transaction it becomes visible to workers only on commit
+    task = Task(
+        name=name,
+        payload=payload or {},
+        key=key,
+        max_attempts=max_attempts,
+        run_at=timezone.now() + timedelta(seconds=delay),
+    )
+    if key:
+        Task.objects.bulk_create([task], ignore_conflicts=True)
+    else:
+        task.save()
+    return task
+
+
+def claim_task(worker_id):
+    now = timezone.now()
+    with transaction.atomic():
+        due = Task.objects.filter(status='Queued', run_at__lte=now).order_by('run_at', 'id')
+        if connection.features.has_select_for_update_skip_locked:
+            due = due.select_for_update(skip_locked=True)
+        task = due.first()
+        if task is None:
+            return None
+        claimed = Task.objects.filter(pk=task.pk, status='Queued').update(
+            status='Running', locked_at=now, locked_by=worker_id, attempts=F('attempts') + 1,
+        )
+    if not claimed:
+        return None
+    task.refresh_from_db()
+    return task
+
+
+class TaskLost(Exception):
+    pass
+
+
+def run_task(task):
+    handler = handlers.get(task.name)
+    try:
+        # The handler's writes commit together with the Done mark. A worker dying in between leaves
+        # neither, so the retry doesn't repeat work (outbox mails, snapshots) that already committed.
+        with transaction.atomic():
+            if handler is None:
+                raise LookupError(f"No handler registered for {task.name!r}")
+            handler(**task.payload)
+            finished = Task.objects.filter(
+                pk=task.pk, status='Running', locked_by=task.locked_by, locked_at=task.locked_at,
+            ).update(status='Done', finished_at=timezone.now())
+            if not finished:
+                raise TaskLost
+    except TaskLost:
+        # Requeued as stale while it ran, the rollback leaves it to whichever worker has it now
+        logger.warning("Task %s #%s was requeued while running, its work was rolled back", task.name, task.pk)
+        return False
+    except Exception:
+        error = traceback.format_exc()
+        logger.warning("Task %s #%s failed (attempt %s)", task.name, task.pk, task.attempts)
+        if task.attempts >= task.max_attempts:
+            Task.objects.filter(pk=task.pk).update(status='Failed', last_error=error, finished_at=timezone.now())
+        else:
+            retry_at = timezone.now() + timedelta(seconds=RETRY_BACKOFF * 2 ** (task.attempts - 1))
+            Task.objects.filter(pk=task.pk).update(status='Queued', last_error=error, run_at=retry_at)
+        return False
+    return True
+
+
+def requeue_stale_tasks():
+    # Tasks of a worker that died mid-run
+    return Task.objects.filter(status='Running', locked_at__lt=timezone.now() - STALE_AFTER).update(status='Queued')
+
+
+def purge_finished_tasks(done_older_than=DONE_RETENTION, failed_older_than=FAILED_RETENTION, batch_size=PURGE_BATCH_SIZE):
+    # Short deletes, each batch commits on its own. A purged keyed task can be enqueued again, the
+    # handlers are idempotent.
+    now = timezone.now()
+    purged = 0
+    for status, older_than in (('Done', done_older_than), ('Failed', failed_older_than)):
+        finished = Task.objects.filter(status=status, finished_at__lt=now - older_than)
+        while ids := list(finished.values_list('id', flat=True)[:batch_size]):
+            purged += Task.objects.filter(pk__in=ids).delete()[0]
+    return purged
+
+
+def work(stop_event, poll_interval=1.0, once=False):
+    worker_id = f"{os.uname().nodename}:{os.getpid()}:{threading.get_ident()}"
+    processed = 0
+    try:
+        while not stop_event.is_set():
+            task = claim_task(worker_id)
+            if task is None:
+                if once:
+                    break
+                stop_event.wait(poll_interval)
+                continue
+            run_task(task)
+            processed += 1
+    finally:
+        connections.close_all()
+    return processed
@@ -0,0 +1,24 @@
+from decimal import Decimal
+
+from django.db.models import F, Sum
+
+from .models import Order
+from .points import earn_points
+from .taskqueue import task
+from .wishlists import send_alerts
+
+
+# Handlers run at least once, so each must be safe to repeat
+
+@task('order.award_points')
+def award_order_points(order_id):
+    order = Order.objects.select_related('user').get(pk=order_id)
+    spent = order.items.aggregate(total=Sum(F('price') * F('quantity')))['total'] or 0
+    points = Decimal(spent) / 100
+    if points:
+        earn_points(order.user, points, order)
+
+
+@task('wishlist.send_alerts')
+def send_wishlist_alerts(alerts, changes):
+    send_alerts(alerts, changes)
@@ -1,3 +1,1629 @@
-from django.test import TestCase
-
-# Create your tests here.
+import asyncio
+import csv
+import gzip
+import json
+import os
+import re
+import smtplib
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+from urllib.parse import urlencode
+from decimal import Decimal
+from io import StringIO
+from unittest.mock import patch
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser, User
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core import mail
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.core.mail import EmailMessage, get_connection
+from django.core.mail.backends.base import BaseEmailBackend
+from django.core.signals import request_finished, request_started
+from django.core.management import CommandError, call_command
+from django.db import close_old_connections, connection
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from .api import API_PRODUCTS_PER_PAGE
+from .backends import ProfileModelBackend
+from .campaigns import apply_campaign, revert_campaign, run_due_campaigns
+from .delivery import ZoneIndex, delivery_quote, parse_pincode, zone_cache
+from .exports import day_start, export_rows
+from .fakegateway import fake_gateway, reset_fake_gateway
+from .feeds import FEED_WATERMARK, PRODUCT_FEED_NAME, SHARD_SIZE, build_feeds, feed_storage, public_path
+from .lifecycle import (
+    ARCHIVE_AFTER, PENDING_EXPIRY, archive_batch, archive_orders, expire_pending_orders, order_history,
+)
+from .management.commands.profile_startup import STARTUP_SCRIPT, parse_importtime
+from .mail import OutboxEmailBackend, RateLimiter, claim_batch, send_batch
+from .middleware import PRIMARY_COOKIE, ReplicaRoutingMiddleware, ThrottleMiddleware
+from .models import (
+    ArchivedOrder, Category, DeliveryZone, Order, OrderItem, OutboxEmail, PendingUpload, PointsEntry, Product,
+    ProductColor, ProductImage, ProductRanking, ProductRecommendation, ProductReview, Profile, SaleCampaign,
+    SalesRollup, Task, Watermark, Wishlist, WishlistItem,
+)
+from .payments import confirm_order, settle_payment
+from .points import POINTS_LIFETIME, earn_points, expire_points, points_balance, spend_points
+from .rankings import ranked_products, refresh_rankings
+from .recommendations import build_recommendations, co_occurrence_matrix, top_recommendations
+from .rollups import MEASURES as ROLLUP_MEASURES, ROLLUP_WATERMARK, build_sales_rollups
+from .routers import REPLICA, ReplicaRouter, RoutingState, order_history_reads, routing_state
+from .s3storage import CachedURLS3Storage
+from .stockfeed import stock_feed
+from .storage import (
+    OFFLOAD_ATTEMPTS, PUBLIC_URL_TTL, CachedURLFileSystemStorage, CachedURLMixin, OffloadedStorage, URLCache,
+)
+from .streams import plain_response, stock_event, with_stock_streams
+from .taskqueue import claim_task, enqueue, run_task, task
+from .tasks import award_order_points
+from .throttle import AdmissionController, Throttle
+from .views import PRODUCTS_PER_PAGE, REVIEWS_PER_PAGE, has_ordered_ten_times
+from .wishlists import queue_wishlist_alerts, send_alerts
+
+# Create your tests here.
+
+
+class ReplicaRoutingTests(TestCase):
+    # The two test databases are independent (without DATABASE_REPLICA_URL, settings adds one for
+    # the test run), so rows only present on one of them show which database a query went to.
+    # Replica rows are bulk created to skip the save signals, which would write to the primary.
+    databases = {'default', REPLICA}
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('shopper', password='pw')
+        cls.category = Category.objects.create(name='Sarees')
+        cls.product = Product.objects.create(category=cls.category, name='On primary', price=100, after_discount_price=0)
+        User.objects.using(REPLICA).bulk_create([User(id=cls.user.id, username='shopper')])
+        Category.objects.using(REPLICA).bulk_create([Category(id=cls.category.id, name='Sarees')])
+        Product.objects.using(REPLICA).bulk_create([
+            Product(id=cls.product.id, category_id=cls.category.id, name='On replica', price=100, after_discount_price=0),
+        ])
+
+    def route(self, model, state):
+        token = routing_state.set(state)
+        try:
+            return ReplicaRouter().db_for_read(model)
+        finally:
+            routing_state.reset(token)
+
+    def test_catalog_pages_read_from_replica(self):
+        response = self.client.get(reverse('product_detail', args=[self.product.id]))
+        self.assertContains(response, 'On replica')
+        self.assertNotContains(response, 'On primary')
+
+    def test_recent_writer_reads_from_primary(self):
+        self.client.cookies[PRIMARY_COOKIE] = '1'
+        response = self.client.get(reverse('product_detail', args=[self.product.id]))
+        self.assertContains(response, 'On primary')
+
+    def test_write_pins_rest_of_request_and_sets_cookie(self):
+        def view(request):
+            Wishlist.objects.create(user=self.user)
+            return HttpResponse(Product.objects.get(pk=self.product.id).name)
+
+        response = ReplicaRoutingMiddleware(view)(RequestFactory().get('/'))
+        self.assertEqual(response.content, b'On primary')
+        self.assertEqual(response.cookies[PRIMARY_COOKIE]['max-age'], settings.REPLICA_STICKY_SECONDS)
+
+    def test_reads_without_writes_set_no_cookie(self):
+        response = ReplicaRoutingMiddleware(lambda request: HttpResponse(Product.objects.get(pk=self.product.id).name))(
+            RequestFactory().get('/')
+        )
+        self.assertEqual(response.content, b'On replica')
+        self.assertNotIn(PRIMARY_COOKIE, response.cookies)
+
+    def test_unsafe_methods_read_from_primary(self):
+        self.assertIsNone(self.route(Product, RoutingState(pinned=True)))
+        self.assertEqual(self.route(Product, RoutingState()), REPLICA)
+
+    def test_orders_only_read_from_replica_in_order_history(self):
+        state = RoutingState()
+        self.assertIsNone(self.route(Order, state))
+        token = routing_state.set(state)
+        try:
+            with order_history_reads():
+                self.assertEqual(ReplicaRouter().db_for_read(Order), REPLICA)
+        finally:
+            routing_state.reset(token)
+
+    def test_my_orders_reads_from_replica(self):
+        Order.objects.using(REPLICA).bulk_create([Order(
+            user_id=self.user.id, total=100, status='Confirmed', shipping_address='Replica street',
+            phone='1', pincode=600001, deliverycharge=60, redeemed_points=0,
+        )])
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('my_orders'))
+        self.assertContains(response, 'Replica street')
+
+    def test_outside_requests_use_primary(self):
+        self.assertIsNone(ReplicaRouter().db_for_read(Product))
+
+
+@override_settings(PAYMENT_GATEWAY='fake', RAZORPAY_WEBHOOK_SECRET='webhook-secret')
+class PaymentSettlementTests(TestCase):
+    def setUp(self):
+        reset_fake_gateway()
+        self.gateway = fake_gateway()
+        self.user = User.objects.create_user('buyer', password='pw')
+        category = Category.objects.create(name='Kurtis')
+        product = Product.objects.create(category=category, name='Kurti', price=500, after_discount_price=0)
+        self.color = ProductColor.objects.create(product=product, color='Red', qty=5)
+        gateway_order = self.gateway.order.create({'amount': 1000 * 100, 'currency': 'INR'})
+        self.order = Order.objects.create(
+            user=self.user, total=1000, status='Pending', razorpay_order_id=gateway_order['id'],
+            shipping_address='Street', phone='1', pincode=600001, deliverycharge=60, redeemed_points=0,
+        )
+        OrderItem.objects.create(order=self.order, product=product, color=self.color, price=500, quantity=2)
+
+    def post_webhook(self, payment, secret='webhook-secret'):
+        body, signature = self.gateway.webhook(payment, secret)
+        return self.client.post(
+            reverse('razorpay_webhook'), body, content_type='application/json', HTTP_X_RAZORPAY_SIGNATURE=signature,
+        )
+
+    def assertSettledOnce(self, payment):
+        self.order.refresh_from_db()
+        self.color.refresh_from_db()
+        self.assertEqual(self.order.status, 'Confirmed')
+        self.assertEqual(self.order.razorpay_payment_id, payment['id'])
+        self.assertEqual(self.color.qty, 3)
+        self.assertEqual(Task.objects.filter(name='order.award_points').count(), 1)
+
+    def test_webhook_settles_order_once(self):
+        payment = self.gateway.pay(self.order.razorpay_order_id)
+        self.assertEqual(self.post_webhook(payment).status_code, 200)
+        self.assertEqual(self.post_webhook(payment).status_code, 200)
+        self.assertSettledOnce(payment)
+
+    def test_webhook_rejects_bad_signature(self):
+        payment = self.gateway.pay(self.order.razorpay_order_id)
+        self.assertEqual(self.post_webhook(payment, secret='wrong').status_code, 400)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, 'Pending')
+
+    def test_checkout_callback_then_webhook(self):
+        payment = self.gateway.pay(self.order.razorpay_order_id)
+        body = {
+            'razorpay_payment_id': payment['id'],
+            'razorpay_order_id': payment['order_id'],
+            'razorpay_signature': self.gateway.checkout_signature(payment),
+            'order_id': self.order.id,
+        }
+        for _ in range(2):
+            response = self.client.post(reverse('razorpay_payment_success'), json.dumps(body), content_type='application/json')
+            self.assertTrue(response.json()['success'])
+        self.post_webhook(payment)
+        self.assertSettledOnce(payment)
+
+    def test_short_payment_is_not_settled(self):
+        payment = self.gateway.pay(self.order.razorpay_order_id, amount=100)
+        with self.assertLogs('sho.payments', 'WARNING'):
+            self.post_webhook(payment)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, 'Pending')
+
+    def test_reconcile_settles_missed_payments(self):
+        Order.objects.filter(pk=self.order.pk).update(status='Expired')
+        payment = self.gateway.pay(self.order.razorpay_order_id)
+        # Another customer's payment for an order this shop doesn't know about
+        self.gateway.pay(self.gateway.order.create({'amount': 100})['id'])
+        call_command('reconcile_payments', page_size=1, stdout=StringIO())
+        call_command('reconcile_payments', page_size=1, stdout=StringIO())
+        self.assertSettledOnce(payment)
+        self.assertFalse(PointsEntry.objects.filter(kind='Redeem').exists())
+
+    def archive(self, status):
+        Order.objects.filter(pk=self.order.pk).update(status=status, updated_at=timezone.now() - ARCHIVE_AFTER * 2)
+        self.assertEqual(archive_orders(), 1)
+
+    def test_archived_order_keeps_its_payment(self):
+        payment = self.gateway.pay(self.order.razorpay_order_id)
+        self.post_webhook(payment)
+        self.archive('Delivered')
+        self.assertEqual(ArchivedOrder.objects.get(pk=self.order.pk).razorpay_payment_id, payment['id'])
+        # A late webhook or a reconciliation run recognises the settled payment
+        with self.assertNoLogs('sho.payments', 'WARNING'):
+            self.post_webhook(payment)
+            call_command('reconcile_payments', stdout=StringIO())
+
+    def test_payment_for_archived_unpaid_order_is_flagged(self):
+        self.archive('Expired')
+        payment = self.gateway.pay(self.order.razorpay_order_id)
+        with self.assertLogs('sho.payments', 'WARNING') as logs:
+            self.post_webhook(payment)
+            call_command('reconcile_payments', stdout=StringIO())
+        self.assertEqual(len(logs.output), 2)
+        self.assertTrue(all('archived with payment None' in line for line in logs.output))
+
+
+class ProductReviewTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('reviewer', password='pw')
+        cls.product = Product.objects.create(
+            category=Category.objects.create(name='Sarees'), name='Saree', price=900, after_discount_price=0,
+        )
+
+    def setUp(self):
+        # Read the catalog from the primary, where the reviews are, when a replica is configured
+        self.client.cookies[PRIMARY_COOKIE] = '1'
+
+    def add_reviews(self, count):
+        for n in range(count):
+            ProductReview.objects.create(product=self.product, reviewer=self.user, review=f'Review {n}', review_image='r.jpg')
+
+    def test_review_count_follows_saves_and_deletes(self):
+        self.add_reviews(3)
+        ProductReview.objects.filter(product=self.product).first().delete()
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.review_count, 2)
+
+    def test_full_save_keeps_review_count(self):
+        product = Product.objects.get(pk=self.product.pk)
+        self.add_reviews(2)
+        product.name = 'Silk saree'
+        product.save()
+        product.refresh_from_db()
+        self.assertEqual((product.name, product.review_count), ('Silk saree', 2))
+
+    def test_product_page_does_not_load_reviews(self):
+        self.add_reviews(REVIEWS_PER_PAGE + 5)
+        response = self.client.get(reverse('product_detail', args=[self.product.id]))
+        self.assertContains(response, f'Customer Reviews ({REVIEWS_PER_PAGE + 5})')
+        self.assertNotContains(response, 'Review 0')
+
+    def test_reviews_are_paged_by_id(self):
+        self.add_reviews(REVIEWS_PER_PAGE + 5)
+        url = reverse('product_reviews', args=[self.product.id])
+        with self.assertNumQueries(1):
+            first = self.client.get(url)
+        self.assertEqual(len(first.context['reviews']), REVIEWS_PER_PAGE)
+        self.assertContains(first, f'Review {REVIEWS_PER_PAGE + 4}')
+        second = self.client.get(url, {'before': first.context['next_before']})
+        self.assertEqual([review.review for review in second.context['reviews']], [f'Review {n}' for n in range(4, -1, -1)])
+        self.assertIsNone(second.context['next_before'])
+
+
+class ThrottleTests(TestCase):
+    def test_bucket_allows_burst_then_refills(self):
+        throttle = Throttle({'login': (2, 60)})
+        self.assertEqual(throttle.wait('login', 'ip:1', now=0), 0)
+        self.assertEqual(throttle.wait('login', 'ip:1', now=0), 0)
+        self.assertEqual(throttle.wait('login', 'ip:1', now=0), 30)
+        # Other clients have their own bucket
+        self.assertEqual(throttle.wait('login', 'ip:2', now=0), 0)
+        self.assertEqual(throttle.wait('login', 'ip:1', now=30), 0)
+
+    def test_full_buckets_are_pruned(self):
+        throttle = Throttle({'login': (2, 60)}, max_buckets=2)
+        throttle.wait('login', 'ip:1', now=0)
+        throttle.wait('login', 'ip:2', now=0)
+        throttle.wait('login', 'ip:3', now=60)
+        self.assertEqual(set(throttle.buckets), {('login', 'ip:3')})
+
+    @override_settings(THROTTLE_RATES={'login': (1, 60)}, TRUSTED_PROXY_COUNT=1)
+    def test_middleware_limits_by_forwarded_ip(self):
+        middleware = ThrottleMiddleware(lambda request: HttpResponse('ok'))
+
+        def login(forwarded_for):
+            request = RequestFactory().post(reverse('login'), HTTP_X_FORWARDED_FOR=forwarded_for)
+            request.user = AnonymousUser()
+            return middleware(request)
+
+        self.assertEqual(login('6.6.6.6, 1.1.1.1').status_code, 200)
+        # A spoofed left-most address doesn't get a fresh bucket
+        response = login('7.7.7.7, 1.1.1.1')
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '60')
+        self.assertEqual(login('2.2.2.2').status_code, 200)
+
+    @override_settings(THROTTLE_RATES={'login': (1, 60)})
+    def test_login_page_loads_are_not_counted(self):
+        middleware = ThrottleMiddleware(lambda request: HttpResponse('ok'))
+
+        def login(method):
+            request = getattr(RequestFactory(), method)(reverse('login'))
+            request.user = AnonymousUser()
+            return middleware(request)
+
+        for _ in range(3):
+            self.assertEqual(login('get').status_code, 200)
+        self.assertEqual(login('post').status_code, 200)
+        self.assertEqual(login('post').status_code, 429)
+        self.assertEqual(login('get').status_code, 200)
+
+    def test_browsing_is_shed_before_checkout(self):
+        controller = AdmissionController({'browse': 1, 'checkout': 2})
+        self.assertTrue(controller.admit('browse'))
+        self.assertFalse(controller.admit('browse'))
+        self.assertTrue(controller.admit('checkout'))
+        self.assertFalse(controller.admit('checkout'))
+        controller.release()
+        controller.release()
+        self.assertTrue(controller.admit('browse'))
+
+
+def asgi_request(method, path, body=b'', headers=(), pulled=()):
+    # Drives hana.asgi.application, noting how many chunks the response had read (len(pulled))
+    # when each body message went out
+    from hana.asgi import application
+
+    sent = []
+
+    async def run():
+        messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+
+        async def receive():
+            if messages:
+                return messages.pop(0)
+            # The client stays connected until the response is done
+            await asyncio.Future()
+
+        async def send(message):
+            sent.append(dict(message, pulled=len(pulled)))
+
+        await application({
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': method, 'scheme': 'http',
+            'path': path, 'query_string': b'', 'server': ('testserver', 80), 'client': ('127.0.0.1', 1),
+            'headers': [(b'host', b'testserver')] + [(name.encode(), value.encode()) for name, value in headers],
+        }, receive, send)
+
+    # The test's transaction must outlive the request, like the test client does
+    request_started.disconnect(close_old_connections)
+    request_finished.disconnect(close_old_connections)
+    try:
+        async_to_sync(run)()
+    finally:
+        request_started.connect(close_old_connections)
+        request_finished.connect(close_old_connections)
+    return sent[0], [message for message in sent[1:] if message.get('body')]
+
+
+class ProductFeedTests(TestCase):
+    def setUp(self):
+        feed_root = tempfile.TemporaryDirectory()
+        self.addCleanup(feed_root.cleanup)
+        self.enterContext(override_settings(STORAGES={**settings.STORAGES, 'feeds': {
+            'BACKEND': 'django.core.files.storage.FileSystemStorage',
+            'OPTIONS': {'location': feed_root.name, 'allow_overwrite': True},
+        }}))
+        category = Category.objects.create(name='Sarees')
+        self.first = Product.objects.create(category=category, name='Silk', price=1000, after_discount_price=0)
+        self.color = ProductColor.objects.create(product=self.first, color='Blue', qty=4)
+        # Far enough along to land in the next shard
+        self.last = Product.objects.create(id=self.first.id + SHARD_SIZE, category=category, name='Cotton', price=500, after_discount_price=0)
+
+    def read(self, name):
+        with feed_storage().open(public_path(name), 'rb') as feed:
+            return feed.read().decode('utf-8')
+
+    def test_only_changed_shards_are_rebuilt(self):
+        self.assertEqual(build_feeds(), (2, 2))
+        self.assertEqual(build_feeds(), (0, 2))
+        self.color.qty = 0
+        self.color.save()
+        self.assertEqual(build_feeds(), (1, 2))
+        self.assertIn('<g:availability>out_of_stock</g:availability>', self.read(PRODUCT_FEED_NAME))
+        self.last.delete()
+        self.assertEqual(build_feeds(), (0, 1))
+        self.assertNotIn('Cotton', self.read(PRODUCT_FEED_NAME))
+        self.assertEqual(self.read('sitemap.xml').count('<sitemap>'), 1)
+        self.assertTrue(feed_storage().exists(public_path(PRODUCT_FEED_NAME + '.gz')))
+
+    def test_watermark_is_kept_in_the_database(self):
+        build_feeds()
+        watermark = Watermark.objects.get(name=FEED_WATERMARK).value
+        self.assertIsNotNone(watermark)
+        # Files lost from storage are rewritten even though nothing changed since the watermark
+        feed_storage().delete('parts/products-0.xml')
+        self.assertEqual(build_feeds(), (1, 2))
+        self.assertGreater(Watermark.objects.get(name=FEED_WATERMARK).value, watermark)
+
+    def test_feeds_are_served_from_storage(self):
+        self.assertEqual(self.client.get('/sitemap.xml').status_code, 404)
+        build_feeds()
+        response = self.client.get('/sitemap.xml')
+        self.assertEqual(response['Content-Type'], 'application/xml')
+        self.assertIn('sitemap-products-1.xml', b''.join(response.streaming_content).decode('utf-8'))
+        packed = self.client.get('/feeds/products.xml', HTTP_ACCEPT_ENCODING='gzip, br')
+        self.assertEqual(packed['Content-Encoding'], 'gzip')
+        self.assertIn(b'Silk - Blue', gzip.decompress(b''.join(packed.streaming_content)))
+        self.assertEqual(self.client.get('/sitemap-products-0.xml').status_code, 200)
+
+    @patch('sho.streams.STREAM_BATCH_SIZE', 1)
+    def test_feed_streams_under_asgi(self):
+        build_feeds()
+        pulled = []
+
+        def small_chunks(content):
+            with content:
+                while chunk := content.read(100):
+                    pulled.append(chunk)
+                    yield chunk
+
+        with patch('sho.views.file_chunks', small_chunks):
+            start, bodies = asgi_request('GET', '/feeds/products.xml', pulled=pulled)
+        self.assertEqual(start['status'], 200)
+        self.assertEqual(b''.join(message['body'] for message in bodies), self.read(PRODUCT_FEED_NAME).encode())
+        # Each chunk went out before the next was read
+        self.assertEqual([message['pulled'] for message in bodies], list(range(1, len(pulled) + 1)))
+
+
+class CatalogApiTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('shopper', password='pw')
+        cls.category = Category.objects.create(name='Kurtis')
+        cls.product = Product.objects.create(category=cls.category, name='Kurti', price=500, after_discount_price=0)
+        cls.color = ProductColor.objects.create(product=cls.product, color='Green', qty=3)
+
+    def setUp(self):
+        self.client.cookies[PRIMARY_COOKIE] = '1'
+
+    def revalidate(self, url):
+        etag = self.client.get(url)['ETag']
+        return etag, self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+    def test_unchanged_product_is_not_modified_after_one_query(self):
+        url = reverse('api_product', args=[self.product.id])
+        response = self.client.get(url)
+        self.assertEqual(response.json()['colors'][0]['qty'], 3)
+        with self.assertNumQueries(1):
+            cached = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(cached.status_code, 304)
+
+    def test_stock_change_only_changes_product_etag(self):
+        product_url = reverse('api_product', args=[self.product.id])
+        category_url = reverse('api_category_products', args=[self.category.id])
+        product_etag, _ = self.revalidate(product_url)
+        category_etag, _ = self.revalidate(category_url)
+        categories_etag, _ = self.revalidate(reverse('api_categories'))
+        self.color.qty = 1
+        self.color.save()
+        response = self.client.get(product_url, HTTP_IF_NONE_MATCH=product_etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['colors'][0]['qty'], 1)
+        self.assertEqual(self.client.get(category_url, HTTP_IF_NONE_MATCH=category_etag).status_code, 304)
+        self.assertEqual(self.client.get(reverse('api_categories'), HTTP_IF_NONE_MATCH=categories_etag).status_code, 304)
+
+    def test_price_change_changes_category_etag_only(self):
+        category_url = reverse('api_category_products', args=[self.category.id])
+        category_etag, _ = self.revalidate(category_url)
+        categories_etag, _ = self.revalidate(reverse('api_categories'))
+        product = Product.objects.get(pk=self.product.pk)
+        product.price = 450
+        product.save()
+        response = self.client.get(category_url, HTTP_IF_NONE_MATCH=category_etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['products'][0]['price'], 450)
+        self.assertEqual(self.client.get(reverse('api_categories'), HTTP_IF_NONE_MATCH=categories_etag).status_code, 304)
+
+    def test_category_change_changes_categories_etag(self):
+        categories_etag, _ = self.revalidate(reverse('api_categories'))
+        self.category.name = 'Kurtas'
+        self.category.save()
+        response = self.client.get(reverse('api_categories'), HTTP_IF_NONE_MATCH=categories_etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['categories'][0]['name'], 'Kurtas')
+
+    def test_moving_a_product_changes_both_category_etags(self):
+        other = Category.objects.create(name='Sarees')
+        old_url = reverse('api_category_products', args=[self.category.id])
+        new_url = reverse('api_category_products', args=[other.id])
+        old_etag, _ = self.revalidate(old_url)
+        new_etag, _ = self.revalidate(new_url)
+        product = Product.objects.get(pk=self.product.pk)
+        product.category = other
+        product.save()
+        moved_out = self.client.get(old_url, HTTP_IF_NONE_MATCH=old_etag)
+        self.assertEqual(moved_out.status_code, 200)
+        self.assertEqual(moved_out.json()['products'], [])
+        self.assertEqual(self.client.get(new_url, HTTP_IF_NONE_MATCH=new_etag).status_code, 200)
+
+    def test_review_only_changes_product_etag(self):
+        category_etag, _ = self.revalidate(reverse('api_categories'))
+        product_etag, _ = self.revalidate(reverse('api_product', args=[self.product.id]))
+        ProductReview.objects.create(product=self.product, reviewer=self.user, review='Nice', review_image='r.jpg')
+        self.assertEqual(self.client.get(reverse('api_categories'), HTTP_IF_NONE_MATCH=category_etag).status_code, 304)
+        self.assertNotEqual(self.client.get(reverse('api_product', args=[self.product.id]))['ETag'], product_etag)
+
+    def test_category_products_are_paged_by_id(self):
+        for n in range(API_PRODUCTS_PER_PAGE):
+            Product.objects.create(category=self.category, name=f'Kurti {n}', price=500, after_discount_price=0)
+        url = reverse('api_category_products', args=[self.category.id])
+        first = self.client.get(url).json()
+        self.assertEqual(len(first['products']), API_PRODUCTS_PER_PAGE)
+        second = self.client.get(url, {'after': first['next_after']}).json()
+        self.assertEqual([product['name'] for product in second['products']], [f'Kurti {API_PRODUCTS_PER_PAGE - 1}'])
+        self.assertIsNone(second['next_after'])
+
+
+# Tables that grow with the business. A query reading one of them start to end gets slower with
+# every order, review and product, the plan tests below fail on those.
+GROWING_TABLES = [
+    'sho_archivedorder', 'sho_order', 'sho_orderitem', 'sho_product', 'sho_productcolor', 'sho_productimage',
+    'sho_productranking', 'sho_productreview',
+]
+
+
+def query_plan(sql):
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            # The test tables are tiny, a sequential scan would win on cost even where an index fits
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            cursor.execute('EXPLAIN ' + sql)
+            return [row[0] for row in cursor.fetchall()]
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+        return [row[-1] for row in cursor.fetchall()]
+
+
+def full_scan(line):
+    # SQLite reports "SCAN <table>" for reading every row, even through an index, and
+    # "SEARCH <table> USING INDEX ..." for a lookup. Postgres says "Seq Scan on <table>".
+    match = re.match(r'\s*(?:->\s*)?(?:SCAN|Seq Scan on) (\w+)', line)
+    return match and match.group(1) in GROWING_TABLES
+
+
+class QueryPlanTests(TestCase):
+    # EXPLAINs the queries the hot paths actually run, so a changed query or a dropped index
+    # shows up here instead of as a slow page once the tables have grown
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('shopper', password='pw')
+        cls.category = Category.objects.create(name='Sarees')
+        cls.product = Product.objects.create(category=cls.category, name='Saree', price=1000, after_discount_price=0)
+        cls.color = ProductColor.objects.create(product=cls.product, color='Red', qty=5)
+        ProductReview.objects.create(product=cls.product, reviewer=cls.user, review='Lovely', review_image='r.jpg')
+        order = Order.objects.create(
+            user=cls.user, total=1000, status='Confirmed', razorpay_order_id='order_plan',
+            shipping_address='Street', phone='1', pincode=600001, deliverycharge=0, redeemed_points=0,
+        )
+        OrderItem.objects.create(order=order, product=cls.product, color=cls.color, price=1000, quantity=1)
+
+    def setUp(self):
+        self.client.cookies[PRIMARY_COOKIE] = '1'
+
+    def assertIndexed(self, run, *indexes):
+        with CaptureQueriesContext(connection) as queries:
+            run()
+        plans = [
+            (query['sql'], query_plan(query['sql']))
+            for query in queries.captured_queries if query['sql'].startswith('SELECT')
+        ]
+        self.assertTrue(plans)
+        for sql, plan in plans:
+            scans = [line for line in plan if full_scan(line)]
+            self.assertFalse(scans, f'{sql}\n' + '\n'.join(plan))
+        used = '\n'.join(line for _, plan in plans for line in plan)
+        for index in indexes:
+            self.assertIn(index, used)
+
+    def test_loyalty_check(self):
+        self.assertIndexed(lambda: has_ordered_ten_times(self.user), 'order_user_status_idx')
+
+    def test_order_history(self):
+        ArchivedOrder.objects.create(
+            id=10 ** 6, user=self.user, total=500, status='Delivered', created_at=timezone.now(), updated_at=timezone.now(),
+            shipping_address='Street', phone='1', pincode=600001, deliverycharge=0, redeemed_points=0,
+        )
+        self.assertIndexed(lambda: order_history(self.user), 'order_user_created_idx', 'archived_user_created_idx')
+
+    def test_payment_lookup_by_gateway_order(self):
+        payment = {'id': 'pay_plan', 'status': 'captured', 'order_id': 'order_unknown', 'amount': 0}
+        with self.assertLogs('sho.payments', 'WARNING'):
+            self.assertIndexed(lambda: settle_payment(payment), 'order_razorpay_order_idx')
+
+    def test_category_listing(self):
+        url = reverse('category_products', args=[self.category.id])
+        self.assertIndexed(lambda: self.client.get(url), 'product_category_id_idx')
+        self.assertIndexed(lambda: self.client.get(url, {'sort': 'best-sellers'}), 'ranking_best_seller_idx')
+        self.assertIndexed(lambda: list(ranked_products(self.category, 'trending')), 'ranking_trending_idx')
+
+    def test_category_api(self):
+        url = reverse('api_category_products', args=[self.category.id])
+        self.assertIndexed(lambda: self.client.get(url), 'product_category_id_idx')
+
+    def test_review_pages(self):
+        url = reverse('product_reviews', args=[self.product.id])
+        self.assertIndexed(lambda: self.client.get(url, {'before': 10 ** 9}), 'review_product_id_idx')
+
+
+class StaticStorageTests(TestCase):
+    def setUp(self):
+        static_root = tempfile.TemporaryDirectory()
+        self.addCleanup(static_root.cleanup)
+        self.enterContext(override_settings(
+            STATIC_ROOT=static_root.name,
+            STATICFILES_FINDERS=['django.contrib.staticfiles.finders.FileSystemFinder'],
+        ))
+        self.client.cookies[PRIMARY_COOKIE] = '1'
+
+    def test_collected_assets_are_minified_hashed_and_compressed(self):
+        call_command('collectstatic', interactive=False, verbosity=0)
+        name = staticfiles_storage.stored_name('css/site.css')
+        self.assertRegex(name, r'^css/site\.[0-9a-f]{12}\.css$')
+        with staticfiles_storage.open(name) as css:
+            self.assertNotIn(b'\n', css.read().strip())
+        self.assertTrue(staticfiles_storage.exists(name + '.gz'))
+        self.assertTrue(staticfiles_storage.exists(name + '.br'))
+        self.assertContains(self.client.get(reverse('home')), staticfiles_storage.url('css/site.css'))
+
+    def test_pages_render_before_collectstatic(self):
+        self.assertContains(self.client.get(reverse('home')), '/static/css/site.css')
+
+
+class WishlistAlertTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('shopper', email='shopper@example.com', password='pw')
+        cls.category = Category.objects.create(name='Sarees')
+        cls.product = Product.objects.create(category=cls.category, name='Silk', price=1000, after_discount_price=0)
+        cls.color = ProductColor.objects.create(product=cls.product, color='Blue', qty=0)
+        cls.wishlist = Wishlist.objects.create(user=cls.user)
+        WishlistItem.objects.create(wishlist=cls.wishlist, product=cls.product)
+
+    def setUp(self):
+        # The first run only takes the snapshot
+        self.assertEqual(queue_wishlist_alerts(), (0, 0, 0))
+
+    def send_queued(self):
+        for task in Task.objects.filter(name='wishlist.send_alerts'):
+            send_alerts(**task.payload)
+            task.delete()
+
+    def test_restock_and_price_drop_send_one_mail_once(self):
+        self.color.qty = 2
+        self.color.save()
+        Product.objects.filter(pk=self.product.pk).update(price=800)
+        self.assertEqual(queue_wishlist_alerts(), (1, 1, 1))
+        self.send_queued()
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ['shopper@example.com'])
+        self.assertIn('Silk is back in stock in Blue and dropped from ₹1000 to ₹800.', mail.outbox[0].body)
+        self.assertEqual(queue_wishlist_alerts(), (0, 0, 0))
+
+    def test_rises_and_sell_outs_move_the_snapshot_without_alerts(self):
+        Product.objects.filter(pk=self.product.pk).update(price=1200)
+        self.assertEqual(queue_wishlist_alerts(), (0, 0, 0))
+        Product.objects.filter(pk=self.product.pk).update(price=1100)
+        self.assertEqual(queue_wishlist_alerts(), (0, 1, 1))
+        for qty, alerts in ((2, (1, 0, 1)), (0, (0, 0, 0)), (1, (1, 0, 1))):
+            ProductColor.objects.filter(pk=self.color.pk).update(qty=qty)
+            self.assertEqual(queue_wishlist_alerts(), alerts)
+
+    def test_shoppers_are_batched(self):
+        for n in range(4):
+            user = User.objects.create_user(f'fan{n}', email=f'fan{n}@example.com')
+            WishlistItem.objects.create(wishlist=Wishlist.objects.create(user=user), product=self.product)
+        no_email = Wishlist.objects.create(user=User.objects.create_user('no-email'))
+        WishlistItem.objects.create(wishlist=no_email, product=self.product)
+        self.color.qty = 1
+        self.color.save()
+        self.assertEqual(queue_wishlist_alerts(batch_users=2), (1, 0, 5))
+        self.assertEqual(Task.objects.filter(name='wishlist.send_alerts').count(), 3)
+        self.send_queued()
+        self.assertEqual(len(mail.outbox), 5)
+
+    def test_wishlist_page_queries_do_not_grow_with_items(self):
+        self.client.force_login(self.user)
+        self.client.cookies[PRIMARY_COOKIE] = '1'
+        ProductImage.objects.create(color=self.color, image='product_images/silk.jpg')
+        with CaptureQueriesContext(connection) as one:
+            response = self.client.get(reverse('wishlist'))
+        self.assertContains(response, 'product_images/silk.jpg')
+        for n in range(3):
+            product = Product.objects.create(category=self.category, name=f'Cotton {n}', price=500, after_discount_price=0)
+            color = ProductColor.objects.create(product=product, color='Red', qty=1)
+            ProductImage.objects.create(color=color, image=f'product_images/cotton{n}.jpg')
+            WishlistItem.objects.create(wishlist=self.wishlist, product=product)
+        with self.assertNumQueries(len(one)):
+            self.client.get(reverse('wishlist'))
+
+
+class OrderExportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('buyer', email='buyer@example.com', password='pw')
+        product = Product.objects.create(
+            category=Category.objects.create(name='Kurtis'), name='Kurti', price=500, after_discount_price=0,
+        )
+        color = ProductColor.objects.create(product=product, color='Red', qty=5)
+        cls.orders = []
+        for status, day in (('Confirmed', 1), ('Pending', 2), ('Delivered', 3)):
+            order = Order.objects.create(
+                user=cls.user, total=1060, status=status, shipping_address='Street, Chennai', phone='1',
+                pincode=600001, deliverycharge=60, redeemed_points=0,
+            )
+            Order.objects.filter(pk=order.pk).update(created_at=day_start(date(2024, 1, day)))
+            OrderItem.objects.create(order=order, product=product, color=color, price=500, quantity=2)
+            cls.orders.append(order)
+
+    def export(self, *args):
+        out = StringIO()
+        call_command('export_orders', *args, stdout=out)
+        return out.getvalue()
+
+    def test_csv_filters_by_day_and_status(self):
+        rows = list(csv.DictReader(StringIO(self.export('--since', '2024-01-02', '--until', '2024-01-03'))))
+        self.assertEqual([int(row['order_id']) for row in rows], [self.orders[1].id, self.orders[2].id])
+        self.assertEqual(rows[0]['shipping_address'], 'Street, Chennai')
+        rows = list(csv.DictReader(StringIO(self.export('--status', 'Delivered'))))
+        self.assertEqual([row['color'] for row in rows], ['Red'])
+
+    def test_archived_orders_are_exported(self):
+        Order.objects.filter(pk=self.orders[2].pk).update(updated_at=timezone.now() - ARCHIVE_AFTER * 2)
+        self.assertEqual(archive_orders(), 1)
+        rows = list(csv.DictReader(StringIO(self.export('--chunk-size', '1'))))
+        self.assertEqual([int(row['order_id']) for row in rows], [order.id for order in self.orders])
+        self.assertEqual((rows[2]['status'], rows[2]['username'], rows[2]['color']), ('Delivered', 'buyer', 'Red'))
+        rows = list(csv.DictReader(StringIO(self.export('--status', 'Delivered', '--since', '2024-01-03'))))
+        self.assertEqual([int(row['order_id']) for row in rows], [self.orders[2].id])
+
+    def test_jsonl_has_one_object_per_item(self):
+        lines = self.export('--format', 'jsonl', '--chunk-size', '1').splitlines()
+        self.assertEqual(len(lines), 3)
+        row = json.loads(lines[0])
+        self.assertEqual((row['order_id'], row['product'], row['quantity']), (self.orders[0].id, 'Kurti', 2))
+
+    def test_admin_action_streams_selected_orders(self):
+        self.client.force_login(User.objects.create_superuser('admin', password='pw'))
+        response = self.client.post(reverse('admin:sho_order_changelist'), {
+            'action': 'export_as_csv', '_selected_action': [self.orders[0].id],
+        })
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        rows = list(csv.DictReader(StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual([int(row['order_id']) for row in rows], [self.orders[0].id])
+
+    @patch('sho.streams.STREAM_BATCH_SIZE', 1)
+    def test_admin_export_streams_under_asgi(self):
+        self.client.force_login(User.objects.create_superuser('admin', password='pw'))
+        token = 'a' * 32
+        pulled = []
+
+        def counted_rows(orders, chunk_size=1, archived=None):
+            for row in export_rows(orders, chunk_size, archived):
+                pulled.append(row)
+                yield row
+
+        with patch('sho.exports.export_rows', counted_rows):
+            start, bodies = asgi_request('POST', reverse('admin:sho_order_changelist'), body=urlencode({
+                'action': 'export_as_csv', '_selected_action': [order.id for order in self.orders],
+                'csrfmiddlewaretoken': token,
+            }, doseq=True).encode(), headers=[
+                ('content-type', 'application/x-www-form-urlencoded'),
+                ('cookie', f"{settings.SESSION_COOKIE_NAME}={self.client.cookies[settings.SESSION_COOKIE_NAME].value}; "
+                           f"{settings.CSRF_COOKIE_NAME}={token}"),
+            ], pulled=pulled)
+        self.assertEqual(start['status'], 200)
+        rows = list(csv.DictReader(StringIO(b''.join(message['body'] for message in bodies).decode())))
+        self.assertEqual([int(row['order_id']) for row in rows], [order.id for order in self.orders])
+        # The header line went out before any order was read, each row before the next
+        self.assertEqual([message['pulled'] for message in bodies], [0, 1, 2, 3])
+
+
+class SalesRollupTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('buyer', password='pw')
+        product = Product.objects.create(
+            category=Category.objects.create(name='Kurtis'), name='Kurti', price=500, after_discount_price=0,
+        )
+        self.red = ProductColor.objects.create(product=product, color='Red', qty=5)
+        self.blue = ProductColor.objects.create(product=product, color='Blue', qty=5)
+        self.created_at = timezone.make_aware(datetime(2024, 1, 1, 10, 30))
+        # 1000 + 200 of items and 60 delivery, paid 1160 after 40 points: 60 of discount
+        self.order = self.make_order(total=1160, redeemed_points=40, lines=((self.red, 500, 2), (self.blue, 200, 1)))
+
+    def make_order(self, total, redeemed_points, lines, status='Confirmed'):
+        order = Order.objects.create(
+            user=self.user, total=total, status=status, shipping_address='Street', phone='1', pincode=600001,
+            deliverycharge=60, redeemed_points=redeemed_points,
+        )
+        for color, price, quantity in lines:
+            OrderItem.objects.create(order=order, product=color.product, color=color, price=price, quantity=quantity)
+        # Placed and last changed well before any rollup run
+        Order.objects.filter(pk=order.pk).update(created_at=self.created_at, updated_at=self.created_at)
+        return order
+
+    def rollup(self, period, color):
+        return SalesRollup.objects.values_list(*ROLLUP_MEASURES).get(period=period, color=color)
+
+    def test_order_amounts_are_shared_over_lines(self):
+        days, rows = build_sales_rollups()
+        self.assertEqual(len(days), 1)
+        self.assertEqual(rows, 4)
+        self.assertEqual(self.rollup('day', self.red), (2, Decimal('1000.00'), Decimal('50.00'), Decimal('33.33'), Decimal('50.00')))
+        self.assertEqual(self.rollup('hour', self.blue), (1, Decimal('200.00'), Decimal('10.00'), Decimal('6.67'), Decimal('10.00')))
+        self.assertEqual(SalesRollup.objects.get(period='hour', color=self.red).bucket, self.created_at.replace(minute=0))
+
+    def test_only_days_changed_since_the_watermark_are_rebuilt(self):
+        self.make_order(total=0, redeemed_points=0, lines=((self.red, 500, 1),), status='Pending')
+        build_sales_rollups()
+        self.assertEqual(Watermark.objects.get(name=ROLLUP_WATERMARK).value.date(), timezone.now().date())
+        self.assertEqual(build_sales_rollups(), ([], 0))
+        self.order.refresh_from_db()
+        self.order.status = 'Cancelled'
+        self.order.save()
+        days, rows = build_sales_rollups()
+        self.assertEqual(len(days), 1)
+        self.assertEqual(rows, 0)
+        self.assertFalse(SalesRollup.objects.exists())
+
+
+class SaleCampaignTests(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(name='Sarees')
+        self.product = Product.objects.create(category=self.category, name='Silk', price=999, after_discount_price=0)
+        # Already 7% off its list price
+        Product.objects.filter(pk=self.product.pk).update(discount=7)
+        self.now = timezone.now()
+
+    def campaign(self, discount, starts_in=0):
+        campaign = SaleCampaign.objects.create(
+            name='Diwali', discount=discount, starts_at=self.now + timedelta(hours=starts_in),
+            ends_at=self.now + timedelta(hours=starts_in + 1),
+        )
+        campaign.categories.add(self.category)
+        return campaign
+
+    def test_apply_rounds_half_up_and_revert_restores(self):
+        campaign = self.campaign(10)
+        self.assertEqual(apply_campaign(campaign), 1)
+        self.product.refresh_from_db()
+        # 999 / 0.93 * 0.90 = 966.77
+        self.assertEqual((self.product.price, self.product.discount), (967, 10))
+        self.assertEqual(apply_campaign(campaign), 0)
+        self.assertEqual(revert_campaign(campaign), 1)
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.price, self.product.discount), (999, 7))
+
+    def test_due_campaigns_do_not_stack(self):
+        first, second = self.campaign(10), self.campaign(20)
+        self.campaign(30, starts_in=2)
+        applied, reverted = run_due_campaigns(self.now)
+        self.assertEqual(applied, [(first, 1), (second, 0)])
+        self.assertEqual(reverted, [])
+        applied, reverted = run_due_campaigns(self.now + timedelta(hours=2))
+        self.assertEqual(reverted, [(first, 1), (second, 0)])
+        self.assertEqual(applied, [(SaleCampaign.objects.get(discount=30), 1)])
+
+
+class LoyaltyPointsTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('buyer', password='pw')
+        product = Product.objects.create(
+            category=Category.objects.create(name='Kurtis'), name='Kurti', price=500, after_discount_price=0,
+        )
+        self.color = ProductColor.objects.create(product=product, color='Red', qty=5)
+        earn_points(self.user, 100)
+
+    def pending_order(self, redeemed_points):
+        order = Order.objects.create(
+            user=self.user, total=560 - redeemed_points, status='Pending', shipping_address='Street', phone='1',
+            pincode=600001, deliverycharge=60, redeemed_points=redeemed_points,
+        )
+        OrderItem.objects.create(order=order, product=self.color.product, color=self.color, price=500, quantity=1)
+        return order
+
+    def test_points_are_spent_once_across_pending_orders(self):
+        first, second = self.pending_order(100), self.pending_order(100)
+        self.assertTrue(confirm_order(first.id, 'pay_1')[1])
+        with self.assertLogs('sho.payments', 'WARNING'):
+            order, confirmed = confirm_order(second.id, 'pay_2')
+        self.assertFalse(confirmed)
+        self.assertEqual(order.status, 'Pending')
+        self.assertEqual(points_balance(self.user), 0)
+
+    @override_settings(PAYMENT_GATEWAY='fake')
+    def test_checkout_callback_refuses_when_the_points_were_spent(self):
+        reset_fake_gateway()
+        gateway = fake_gateway()
+        order = self.pending_order(100)
+        order.razorpay_order_id = gateway.order.create({'amount': 460 * 100})['id']
+        order.save()
+        self.client.force_login(self.user)
+        session = self.client.session
+        session['cart'] = {str(self.color.id): {'product_id': self.color.product_id, 'quantity': 1}}
+        session.save()
+        # Spent in another tab between placing the order and paying for it
+        spend_points(self.user, 100)
+        payment = gateway.pay(order.razorpay_order_id)
+        with self.assertLogs('sho.payments', 'WARNING'):
+            response = self.client.post(reverse('razorpay_payment_success'), json.dumps({
+                'razorpay_payment_id': payment['id'],
+                'razorpay_order_id': payment['order_id'],
+                'razorpay_signature': gateway.checkout_signature(payment),
+                'order_id': order.id,
+            }), content_type='application/json')
+        self.assertEqual(response.json(), {
+            'success': False, 'error': 'Your loyalty points balance no longer covers the points redeemed on this order.',
+        })
+        self.assertEqual(list(self.client.session['cart']), [str(self.color.id)])
+        order.refresh_from_db()
+        self.assertEqual(order.status, 'Pending')
+
+    def test_balance_is_not_clamped(self):
+        PointsEntry.objects.create(user=self.user, kind='Adjust', points=-150)
+        self.assertEqual(points_balance(self.user), -50)
+
+    def test_unredeemed_points_expire_oldest_first(self):
+        year_ago = timezone.now() - POINTS_LIFETIME - timedelta(days=1)
+        PointsEntry.objects.filter(user=self.user).update(created_at=year_ago)
+        spend_points(self.user, 30)
+        earn_points(self.user, 20)
+        self.assertEqual(expire_points(), 1)
+        self.assertEqual(PointsEntry.objects.get(kind='Expire').points, -70)
+        self.assertEqual(points_balance(self.user), 20)
+        self.assertEqual(expire_points(), 0)
+
+
+class ProfileLoadingTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('shopper', password='pw')
+
+    def test_backend_joins_the_profile(self):
+        with self.assertNumQueries(1):
+            user = ProfileModelBackend().get_user(self.user.id)
+            self.assertFalse(user.profile.first_order_offer_used)
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        self.assertIsNone(ProfileModelBackend().get_user(self.user.id))
+
+    def test_user_saves_write_the_profile_only_when_it_changed(self):
+        user = User.objects.get(pk=self.user.pk)
+        with self.assertNumQueries(1):
+            user.save()
+        user = ProfileModelBackend().get_user(self.user.id)
+        with self.assertNumQueries(1):
+            user.save()
+        user.profile.first_order_offer_used = True
+        with CaptureQueriesContext(connection) as queries:
+            user.save()
+        self.assertEqual(len(queries), 2)
+        self.assertIn('first_order_offer_used', queries[1]['sql'])
+        self.assertTrue(Profile.objects.get(user=self.user).first_order_offer_used)
+
+
+class CountingFileSystemStorage(FileSystemStorage):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.resolved = 0
+
+    def url(self, name):
+        self.resolved += 1
+        return super().url(name)
+
+
+class CachedCountingStorage(CachedURLMixin, CountingFileSystemStorage):
+    pass
+
+
+class MediaURLCacheTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        self.storage = CachedCountingStorage(location=media_root.name, base_url='/media/')
+
+    def test_urls_are_resolved_once_per_name(self):
+        for _ in range(3):
+            self.assertEqual(self.storage.url('product_images/a.jpg'), '/media/product_images/a.jpg')
+        self.storage.url('product_images/b.jpg')
+        self.assertEqual(self.storage.resolved, 2)
+
+    def test_batch_resolves_each_missing_name_once(self):
+        self.storage.url('product_images/a.jpg')
+        names = ['product_images/a.jpg', 'product_images/b.jpg', '', None, 'product_images/b.jpg']
+        self.assertEqual(self.storage.urls(names), {
+            'product_images/a.jpg': '/media/product_images/a.jpg',
+            'product_images/b.jpg': '/media/product_images/b.jpg',
+        })
+        self.assertEqual(self.storage.resolved, 2)
+        # The batch shares the cache with url()
+        self.storage.url('product_images/b.jpg')
+        self.storage.urls(names)
+        self.assertEqual(self.storage.resolved, 2)
+
+    def test_saves_and_deletes_drop_the_cached_url(self):
+        self.storage.url('product_images/a.jpg')
+        name = self.storage.save('product_images/a.jpg', ContentFile(b'image'))
+        self.storage.url(name)
+        self.storage.delete(name)
+        self.storage.url(name)
+        self.assertEqual(self.storage.resolved, 3)
+
+    def test_cache_expires_and_drops_least_recently_used(self):
+        cache = URLCache(max_names=2)
+        cache.set('a', (), '/a', ttl=60)
+        cache.set('b', (), '/b', ttl=0)
+        self.assertIsNone(cache.get('b', ()))
+        cache.set('c', (), '/c', ttl=60)
+        cache.get('a', ())
+        cache.set('d', (), '/d', ttl=60)
+        self.assertEqual(list(cache.entries), ['a', 'd'])
+
+    def test_signed_urls_are_cached_for_part_of_their_lifetime(self):
+        signed = CachedURLS3Storage(bucket_name='bucket', querystring_auth=True, querystring_expire=3600, custom_domain=None)
+        self.assertEqual(signed.url_ttl(), 3240)
+        self.assertEqual(signed.url_ttl(expire=300), 240)
+        public = CachedURLS3Storage(bucket_name='bucket', querystring_auth=False)
+        self.assertEqual(public.url_ttl(), PUBLIC_URL_TTL)
+
+
+class FlakyRemoteStorage(CachedURLFileSystemStorage):
+    # Filesystem stand-in for S3 that fails the first `failures` uploads
+    def __init__(self, failures=0, **kwargs):
+        super().__init__(**kwargs)
+        self.failures = failures
+
+    def _save(self, name, content):
+        if self.failures:
+            self.failures -= 1
+            raise OSError("S3 is down")
+        return super()._save(name, content)
+
+
+@patch('sho.storage.OFFLOAD_BACKOFF', 0)
+class OffloadedStorageTests(TestCase):
+    def setUp(self):
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(root.cleanup)
+        self.root = root.name
+
+    def storage(self, failures=0, host='web-1'):
+        return OffloadedStorage(
+            remote_backend='sho.tests.FlakyRemoteStorage',
+            remote_options={'failures': failures, 'location': os.path.join(self.root, 's3'), 'base_url': '/s3/'},
+            location=os.path.join(self.root, 'staging'), base_url='/media-staged/', host=host,
+        )
+
+    def test_push_moves_the_file_to_the_remote(self):
+        storage = self.storage()
+        name = storage.save('product_images/a.jpg', ContentFile(b'image'))
+        self.assertEqual(PendingUpload.objects.get(name=name).host, 'web-1')
+        self.assertEqual(storage.url(name), '/media-staged/product_images/a.jpg')
+        self.assertTrue(storage.push(name))
+        self.assertFalse(PendingUpload.objects.exists())
+        self.assertFalse(storage.local.exists(name))
+        self.assertEqual(storage.url(name), '/s3/product_images/a.jpg')
+        with storage.open(name) as pushed:
+            self.assertEqual(pushed.read(), b'image')
+
+    def test_other_processes_link_the_staged_file_until_it_is_pushed(self):
+        name = self.storage().save('product_images/a.jpg', ContentFile(b'image'))
+        # Another worker on the same host, or this one after a restart
+        storage = self.storage()
+        self.assertEqual(storage.url(name), '/media-staged/product_images/a.jpg')
+        self.assertTrue(storage.push(name))
+        self.assertEqual(storage.url(name), '/s3/product_images/a.jpg')
+
+    def test_failed_pushes_are_retried_then_left_for_the_sweeper(self):
+        storage = self.storage(failures=OFFLOAD_ATTEMPTS + 1)
+        name = storage.save('product_images/a.jpg', ContentFile(b'image'))
+        self.assertFalse(storage.push(name))
+        upload = PendingUpload.objects.get(name=name)
+        self.assertEqual(upload.attempts, OFFLOAD_ATTEMPTS)
+        self.assertIn('S3 is down', upload.last_error)
+        self.assertTrue(storage.push(name))
+        self.assertFalse(PendingUpload.objects.exists())
+
+    def test_missing_local_file_is_an_error(self):
+        storage = self.storage()
+        name = storage.save('product_images/a.jpg', ContentFile(b'image'))
+        os.remove(storage.local.path(name))
+        self.assertFalse(storage.push(name))
+        self.assertIn('missing', PendingUpload.objects.get(name=name).last_error)
+
+    def test_sweeper_only_pushes_its_own_hosts_uploads(self):
+        name = self.storage(host='web-2').save('product_images/a.jpg', ContentFile(b'image'))
+        PendingUpload.objects.update(next_attempt_at=timezone.now())
+        self.assertEqual(self.storage().push_pending(), [])
+        self.assertTrue(PendingUpload.objects.filter(name=name).exists())
+
+
+flaky_calls = []
+
+
+@task('tests.flaky')
+def flaky_handler(fail_times):
+    flaky_calls.append(fail_times)
+    if len(flaky_calls) <= fail_times:
+        raise RuntimeError("try again")
+
+
+@task('tests.mail_then_fail')
+def mail_then_fail_handler():
+    OutboxEmailBackend().send_messages([EmailMessage('Alert', 'Body', to=['user@example.com'])])
+    raise RuntimeError("worker died")
+
+
+class TaskQueueTests(TestCase):
+    def setUp(self):
+        flaky_calls.clear()
+
+    def run_due(self):
+        # Moves retries forward to now instead of waiting out the backoff
+        Task.objects.filter(status='Queued').update(run_at=timezone.now())
+        claimed = claim_task('test-worker')
+        return claimed and run_task(claimed)
+
+    def test_keyed_tasks_are_enqueued_once(self):
+        enqueue('tests.flaky', {'fail_times': 0}, key='once')
+        enqueue('tests.flaky', {'fail_times': 0}, key='once')
+        self.assertEqual(Task.objects.count(), 1)
+
+    def test_failures_back_off_then_give_up(self):
+        enqueue('tests.flaky', {'fail_times': 5}, max_attempts=2)
+        self.assertFalse(self.run_due())
+        retry = Task.objects.get()
+        self.assertEqual((retry.status, retry.attempts), ('Queued', 1))
+        self.assertGreater(retry.run_at, timezone.now())
+        self.assertIsNone(claim_task('test-worker'))
+        self.assertFalse(self.run_due())
+        failed = Task.objects.get()
+        self.assertEqual((failed.status, failed.attempts), ('Failed', 2))
+        self.assertIn('try again', failed.last_error)
+        self.assertIsNone(self.run_due())
+
+    def test_retried_task_succeeds(self):
+        enqueue('tests.flaky', {'fail_times': 1})
+        self.assertFalse(self.run_due())
+        self.assertTrue(self.run_due())
+        self.assertEqual(Task.objects.get().status, 'Done')
+        self.assertEqual(len(flaky_calls), 2)
+
+    def test_failed_task_leaves_no_outbox_mail(self):
+        enqueue('tests.mail_then_fail')
+        self.assertFalse(self.run_due())
+        self.assertFalse(OutboxEmail.objects.exists())
+        self.assertEqual(Task.objects.get().status, 'Queued')
+
+    def test_task_requeued_while_running_is_rolled_back(self):
+        enqueue('tests.flaky', {'fail_times': 0})
+        claimed = claim_task('test-worker')
+        Task.objects.filter(pk=claimed.pk).update(status='Queued')
+        self.assertFalse(run_task(claimed))
+        self.assertEqual(Task.objects.get().status, 'Queued')
+
+    def test_only_old_finished_tasks_are_purged(self):
+        now = timezone.now()
+        for status, age in (('Done', 8), ('Done', 1), ('Failed', 8), ('Failed', 31), ('Queued', 31)):
+            Task.objects.create(
+                name=f'{status} {age}', status=status, run_at=now, finished_at=now - timedelta(days=age),
+            )
+        out = StringIO()
+        call_command('purge_tasks', batch_size=1, stdout=out)
+        self.assertIn("Purged 2 finished task(s).", out.getvalue())
+        self.assertEqual(
+            sorted(Task.objects.values_list('name', flat=True)), ['Done 1', 'Failed 8', 'Queued 31'],
+        )
+
+    def test_awarding_points_twice_earns_once(self):
+        user = User.objects.create_user('buyer', password='pw')
+        product = Product.objects.create(
+            category=Category.objects.create(name='Kurtis'), name='Kurti', price=500, after_discount_price=0,
+        )
+        order = Order.objects.create(
+            user=user, total=1060, status='Confirmed', shipping_address='Street', phone='1', pincode=600001,
+            deliverycharge=60, redeemed_points=0,
+        )
+        OrderItem.objects.create(
+            order=order, product=product, color=ProductColor.objects.create(product=product, color='Red', qty=5),
+            price=500, quantity=2,
+        )
+        award_order_points(order.id)
+        award_order_points(order.id)
+        self.assertEqual(points_balance(user), 10)
+
+
+class FailingSMTPBackend(BaseEmailBackend):
+    # Delivery stand-in that rejects every message with the given SMTP reply
+    code = 421
+
+    def send_messages(self, email_messages):
+        raise smtplib.SMTPResponseException(self.code, b'Try later')
+
+
+class PermanentFailureSMTPBackend(FailingSMTPBackend):
+    code = 550
+
+
+class OutboxTests(TestCase):
+    def queue(self, count):
+        backend = OutboxEmailBackend()
+        backend.send_messages([EmailMessage(f'Mail {n}', 'Body', to=[f'user{n}@example.com']) for n in range(count)])
+
+    def test_batches_are_claimed_once(self):
+        self.queue(3)
+        first, second = claim_batch(2), claim_batch(2)
+        self.assertEqual([row.subject for row in first], ['Mail 0', 'Mail 1'])
+        self.assertEqual([row.subject for row in second], ['Mail 2'])
+        self.assertEqual(claim_batch(2), [])
+        self.assertEqual(send_batch(first + second, RateLimiter(0), get_connection('django.core.mail.backends.locmem.EmailBackend')), (3, 0))
+        self.assertEqual([message.to for message in mail.outbox], [[f'user{n}@example.com'] for n in range(3)])
+        self.assertEqual(OutboxEmail.objects.filter(status='Sent').count(), 3)
+
+    def test_rate_limiter_spaces_sends(self):
+        limiter = RateLimiter(per_minute=60 * 50)
+        started = time.monotonic()
+        for _ in range(3):
+            limiter.wait()
+        self.assertGreaterEqual(time.monotonic() - started, 2 / 50)
+
+    def test_transient_failures_are_retried_later(self):
+        self.queue(1)
+        send_batch(claim_batch(10), RateLimiter(0), get_connection('sho.tests.FailingSMTPBackend'))
+        row = OutboxEmail.objects.get()
+        self.assertEqual((row.status, row.attempts), ('Queued', 1))
+        self.assertGreater(row.next_attempt_at, timezone.now())
+        self.assertEqual(claim_batch(10), [])
+        OutboxEmail.objects.update(next_attempt_at=timezone.now())
+        send_batch(claim_batch(10), RateLimiter(0), get_connection('sho.tests.PermanentFailureSMTPBackend'))
+        row.refresh_from_db()
+        self.assertEqual((row.status, row.attempts), ('Failed', 2))
+
+
+class DeliveryZoneTests(TestCase):
+    def setUp(self):
+        zone_cache.reset()
+        self.addCleanup(zone_cache.reset)
+
+    def test_index_finds_the_range_holding_a_pincode(self):
+        index = ZoneIndex([(600001, 600099, 40, True, 'Chennai'), (110001, 110099, 90, False, 'Delhi')])
+        self.assertEqual(index.lookup(600001)[4], 'Chennai')
+        self.assertEqual(index.lookup(600099)[4], 'Chennai')
+        self.assertEqual(index.lookup(110050)[4], 'Delhi')
+        self.assertIsNone(index.lookup(600100))
+        self.assertIsNone(index.lookup(110000))
+
+    def test_seeded_zones_keep_the_old_charges(self):
+        self.assertEqual(delivery_quote(600001), (True, 60, 'Tamil Nadu'))
+        self.assertEqual(delivery_quote(699998), (True, 60, 'Tamil Nadu'))
+        self.assertEqual(delivery_quote(600000), (True, 90, 'Rest of India'))
+        self.assertEqual(delivery_quote(700001), (True, 90, 'Rest of India'))
+        self.assertIsNone(parse_pincode('060001'))
+
+    def test_loading_a_csv_merges_adjacent_pincodes(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as f:
+            f.write('pincode,charge,serviceable\n600001,40,1\n600002,40,1\n600003,40,0\n110001,90,1\n')
+        self.addCleanup(os.remove, f.name)
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('load_delivery_zones', f.name, stdout=StringIO())
+        self.assertEqual(
+            list(DeliveryZone.objects.values_list('name', 'pincode_from', 'pincode_to')),
+            [('110001-110001', 110001, 110001), ('600001-600002', 600001, 600002), ('600003-600003', 600003, 600003)],
+        )
+        self.assertEqual(delivery_quote(600002), (True, 40, '600001-600002'))
+        self.assertFalse(delivery_quote(600003)[0])
+        self.assertEqual(delivery_quote(700001), (False, None, None))
+
+
+class ProductRankingTests(TestCase):
+    def setUp(self):
+        self.client.cookies[PRIMARY_COOKIE] = '1'
+        self.user = User.objects.create_user('buyer', password='pw')
+        self.category = Category.objects.create(name='Sarees')
+        self.classic = Product.objects.create(category=self.category, name='Classic', price=900, after_discount_price=0)
+        self.new = Product.objects.create(category=self.category, name='New', price=900, after_discount_price=0)
+
+    def sell(self, product, quantity, days_ago, status='Delivered'):
+        order = Order.objects.create(
+            user=self.user, total=900 * quantity, status=status, shipping_address='Street', phone='1',
+            pincode=600001, deliverycharge=60, redeemed_points=0,
+        )
+        color = ProductColor.objects.create(product=product, color='Red', qty=1)
+        OrderItem.objects.create(order=order, product=product, color=color, price=900, quantity=quantity)
+        Order.objects.filter(pk=order.pk).update(created_at=timezone.now() - timedelta(days=days_ago))
+
+    def names(self, sort):
+        return [ranking.product.name for ranking in ranked_products(self.category, sort)]
+
+    def test_best_sellers_weigh_volume_and_trending_weighs_recency(self):
+        self.sell(self.classic, 10, days_ago=30)
+        self.sell(self.new, 2, days_ago=0)
+        self.sell(self.new, 50, days_ago=0, status='Pending')
+        self.assertEqual(refresh_rankings(), 2)
+        self.assertEqual(self.names('best-sellers'), ['Classic', 'New'])
+        self.assertEqual(self.names('trending'), ['New', 'Classic'])
+        ranking = ProductRanking.objects.get(product=self.classic)
+        self.assertEqual(ranking.units_sold, 10)
+        self.assertAlmostEqual(ranking.best_seller_score, 10 * 0.5 ** (30 / 90), places=3)
+        # Orders are counted once, later runs only decay the scores
+        self.assertEqual(refresh_rankings(), 0)
+        self.assertEqual(ProductRanking.objects.get(product=self.classic).units_sold, 10)
+
+    def test_default_listing_is_paged(self):
+        Product.objects.bulk_create([
+            Product(category=self.category, name=f'Saree {n}', price=500, after_discount_price=0)
+            for n in range(PRODUCTS_PER_PAGE)
+        ])
+        url = reverse('category_products', args=[self.category.id])
+        first = self.client.get(url)
+        self.assertEqual(len(first.context['products']), PRODUCTS_PER_PAGE)
+        self.assertContains(first, 'Page 1 of 2')
+        last = self.client.get(url, {'page': 2})
+        self.assertEqual([product.name for product in last.context['products']], [f'Saree {n}' for n in range(22, 24)])
+
+
+class StockStreamTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        product = Product.objects.create(
+            category=Category.objects.create(name='Sarees'), name='Silk', price=1000, after_discount_price=0,
+        )
+        cls.color = ProductColor.objects.create(product=product, color='Blue', qty=4)
+        cls.path = f'/stream/stock/{product.id}/'
+
+    def stream(self, path, on_open=None):
+        async def django_app(scope, receive, send):
+            await plain_response(send, 200, b'Django')
+
+        async def run():
+            sent = []
+            disconnected = asyncio.Event()
+
+            async def receive():
+                await disconnected.wait()
+                return {'type': 'http.disconnect'}
+
+            async def send(message):
+                sent.append(message)
+
+            async def wait_for(count):
+                while len(sent) < count:
+                    await asyncio.sleep(0.01)
+
+            app = with_stock_streams(django_app)
+            response = asyncio.ensure_future(app({'type': 'http', 'method': 'GET', 'path': path}, receive, send))
+            try:
+                await asyncio.wait_for(asyncio.shield(response), 0.2)
+            except asyncio.TimeoutError:
+                # Still streaming: the snapshot is out, push a change, then hang up
+                await asyncio.wait_for(wait_for(2), 5)
+                on_open()
+                await asyncio.wait_for(wait_for(3), 5)
+                disconnected.set()
+                await asyncio.wait_for(response, 5)
+            if stock_feed.poller:
+                stock_feed.poller.cancel()
+            return sent
+
+        try:
+            return async_to_sync(run)()
+        finally:
+            stock_feed.loop = stock_feed.poller = None
+
+    def test_other_requests_go_to_django(self):
+        sent = self.stream('/stream/stock/')
+        self.assertEqual(sent[1]['body'], b'Django')
+
+    def test_unknown_product_is_not_found(self):
+        sent = self.stream('/stream/stock/999999/')
+        self.assertEqual(sent[0]['status'], 404)
+
+    def test_stream_sends_the_snapshot_then_changes(self):
+        product_id = self.color.product_id
+        sent = self.stream(self.path, lambda: stock_feed.dispatch([(product_id, self.color.id, 0)]))
+        self.assertEqual(sent[0]['status'], 200)
+        self.assertIn((b'content-type', b'text/event-stream'), sent[0]['headers'])
+        self.assertEqual(sent[1]['body'], stock_event({self.color.id: 4}))
+        self.assertEqual(sent[2]['body'], stock_event({self.color.id: 0}))
+        self.assertEqual(len(stock_feed), 0)
+
+    @patch('sho.streams.MAX_STREAMS', 0)
+    def test_streams_over_the_limit_are_refused(self):
+        self.assertEqual(self.stream(self.path)[0]['status'], 503)
+
+    def test_asgi_process_keeps_no_db_connections(self):
+        script = (
+            "import hana.asgi\n"
+            "from django.conf import settings\n"
+            "print(sorted({db['CONN_MAX_AGE'] for db in settings.DATABASES.values()}))\n"
+        )
+        env = {name: value for name, value in os.environ.items() if name != 'DATABASE_CONN_MAX_AGE'}
+        result = subprocess.run(
+            [sys.executable, '-c', script], cwd=settings.BASE_DIR, capture_output=True, text=True,
+            env={**env, 'DJANGO_SETTINGS_MODULE': settings.SETTINGS_MODULE},
+        )
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertEqual(result.stdout.splitlines()[-1], '[0]')
+
+
+class StartupImportTests(TestCase):
+    def test_worker_startup_leaves_the_sdks_unimported(self):
+        script = STARTUP_SCRIPT + (
+            "import sys\n"
+            "print(' '.join(name for name in ('razorpay', 'boto3', 'botocore', 'storages.backends.s3boto3', 'numpy', 'scipy')"
+            " if name in sys.modules))\n"
+        )
+        result = subprocess.run(
+            [sys.executable, '-c', script], cwd=settings.BASE_DIR, capture_output=True, text=True,
+            env={**os.environ, 'DJANGO_SETTINGS_MODULE': settings.SETTINGS_MODULE},
+        )
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertEqual(result.stdout.splitlines()[-1], '')
+
+    def test_importtime_output_is_parsed(self):
+        stderr = "import time: self [us] | cumulative | imported package\nimport time:       120 |        450 |   django.urls\n"
+        self.assertEqual(parse_importtime(stderr), [('django.urls', 120, 450, 1)])
+
+
+class OrderLifecycleTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('buyer', password='pw')
+        product = Product.objects.create(
+            category=Category.objects.create(name='Kurtis'), name='Kurti', price=500, after_discount_price=0,
+        )
+        self.color = ProductColor.objects.create(product=product, color='Red', qty=5)
+        self.now = timezone.now()
+
+    def order(self, status, age, changed=None):
+        order = Order.objects.create(
+            user=self.user, total=1060, status=status, shipping_address='Street', phone='1', pincode=600001,
+            deliverycharge=60, redeemed_points=0,
+        )
+        OrderItem.objects.create(order=order, product=self.color.product, color=self.color, price=500, quantity=2)
+        Order.objects.filter(pk=order.pk).update(
+            created_at=self.now - age, updated_at=self.now - (age if changed is None else changed),
+        )
+        return order
+
+    def test_only_stale_pending_orders_expire(self):
+        stale = self.order('Pending', PENDING_EXPIRY + timedelta(hours=1))
+        fresh = self.order('Pending', timedelta(hours=1))
+        paid = self.order('Confirmed', PENDING_EXPIRY + timedelta(hours=1))
+        self.assertEqual(expire_pending_orders(), 1)
+        statuses = dict(Order.objects.values_list('id', 'status'))
+        self.assertEqual([statuses[o.id] for o in (stale, fresh, paid)], ['Expired', 'Pending', 'Confirmed'])
+
+    def test_finished_orders_move_to_the_archive(self):
+        old = self.order('Delivered', ARCHIVE_AFTER + timedelta(days=1))
+        recent = self.order('Delivered', timedelta(days=1))
+        shipping = self.order('Shipped', ARCHIVE_AFTER + timedelta(days=2))
+        self.assertEqual(archive_orders(), 1)
+        archived = ArchivedOrder.objects.get()
+        self.assertEqual((archived.id, archived.status), (old.id, 'Delivered'))
+        self.assertEqual(list(archived.items.values_list('quantity', flat=True)), [2])
+        self.assertFalse(Order.objects.filter(pk=old.pk).exists())
+        self.assertEqual([order.id for order in order_history(self.user)], [recent.id, old.id, shipping.id])
+
+    def test_orders_changed_after_the_cutoff_are_not_archived(self):
+        order = self.order('Delivered', ARCHIVE_AFTER + timedelta(days=1), changed=timedelta(days=1))
+        self.assertEqual(archive_batch([order.id], self.now - ARCHIVE_AFTER), 0)
+        self.assertTrue(Order.objects.filter(pk=order.pk).exists())
+
+    def test_recommendations_count_archived_baskets(self):
+        other = ProductColor.objects.create(
+            product=Product.objects.create(category=self.color.product.category, name='Dupatta', price=200, after_discount_price=0),
+            color='Gold', qty=5,
+        )
+        for age in (ARCHIVE_AFTER + timedelta(days=1), timedelta(days=1)):
+            order = self.order('Delivered', age)
+            OrderItem.objects.create(order=order, product=other.product, color=other, price=200, quantity=1)
+        self.assertEqual(archive_orders(), 1)
+        build_recommendations()
+        pair = ProductRecommendation.objects.get(product=self.color.product)
+        self.assertEqual((pair.recommended_id, pair.orders_together), (other.product_id, 2))
+
+    def test_rollups_keep_archived_sales(self):
+        self.order('Delivered', ARCHIVE_AFTER + timedelta(days=1))
+        build_sales_rollups()
+        archive_orders()
+        # A same-day sibling changing rebuilds the day, and so does a full rebuild
+        self.order('Confirmed', ARCHIVE_AFTER + timedelta(days=1), changed=timedelta(0))
+        for full in (False, True):
+            build_sales_rollups(full=full)
+            day = SalesRollup.objects.get(period='day')
+            self.assertEqual((day.units, day.revenue), (4, Decimal('2000.00')))
+
+
+class RecommendationTests(TestCase):
+    def setUp(self):
+        import numpy as np
+
+        self.user = User.objects.create_user('buyer', password='pw')
+        category = Category.objects.create(name='Kurtis')
+        self.colors = [
+            ProductColor.objects.create(
+                product=Product.objects.create(category=category, name=name, price=500, after_discount_price=0),
+                color='Red', qty=5,
+            )
+            for name in ('Kurti', 'Dupatta', 'Leggings', 'Saree')
+        ]
+        self.product_ids = np.array([color.product_id for color in self.colors], dtype=np.int64)
+
+    def basket(self, *indexes, status='Delivered'):
+        order = Order.objects.create(
+            user=self.user, total=1060, status=status, shipping_address='Street', phone='1', pincode=600001,
+            deliverycharge=60, redeemed_points=0,
+        )
+        for i in indexes:
+            color = self.colors[i]
+            OrderItem.objects.create(order=order, product=color.product, color=color, price=500, quantity=1)
+
+    def test_pairs_are_counted_once_per_order(self):
+        self.basket(0, 1, 0)
+        self.basket(0, 1, 2)
+        self.basket(1, 2)
+        self.basket(3)
+        self.basket(0, 3, status='Pending')
+        # Batches of two orders, so the counts add up across batches
+        counts = co_occurrence_matrix(self.product_ids, batch_size=2).toarray()
+        self.assertEqual(counts.tolist(), [
+            [2, 2, 1, 0],
+            [2, 3, 2, 0],
+            [1, 2, 2, 0],
+            [0, 0, 0, 1],
+        ])
+
+    def test_products_are_not_recommended_to_themselves(self):
+        self.basket(0, 1)
+        self.basket(0)
+        recommendations = top_recommendations(co_occurrence_matrix(self.product_ids), self.product_ids)
+        self.assertEqual(
+            [(r.product_id, r.recommended_id) for r in recommendations],
+            [(self.product_ids[0], self.product_ids[1]), (self.product_ids[1], self.product_ids[0])],
+        )
+
+    def test_ranked_by_score_then_shared_orders_then_id(self):
+        from scipy import sparse
+
+        # Product 0 scores 0.5 with each of the others: 2 / sqrt(4 * 4) and 1 / sqrt(4 * 1)
+        counts = sparse.csr_matrix([
+            [4, 2, 1, 2],
+            [2, 4, 0, 0],
+            [1, 0, 1, 0],
+            [2, 0, 0, 4],
+        ])
+        ranked = [r for r in top_recommendations(counts, self.product_ids) if r.product_id == self.product_ids[0]]
+        self.assertEqual(
+            [(r.recommended_id, r.rank, r.orders_together, r.score) for r in ranked],
+            [(self.product_ids[1], 1, 2, 0.5), (self.product_ids[3], 2, 2, 0.5), (self.product_ids[2], 3, 1, 0.5)],
+        )
+        top = top_recommendations(counts, self.product_ids, top_k=2)
+        self.assertEqual(
+            [r.recommended_id for r in top if r.product_id == self.product_ids[0]], [self.product_ids[1], self.product_ids[3]],
+        )
+
+    def test_rebuild_replaces_stale_rows(self):
+        ProductRecommendation.objects.create(
+            product=self.colors[0].product, recommended=self.colors[3].product, rank=1, orders_together=9, score=1,
+        )
+        self.basket(0, 1)
+        out = StringIO()
+        call_command('build_recommendations', stdout=out)
+        self.assertEqual(
+            list(ProductRecommendation.objects.values_list('product_id', 'recommended_id', 'rank', 'orders_together')),
+            [(self.product_ids[0], self.product_ids[1], 1, 1), (self.product_ids[1], self.product_ids[0], 1, 1)],
+        )
+        self.assertIn("Stored 2 recommendation(s) for 2 product(s).", out.getvalue())
+
+
+class LoadTestCheckoutTests(TransactionTestCase):
+    # The in-process server's threads need committed data
+
+    def test_refuses_to_run_without_debug(self):
+        with self.assertRaises(CommandError):
+            call_command('load_test_checkout', users=1, stdout=StringIO())
+        self.assertFalse(User.objects.exists())
+
+    @patch('sho.routers.ReplicaRouter.db_for_read', return_value=None)
+    def test_smoke_run_cleans_up_and_leaves_the_queue(self, db_for_read):
+        queued = enqueue('tests.flaky', {'fail_times': 0})
+        out = StringIO()
+        call_command(
+            'load_test_checkout', users=2, concurrency=1, stock=5, i_know_this_is_production=True, stdout=out,
+        )
+        self.assertIn('Checkouts: 2/2 placed orders paid', out.getvalue())
+        self.assertIn('Points: 2 confirmed orders, 0 missing or wrong awards', out.getvalue())
+        for model in (User, Order, Product, Category, DeliveryZone, PointsEntry):
+            self.assertFalse(model.objects.exists(), model.__name__)
+        self.assertEqual(list(Task.objects.values_list('pk', 'status')), [(queued.pk, 'Queued')])
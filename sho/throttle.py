@@ -0,0 +1,86 @@
+import threading
+import time
+
+from django.urls import Resolver404, resolve
+
+# Requests that take money. They are admitted after browsing has been shed.
+CHECKOUT_ROUTES = {'place_order', 'razorpay_payment_success', 'razorpay_webhook'}
+# A bucket that has refilled is the same as no bucket, those are dropped past this many clients
+MAX_BUCKETS = 10000
+
+
+def route_name(request):
+    if not hasattr(request, '_route_name'):
+        try:
+            request._route_name = resolve(request.path_info).url_name
+        except Resolver404:
+            request._route_name = None
+    return request._route_name
+
+
+def route_class(request):
+    return 'checkout' if route_name(request) in CHECKOUT_ROUTES else 'browse'
+
+
+def client_key(request, proxy_count=0):
+    if request.user.is_authenticated:
+        return f'user:{request.user.pk}'
+    # Behind proxy_count proxies the client address is the one the outermost proxy appended,
+    # anything to the left of it was sent by the client and can't be trusted
+    forwarded = [ip.strip() for ip in request.META.get('HTTP_X_FORWARDED_FOR', '').split(',') if ip.strip()]
+    if proxy_count and len(forwarded) >= proxy_count:
+        return f'ip:{forwarded[-proxy_count]}'
+    return f"ip:{request.META.get('REMOTE_ADDR')}"
+
+
+class Throttle:
+    # One token bucket per (route, client). A route limited to (count, seconds) allows bursts of
+    # count requests and refills at count per seconds.
+    def __init__(self, rates, max_buckets=MAX_BUCKETS):
+        self.rates = {route: (count, count / seconds) for route, (count, seconds) in rates.items()}
+        self.max_buckets = max_buckets
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def wait(self, route, client, now=None):
+        # Seconds until the client may call the route again, 0 if this call is allowed
+        capacity, refill = self.rates[route]
+        now = time.monotonic() if now is None else now
+        key = (route, client)
+        with self.lock:
+            tokens, stamp = self.buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - stamp) * refill)
+            if tokens < 1:
+                self.buckets[key] = (tokens, now)
+                return (1 - tokens) / refill
+            if key not in self.buckets and len(self.buckets) >= self.max_buckets:
+                self.prune(now)
+            self.buckets[key] = (tokens - 1, now)
+            return 0
+
+    def prune(self, now):
+        for key, (tokens, stamp) in list(self.buckets.items()):
+            capacity, refill = self.rates[key[0]]
+            if tokens + (now - stamp) * refill >= capacity:
+                del self.buckets[key]
+
+
+class AdmissionController:
+    # Caps the requests in flight in this process. Each route class may only start while fewer
+    # than its limit are running, browsing has the lower limit so it is turned away first and the
+    # remaining workers stay free for checkout.
+    def __init__(self, limits):
+        self.limits = limits
+        self.in_flight = 0
+        self.lock = threading.Lock()
+
+    def admit(self, route_class):
+        with self.lock:
+            if self.in_flight >= self.limits[route_class]:
+                return False
+            self.in_flight += 1
+            return True
+
+    def release(self):
+        with self.lock:
+            self.in_flight -= 1
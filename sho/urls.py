@@ -1,6 +1,6 @@
-from django.urls import path
+from django.urls import path, re_path
 from django.contrib.auth import views as auth_views
-from . import views
+from . import api, views
 from .forms import BootstrapAuthenticationForm
 
 urlpatterns = [
@@ -10,13 +10,16 @@ urlpatterns = [
     path('logout/', auth_views.LogoutView.as_view(template_name='sho/home.html'), name='logout'),
     path('categories/<int:pk>/', views.category_products, name='category_products'),
     path('product_detail/<int:pk>/', views.view_product_detail, name='product_detail'),
+    path('product_detail/<int:pk>/reviews/', views.product_reviews, name='product_reviews'),
     path('cart/', views.cart_detail, name='cart_detail'),
     path('add-to-cart/<int:product_id>/', views.add_to_cart, name='add_to_cart'),
     path('remove-from-cart/<str:key>/', views.remove_from_cart, name='remove_from_cart'), 
     path('ajax/update-cart-quantity/', views.ajax_update_cart_quantity, name='ajax_update_cart_quantity'),
     path('product_detail/<int:product_id>/get-stock-quantity/<int:color_id>/',views.ajax_get_stock_quantity_of_product, name='get_stock_quantity_of_product' ),
+    path('ajax/delivery-charge/', views.ajax_delivery_charge, name='ajax_delivery_charge'),
     path('place-order/', views.place_order_and_redirect_to_razorpay, name='place_order'),
     path('razorpay-success/', views.razorpay_payment_success, name='razorpay_payment_success'),
+    path('razorpay/webhook/', views.razorpay_webhook, name='razorpay_webhook'),
     path('my-orders/', views.my_orders, name='my_orders'),
     path('about-us/', views.about_us, name='about_us'),
     path('faq/', views.faq, name='faq'),
@@ -27,5 +30,10 @@ urlpatterns = [
     path('password_reset/done/', auth_views.PasswordResetDoneView.as_view(), name='password_reset_done'),
     path('reset/<uidb64>/<token>/', auth_views.PasswordResetConfirmView.as_view(), name='password_reset_confirm'),
     path('reset/done/', auth_views.PasswordResetCompleteView.as_view(), name='password_reset_complete'),
+    path('media-staged/<path:path>', views.staged_media, name='staged_media'),
+    re_path(r'^(?P<name>sitemap(?:-products-\d+)?\.xml|feeds/products\.xml)$', views.feed_file, name='feed_file'),
+    path('api/categories/', api.api_categories, name='api_categories'),
+    path('api/categories/<int:pk>/products/', api.api_category_products, name='api_category_products'),
+    path('api/products/<int:pk>/', api.api_product, name='api_product'),
 
 ]
@@ -1,18 +1,38 @@
 
-import razorpay
 import math
+from decimal import Decimal
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth import login, authenticate
-from django.http import HttpResponse, JsonResponse
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
 from django.views.decorators.http import require_POST
 from django.views.decorators.csrf import csrf_exempt
 from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.paginator import Paginator
+from django.db import transaction
+from django.db.models import F, Sum
+from django.utils.cache import patch_vary_headers
+from django.views.static import serve
 from .forms import SignUpForm
 from .models import *
 from .cart import Cart
-
-
+from .points import points_balance
+from .delivery import delivery_quote, parse_pincode
+from .recommendations import RECOMMENDATIONS_SHOWN
+from .rankings import RANKING_SORTS, ranked_products
+from .routers import order_history_reads
+from .payments import (
+    SETTLE_EVENTS, confirm_order, razorpay_client, refusal_reason, settle_payment, verify_webhook_signature,
+)
+from .lifecycle import order_history
+from .catalog import product_card, with_cover_image
+from .feeds import feed_storage, public_path
+from .streams import response_chunks
+
+
+PRODUCTS_PER_PAGE = 24
+REVIEWS_PER_PAGE = 10
 
 # Create your views here.
 
@@ -38,17 +58,48 @@ def register(request):
 
 def category_products(request, pk):
     category = get_object_or_404(Category, pk=pk)
-    products = Product.objects.filter(category=category) 
+    sort = request.GET.get('sort', '')
+    if sort in RANKING_SORTS:
+        listing = ranked_products(category, sort)
+    else:
+        sort = ''
+        listing = Product.objects.filter(category=category).order_by('id')
+    page = Paginator(listing, PRODUCTS_PER_PAGE).get_page(request.GET.get('page'))
+    products = [ranking.product for ranking in page] if sort else page
     return render(request, 'sho/category_products.html', {
         'products': products,
-        'category': category
+        'category': category,
+        'page': page,
+        'sort': sort,
     })
 
 
 def view_product_detail(request, pk):
     product = get_object_or_404(Product, pk=pk)
+    recommendations = product.recommendations.select_related('recommended')[:RECOMMENDATIONS_SHOWN]
     return render(request, 'sho/view_product_detail.html', {
-        'product': product
+        'product': product,
+        'recommendations': recommendations,
+    })
+
+
+def product_reviews(request, pk):
+    # Fragment loaded by the product page. Keyset paging on id (?before=<last id shown>) costs the
+    # same on the last page as on the first, an OFFSET would scan every review before it.
+    reviews = ProductReview.objects.filter(product_id=pk).select_related('reviewer').order_by('-id')
+    try:
+        before = int(request.GET.get('before', ''))
+    except ValueError:
+        before = None
+    if before is not None:
+        reviews = reviews.filter(id__lt=before)
+    # One extra row tells whether there is a next page without counting
+    reviews = list(reviews[:REVIEWS_PER_PAGE + 1])
+    has_more = len(reviews) > REVIEWS_PER_PAGE
+    reviews = reviews[:REVIEWS_PER_PAGE]
+    return render(request, 'sho/product_reviews.html', {
+        'reviews': reviews,
+        'next_before': reviews[-1].id if has_more else None,
     })
 
 
@@ -81,7 +132,7 @@ def cart_detail(request):
     else:
         vip_user = False
 
-    return render(request, 'sho/cart_detail.html', {'cart_items': cart.get_items(), 'total_sum': total_sum, 'discount': discount, 'vip_user': vip_user})
+    return render(request, 'sho/cart_detail.html', {'cart_items': cart.get_items(), 'total_sum': total_sum, 'discount': discount, 'vip_user': vip_user, 'loyalty_points': points_balance(request.user)})
 
 
 @login_required(login_url='/login/')
@@ -93,7 +144,6 @@ def remove_from_cart(request, key):
 
 @login_required(login_url='/login/')
 @require_POST
-@csrf_exempt  
 def ajax_update_cart_quantity(request):
     key = request.POST.get('key')
     quantity = request.POST.get('quantity')
@@ -146,6 +196,20 @@ def ajax_get_stock_quantity_of_product(request, product_id, color_id):
 
 
 
+def ajax_delivery_charge(request):
+    pincode = parse_pincode(request.GET.get('pincode'))
+    if pincode is None:
+        return JsonResponse({'success': False, 'error': 'Enter a valid 6 digit pincode'})
+    serviceable, charge, zone = delivery_quote(pincode)
+    return JsonResponse({
+        'success': True,
+        'pincode': pincode,
+        'serviceable': serviceable,
+        'charge': charge,
+        'zone': zone,
+    })
+
+
 def has_ordered_ten_times(user: User) -> bool:
     count = Order.objects.filter(user=user, status='Confirmed').count()
     return count >= 10
@@ -158,6 +222,8 @@ def place_order_and_redirect_to_razorpay(request):
 
 
     cart = Cart(request)
+    if not cart.cart:
+        return redirect('cart_detail')
     items = []
     total = 0
     for key, item in cart.cart.items():
@@ -178,14 +244,19 @@ def place_order_and_redirect_to_razorpay(request):
         total -= discount        
 
     redeem_points = int(request.POST.get('redeem_points_in_modal', '0'))
-    redeem_points = min(redeem_points, request.user.profile.loyaltypoints, total)
+    redeem_points = max(0, int(min(redeem_points, points_balance(request.user), total)))
 
     total -= redeem_points
 
     if not address or not phone:
         return redirect('cart_detail')
 
-    deliverycharge = 60 if int(pincode) > 600000 and int(pincode) < 699999 else 90
+    pincode = parse_pincode(pincode)
+    if pincode is None:
+        return redirect('cart_detail')
+    serviceable, deliverycharge, _ = delivery_quote(pincode)
+    if not serviceable:
+        return redirect('cart_detail')
 
     total += deliverycharge
 
@@ -198,22 +269,34 @@ def place_order_and_redirect_to_razorpay(request):
     
     total = math.ceil(total)
    
-    # 1. Create your local pending Order
-    order = Order.objects.create(
-        user=request.user,
-        total=total,
-        shipping_address=address,
-        phone=phone,
-        pincode=pincode,
-        deliverycharge=deliverycharge,
-        status='Pending',
-        redeemed_points=redeem_points
-    )
+    # 1. Create your local pending Order, with its items, so the payment can be settled without
+    # the session (webhook, reconciliation)
+    with transaction.atomic():
+        order = Order.objects.create(
+            user=request.user,
+            total=total,
+            shipping_address=address,
+            phone=phone,
+            pincode=pincode,
+            deliverycharge=deliverycharge,
+            status='Pending',
+            redeemed_points=redeem_points
+        )
+        OrderItem.objects.bulk_create([
+            OrderItem(
+                order=order,
+                product_id=item['product_id'],
+                color_id=item['color_id'],
+                price=item['price'],
+                quantity=item['quantity']
+            )
+            for item in items
+        ])
 
     amount_paise = total * 100  # Razorpay expects amounts in paise
 
     # 2. Create order in Razorpay
-    client = razorpay.Client(auth=(settings.RAZORPAY_KEY_ID, settings.RAZORPAY_KEY_SECRET))
+    client = razorpay_client()
     razorpay_order = client.order.create({
         'amount': amount_paise,
         'currency': 'INR',
@@ -243,7 +326,6 @@ def place_order_and_redirect_to_razorpay(request):
 @csrf_exempt
 def razorpay_payment_success(request):
     import json
-    from django.utils import timezone
 
     if request.method == 'POST':
         data = json.loads(request.body)
@@ -253,7 +335,7 @@ def razorpay_payment_success(request):
         order_id = data.get('order_id')
 
         # Verify signature
-        client = razorpay.Client(auth=(settings.RAZORPAY_KEY_ID, settings.RAZORPAY_KEY_SECRET))
+        client = razorpay_client()
         try:
             params_dict = {
                 'razorpay_order_id': razorpay_order_id,
@@ -262,51 +344,43 @@ def razorpay_payment_success(request):
             }
             client.utility.verify_payment_signature(params_dict)
 
+            # The webhook may already have confirmed the order, confirm_order is a no-op then
             order = Order.objects.get(pk=order_id, razorpay_order_id=razorpay_order_id)
-            order.status = 'Confirmed'
-            order.save()
-
-            if not request.user.profile.first_order_offer_used:
-                request.user.profile.first_order_offer_used = True
-                request.user.profile.save()
-
-            # Move items from Cart to OrderItem
-            cart = Cart(request)
-            points_earned = 0
-            for key, item in cart.cart.items():
-                product = Product.objects.get(id=item['product_id'])
-                color = ProductColor.objects.get(id=item['color_id'])
-                OrderItem.objects.create(
-                    order=order,
-                    product=product,
-                    color=color,
-                    price=item['price'],
-                    quantity=item['quantity']
-                )
-                color.qty -= item['quantity']
-                points_earned += (item['quantity'] * item['price']) * 0.01
-                color.save()
-            cart.clear()
-
-            if order.redeemed_points > 0:
-                request.user.profile.loyaltypoints -= order.redeemed_points 
-
-            request.user.profile.loyaltypoints += points_earned
-            request.user.profile.save()
-            
-            print("it is success", points_earned)
+            order, confirmed = confirm_order(order.id, razorpay_payment_id)
+            # Refused (points spent in another tab, order cancelled): the cart stays for another try
+            reason = None if confirmed else refusal_reason(order, razorpay_payment_id)
+            if reason:
+                return JsonResponse({'success': False, 'error': reason})
+            Cart(request).clear()
+
+            spent = order.items.aggregate(total=Sum(F('price') * F('quantity')))['total'] or 0
+            points_earned = Decimal(spent) / 100
             return JsonResponse({'success': True, 'points_earned': float(points_earned)})
         except Exception as e:
             return JsonResponse({'success': False, 'error': str(e)})
     return JsonResponse({'success': False, 'error': 'Invalid request'})
 
 
+@csrf_exempt
+@require_POST
+def razorpay_webhook(request):
+    import json
+
+    if not verify_webhook_signature(request.body, request.headers.get('X-Razorpay-Signature')):
+        return HttpResponse(status=400)
+    event = json.loads(request.body)
+    if event.get('event') in SETTLE_EVENTS:
+        settle_payment(event['payload']['payment']['entity'])
+    # Always 200 once the signature checks out, Razorpay retries anything else
+    return JsonResponse({'status': 'ok'})
+
+
 @login_required(login_url='/login/')
 def my_orders(request):
-    # Get all orders of the logged-in user, newest first
-    orders = Order.objects.filter(user=request.user).order_by('-created_at').prefetch_related('items__product', 'items__color')
-    
-    return render(request, 'sho/my_orders.html', {'orders': orders})
+    # All orders of the logged-in user, live and archived, newest first
+    with order_history_reads():
+        orders = order_history(request.user)
+        return render(request, 'sho/my_orders.html', {'orders': orders, 'loyalty_points': points_balance(request.user)})
 
 
 def about_us(request):
@@ -320,8 +394,9 @@ def faq(request):
 @login_required(login_url='/login/')
 def wishlist_view(request):
     wishlist, _ = Wishlist.objects.get_or_create(user=request.user)
-    items = wishlist.items.select_related('product').all()
-    return render(request, 'sho/wishlist.html', {'wishlist_items': items})
+    # Cover images come with the products, not one query per card
+    products = with_cover_image(Product.objects.filter(wishlistitem__wishlist=wishlist)).order_by('wishlistitem__id')
+    return render(request, 'sho/wishlist.html', {'wishlist_items': [product_card(product) for product in products]})
 
 
 @login_required(login_url='/login/')
@@ -336,4 +411,32 @@ def ajax_add_to_wishlist(request, product_id_duplicate, product_id):
 def remove_from_wishlist(request, product_id):
     wishlist = get_object_or_404(Wishlist, user=request.user)
     WishlistItem.objects.filter(wishlist=wishlist, product_id=product_id).delete()
-    return redirect('wishlist')
\ No newline at end of file
+    return redirect('wishlist')
+
+
+def staged_media(request, path):
+    # Uploads not yet confirmed on S3 (OffloadedStorage) are served from local disk
+    local = getattr(default_storage, 'local', None)
+    if local is not None and local.exists(path):
+        return serve(request, path, document_root=local.location)
+    return redirect(default_storage.url(path))
+
+
+def file_chunks(content):
+    with content:
+        yield from content.chunks()
+
+
+def feed_file(request, name):
+    # Sitemaps and the product feed, read from the feeds storage that build_product_feeds writes to
+    gzipped = 'gzip' in request.headers.get('Accept-Encoding', '')
+    try:
+        content = feed_storage().open(public_path(name + '.gz' if gzipped else name), 'rb')
+    except FileNotFoundError:
+        raise Http404(name)
+    response = StreamingHttpResponse(response_chunks(request, file_chunks(content)), content_type='application/xml')
+    response['Content-Length'] = content.size
+    if gzipped:
+        response['Content-Encoding'] = 'gzip'
+    patch_vary_headers(response, ['Accept-Encoding'])
+    return response
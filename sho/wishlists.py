@@ -0,0 +1,153 @@
+from django.contrib.auth.models import User
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import transaction
+from django.db.models import F, OuterRef, Q, Subquery
+from django.template.loader import render_to_string
+from django.urls import reverse
+
+from .catalog import product_card, with_cover_image
+from .feeds import absolute_url
+from .models import ColorSnapshot, Product, ProductColor, ProductSnapshot, WishlistItem
+from .taskqueue import enqueue
+
+SNAPSHOT_BATCH_SIZE = 1000
+# Shoppers per queued task, each task renders their mails and writes them to the outbox in one insert
+ALERT_BATCH_USERS = 500
+ALERT_SUBJECT = 'Good news about your Hana Fashion wishlist'
+
+
+def restocked_colors():
+    # Out of stock at the last run, in stock now
+    return ProductColor.objects.filter(qty__gt=0, snapshot__qty__lte=0)
+
+
+def price_drops():
+    return Product.objects.filter(price__lt=F('snapshot__price'))
+
+
+def catalog_changes():
+    restocked = list(restocked_colors().values_list('pk', 'product_id', 'color', 'qty'))
+    drops = list(price_drops().values_list('pk', 'snapshot__price', 'price'))
+    # JSON task payloads: string keys, whole rupees
+    changes = {}
+    for _, product_id, color, _ in restocked:
+        change = changes.setdefault(str(product_id), {'restocked': []})
+        if color:
+            change['restocked'].append(color)
+    for product_id, old_price, new_price in drops:
+        changes.setdefault(str(product_id), {}).update(old_price=int(old_price), new_price=int(new_price))
+    return restocked, drops, changes
+
+
+def wishlist_matches():
+    # Every (user, product) pair with a change, one query streamed in user order. It joins on the
+    # same conditions as catalog_changes() rather than on a list of ids, which may be long.
+    changed = Q(product__in=price_drops().values('pk')) | Q(product__in=restocked_colors().values('product_id'))
+    return (
+        WishlistItem.objects
+        .filter(changed)
+        .exclude(wishlist__user__email='')
+        .order_by('wishlist_id', 'product_id')
+        .values_list('wishlist__user_id', 'product_id')
+        .iterator(chunk_size=SNAPSHOT_BATCH_SIZE)
+    )
+
+
+def alert_batches(changes, batch_users=ALERT_BATCH_USERS):
+    batch = []
+    for user_id, product_id in wishlist_matches():
+        # Changed after catalog_changes() read them, those are alerted on the next run
+        if str(product_id) not in changes:
+            continue
+        if batch and batch[-1][0] == user_id:
+            batch[-1][1].append(product_id)
+            continue
+        if len(batch) == batch_users:
+            yield batch
+            batch = []
+        batch.append([user_id, [product_id]])
+    if batch:
+        yield batch
+
+
+def refresh_snapshots(restocked, drops):
+    # Alerted rows take the values the alerts were made from
+    ColorSnapshot.objects.bulk_update(
+        [ColorSnapshot(color_id=color_id, qty=qty) for color_id, _, _, qty in restocked], ['qty'],
+        batch_size=SNAPSHOT_BATCH_SIZE,
+    )
+    ProductSnapshot.objects.bulk_update(
+        [ProductSnapshot(product_id=product_id, price=price) for product_id, _, price in drops], ['price'],
+        batch_size=SNAPSHOT_BATCH_SIZE,
+    )
+    # Changes that never alert are taken as they are now. A restock or price drop that happened
+    # after catalog_changes() is left in place for the next run to find.
+    ColorSnapshot.objects.exclude(qty=F('color__qty')).exclude(qty__lte=0, color__qty__gt=0).update(
+        qty=Subquery(ProductColor.objects.filter(pk=OuterRef('color_id')).values('qty')[:1]),
+    )
+    ProductSnapshot.objects.filter(product__price__gt=F('price')).update(
+        price=Subquery(Product.objects.filter(pk=OuterRef('product_id')).values('price')[:1]),
+    )
+    # New products and colors start from their current state, without an alert
+    ColorSnapshot.objects.bulk_create(
+        (
+            ColorSnapshot(color_id=color_id, qty=qty)
+            for color_id, qty in ProductColor.objects.filter(snapshot__isnull=True).values_list('pk', 'qty')
+            .iterator(chunk_size=SNAPSHOT_BATCH_SIZE)
+        ),
+        batch_size=SNAPSHOT_BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+    ProductSnapshot.objects.bulk_create(
+        (
+            ProductSnapshot(product_id=product_id, price=price)
+            for product_id, price in Product.objects.filter(snapshot__isnull=True).values_list('pk', 'price')
+            .iterator(chunk_size=SNAPSHOT_BATCH_SIZE)
+        ),
+        batch_size=SNAPSHOT_BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+
+
+def queue_wishlist_alerts(batch_users=ALERT_BATCH_USERS):
+    # The queued tasks and the new snapshots commit together: a failed run is retried in full
+    # instead of alerting twice or not at all
+    users = 0
+    with transaction.atomic():
+        restocked, drops, changes = catalog_changes()
+        if changes:
+            for batch in alert_batches(changes, batch_users):
+                product_ids = {str(product_id) for _, product_ids in batch for product_id in product_ids}
+                enqueue('wishlist.send_alerts', {
+                    'alerts': batch,
+                    'changes': {product_id: changes[product_id] for product_id in product_ids},
+                })
+                users += len(batch)
+        refresh_snapshots(restocked, drops)
+    return len(restocked), len(drops), users
+
+
+def send_alerts(alerts, changes):
+    users = User.objects.in_bulk([user_id for user_id, _ in alerts])
+    product_ids = {product_id for _, product_ids in alerts for product_id in product_ids}
+    cards = {product.id: product_card(product) for product in with_cover_image(Product.objects.filter(pk__in=product_ids))}
+
+    messages = []
+    for user_id, product_ids in alerts:
+        user = users.get(user_id)
+        items = [
+            dict(cards[product_id], **changes[str(product_id)],
+                 url=absolute_url(reverse('product_detail', args=[product_id])))
+            for product_id in product_ids if product_id in cards
+        ]
+        if not user or not user.email or not items:
+            continue
+        context = {'user': user, 'items': items}
+        message = EmailMultiAlternatives(
+            ALERT_SUBJECT, render_to_string('sho/wishlist_alert_email.txt', context), to=[user.email],
+        )
+        message.attach_alternative(render_to_string('sho/wishlist_alert_email.html', context), 'text/html')
+        messages.append(message)
+    # With the outbox backend this is one INSERT for the whole batch
+    get_connection().send_messages(messages)
+    return len(messages)